@@ -0,0 +1,78 @@
+"""
+Микробенчмарк классификатора игровых сообщений.
+
+Сравнивает стоимость разметки одного события общим классификатором
+с прежней цепочкой отдельных custom_filters из handlers.py.
+
+Запуск: python -m benchmarks.bench_classifier
+"""
+
+import re
+import timeit
+
+from bot.classifier import classify
+
+MESSAGES = [
+    "Получено: ✅2*Меч силы: [id555|Вася] =&gt; [id100|Петя]",
+    "Игрок продает через аукцион:\n"
+    + "\n".join(
+        f"{i}*предмет {i} - {i * 10} золота ({1000 + i})" for i in range(1, 30)
+    ),
+    "Вы готовитесь к рыбалке...",
+    "Карта озера активирована",
+    "Вы успешно выловили рыбу! Окунь (1.25 кг) продан в 40 золота",
+    "[id100|Петя], Вы успешно приобрели с аукциона предмет 3*Меч силы - 300 золота потрачено",
+    "Обычное сообщение в чате, которое не относится к игре",
+]
+
+
+def legacy_parse_item_message(message):
+    item_regex = re.compile(
+        r"(Получено|Отправлено):.{2}(\d*\*?)?(\S.+\S): \[id(\d+)\|[^]]+] =&gt; \[id(\d+)\|[^]]+]"
+    )
+    return item_regex.match(message)
+
+
+def legacy_auction_lots(text):
+    pattern = re.compile(r"(\d+)\s*\*\s*([^\*-]+?)\s*-\s*(\d+)\s*золота\s*\((\d+)\)")
+    return [pattern.search(line) for line in text.lower().split("\n")]
+
+
+# Фильтры в том виде и порядке, в котором они регистрировались до классификатора
+LEGACY_FILTERS = [
+    lambda text: legacy_parse_item_message(text),
+    lambda text: "продает через аукцион" in text.lower() and legacy_auction_lots(text),
+    lambda text: "вы готовитесь к рыбалке" in text.lower(),
+    lambda text: "карта озера активирована" in text.lower(),
+    lambda text: "вы успешно выловили рыбу!" in text.lower()
+    and re.search(r"\(([\d.]+)\s*кг\).*в\s(\d+)\sзолота", text),
+    lambda text: "успешно приобрели с аукциона предмет" in text.lower()
+    and re.search(
+        r"\[id(\d+)\|.*?\], Вы успешно приобрели с аукциона предмет (\d+)\*(.+?)\s*-\s*\d+ золота потрачено",
+        text,
+    ),
+]
+
+
+def run_legacy(text):
+    for legacy_filter in LEGACY_FILTERS:
+        legacy_filter(text)
+
+
+def run_classifier(text):
+    classify(text, text.lower())
+
+
+def main(number: int = 20000):
+    for text in MESSAGES:
+        print(text.split("\n", 1)[0][:60])
+        for name, func in (
+            ("legacy filters", run_legacy),
+            ("classifier", run_classifier),
+        ):
+            best = min(timeit.repeat(lambda: func(text), number=number, repeat=5))
+            print(f"  {name:>15}: {best / number * 1e6:.2f} мкс на событие")
+
+
+if __name__ == "__main__":
+    main()
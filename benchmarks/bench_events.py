@@ -0,0 +1,134 @@
+"""
+Микробенчмарк разбора ответа long poll.
+
+Сравнивает прежний путь (vk_api.longpoll.Event для каждого события с
+последующим отбором новых сообщений) с bot.event.parse_messages: время
+разбора, количество и объем выделений памяти по данным tracemalloc и
+память, удерживаемую событиями, ожидающими обработки.
+
+Ответ сервера собран из типичной смеси событий: новые сообщения в беседах
+и личных сообщениях, прочтения, набор текста, счетчики и статусы онлайн.
+
+Запуск: python -m benchmarks.bench_events
+"""
+
+import argparse
+import gc
+import time
+import timeit
+import tracemalloc
+from typing import Callable, List, Sequence, Tuple
+
+from vk_api.longpoll import Event, VkEventType
+
+from bot.event import parse_messages
+
+CHAT_TEXT = "Игрок продает через аукцион:<br>" + "<br>".join(
+    f"{i}*предмет {i} - {i * 10} золота ({1000 + i})" for i in range(1, 10)
+)
+
+
+def make_updates(size: int) -> List[List]:
+    """
+    Собирает ответ long poll заданного размера.
+
+    Args:
+        size (int): Количество событий.
+
+    Returns:
+        List[List]: События в формате long poll.
+    """
+    updates = []
+    now = int(time.time())
+    for i in range(size):
+        message_id = 1000 + i
+        variant = i % 10
+        if variant < 4:
+            updates.append(
+                [4, message_id, 532481, 2000000001, now, CHAT_TEXT, {"from": "555"}, {}]
+            )
+        elif variant == 4:
+            updates.append([4, message_id, 17, 100, now, "скуп", {}, {}])
+        elif variant == 5:
+            updates.append([7, 2000000001, message_id, 0])
+        elif variant == 6:
+            updates.append([63, 2000000001, [555], 1, now])
+        elif variant == 7:
+            updates.append([80, i, 0])
+        elif variant == 8:
+            updates.append([8, -555, 7, now, 0])
+        else:
+            updates.append([2, message_id, 128, 2000000001])
+    return updates
+
+
+def legacy_parse(updates: Sequence[List], received_at: float) -> Tuple[Event, ...]:
+    pending = []
+    for event in [Event(raw) for raw in updates]:
+        if event.type == VkEventType.MESSAGE_NEW and event.text.lower():
+            event.received_at = received_at
+            pending.append(event)
+    return tuple(pending)
+
+
+def measure_memory(
+    parse: Callable[[Sequence[List], float], tuple], updates: Sequence[List]
+) -> Tuple[int, int, int]:
+    """
+    Замер памяти одного разбора.
+
+    Args:
+        parse (Callable): Функция разбора.
+        updates (Sequence[List]): Ответ long poll.
+
+    Returns:
+        Tuple[int, int, int]: Пиковый объем выделенной памяти, объем памяти,
+            удерживаемой результатом, в байтах и количество удерживаемых блоков.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = parse(updates, 0.0)
+        for event in result:
+            # Обработчики читают текст каждого события
+            event.text
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    stats = snapshot.statistics("filename")
+    retained = sum(stat.size for stat in stats)
+    blocks = sum(stat.count for stat in stats)
+    del result
+    return peak, retained, blocks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--size", type=int, default=100, help="событий в ответе")
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    updates = make_updates(args.size)
+    messages = len(parse_messages(updates))
+    print(f"Событий в ответе: {args.size}, из них новых сообщений: {messages}")
+    print(
+        f"{'путь':<16} {'мкс/ответ':>10} {'пик, КБ':>9} "
+        f"{'удерж., Б/сообщ.':>17} {'блоков/сообщ.':>14}"
+    )
+    for name, parse in (
+        ("vk_api Event", legacy_parse),
+        ("parse_messages", parse_messages),
+    ):
+        seconds = timeit.timeit(
+            lambda: [event.text for event in parse(updates, 0.0)], number=args.number
+        )
+        peak, retained, blocks = measure_memory(parse, updates)
+        print(
+            f"{name:<16} {seconds / args.number * 1e6:>10.1f} {peak / 1024:>9.1f} "
+            f"{retained / messages:>17.0f} {blocks / messages:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
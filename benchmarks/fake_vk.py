@@ -0,0 +1,96 @@
+"""
+Заглушка VK API для бенчмарков: все вызовы обслуживаются в процессе, без сети.
+"""
+
+import itertools
+import re
+import time
+from typing import Any, Dict, Optional
+
+from vk_api.longpoll import VkEventType
+
+from bot.event import MessageEvent
+
+EXECUTE_CALL_PATTERN = re.compile(r"API\.messages\.send\((\{.*?\})\)")
+
+
+class FakeVkApi:
+    """
+    Минимальная замена vk_api.VkApi для Bot и VkLongPoll.
+
+    messages.send и execute возвращают новые ID сообщений, messages.getById -
+    сообщение без пересланных сообщений или заранее заданное через messages.
+    """
+
+    api_version = "5.92"
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+        self.sent = 0
+        self.messages: Dict[int, Dict] = {}
+        self._message_ids = itertools.count(1)
+
+    def method(
+        self, method: str, values: Optional[Dict] = None, raw: bool = False, **kwargs
+    ) -> Any:
+        values = values or {}
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "messages.send":
+            self.sent += 1
+            response = next(self._message_ids)
+        elif method == "execute":
+            calls = EXECUTE_CALL_PATTERN.findall(values["code"])
+            self.sent += len(calls)
+            response = [next(self._message_ids) for _ in calls]
+        elif method == "messages.getById":
+            message_id = int(values["message_ids"])
+            response = {
+                "items": [
+                    self.messages.get(
+                        message_id, {"id": message_id, "fwd_messages": []}
+                    )
+                ]
+            }
+        elif method == "messages.getLongPollServer":
+            response = {"key": "key", "server": "localhost", "ts": 1, "pts": 1}
+        else:
+            response = {}
+        return {"response": response} if raw else response
+
+    def get_api(self):
+        return None
+
+
+def make_event(
+    peer_id: int,
+    text: str,
+    from_id: Optional[int] = None,
+    message_id: int = 1,
+    timestamp: Optional[int] = None,
+) -> MessageEvent:
+    """
+    Собирает событие нового сообщения в формате long poll.
+
+    Args:
+        peer_id (int): ID диалога.
+        text (str): Текст сообщения.
+        from_id (Optional[int]): Автор сообщения в беседе.
+        message_id (int): ID сообщения.
+        timestamp (Optional[int]): Время сообщения, по умолчанию текущее.
+
+    Returns:
+        MessageEvent: Событие long poll.
+    """
+    extra = {"from": str(from_id)} if from_id is not None else {}
+    return MessageEvent(
+        [
+            VkEventType.MESSAGE_NEW.value,
+            message_id,
+            1,
+            peer_id,
+            timestamp or int(time.time()),
+            text,
+            extra,
+            {},
+        ]
+    )
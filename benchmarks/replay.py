@@ -0,0 +1,179 @@
+"""
+Воспроизведение журнала событий long poll через настоящие обработчики.
+
+События из журнала (bot.journal) подаются в Bot с обработчиками
+register_handlers во временном рабочем каталоге с отдельной базой данных.
+Вызовы VK API обслуживает заглушка (benchmarks.fake_vk), сообщения не
+отправляются, а сохраняются и выводятся после воспроизведения.
+
+По умолчанию события подаются без пауз. С --speed события подаются с
+исходными интервалами, ускоренными в заданное число раз.
+
+Запуск:
+    python -m benchmarks.replay configs/bot.ini data/journal/bot
+    python -m benchmarks.replay configs/bot.ini data/journal/bot --speed 1
+    python -m benchmarks.replay configs/bot.ini data/journal/bot --sent sent.json --profile replay.prof
+"""
+
+import argparse
+import configparser
+import cProfile
+import json
+import os
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from benchmarks.fake_vk import FakeVkApi
+from benchmarks.suite import workspace
+from bot import Bot, register_handlers
+from bot.event import parse_messages
+from bot.journal import read_journal
+from bot.sender import Priority
+
+
+class ReplayBot(Bot):
+    """
+    Bot, сохраняющий отправляемые сообщения вместо отправки.
+    """
+
+    def __init__(self):
+        super().__init__("replay", name="replay", vk_session=FakeVkApi())
+        self.sender.close()
+        self.sent: List[Dict[str, Any]] = []
+
+    def send(
+        self,
+        chat: int,
+        text: str,
+        reply_id: Optional[int] = None,
+        forward_messages: Optional[List[int]] = None,
+        priority: Priority = Priority.NORMAL,
+        wait: bool = True,
+    ) -> Union[int, Future]:
+        self.sent.append(
+            {
+                "peer_id": chat,
+                "message": text,
+                "reply_to": reply_id,
+                "forward_messages": forward_messages,
+                "priority": Priority(priority).name,
+            }
+        )
+        message_id = len(self.sent)
+        if wait:
+            return message_id
+        future: Future = Future()
+        future.set_result(message_id)
+        return future
+
+
+def replay(
+    config: configparser.ConfigParser,
+    paths: Sequence[str],
+    speed: float = 0.0,
+    profiler: Optional[cProfile.Profile] = None,
+) -> Dict[str, Any]:
+    """
+    Воспроизводит журнал.
+
+    Args:
+        config (configparser.ConfigParser): Конфиг бота, чей журнал воспроизводится.
+        paths (Sequence[str]): Сегменты журнала или каталоги сегментов.
+        speed (float): Ускорение относительно записанных интервалов, 0 - без пауз.
+        profiler (Optional[cProfile.Profile]): Профилировщик, включаемый только
+            на время подачи событий.
+
+    Returns:
+        Dict[str, Any]: Счетчики событий, задержки обработки и отправленные сообщения.
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    with workspace():
+        bot = ReplayBot()
+        register_handlers(bot, config)
+
+        records = messages = handled = 0
+        samples: List[float] = []
+        first_received_at = None
+        replay_started = time.monotonic()
+        if profiler is not None:
+            profiler.enable()
+        for received_at, update in read_journal(paths):
+            records += 1
+            if speed:
+                if first_received_at is None:
+                    first_received_at = received_at
+                delay = (
+                    replay_started
+                    + (received_at - first_received_at) / speed
+                    - time.monotonic()
+                )
+                if delay > 0:
+                    time.sleep(delay)
+            for event in parse_messages([update], time.time()):
+                messages += 1
+                started = time.perf_counter()
+                handled += bot._process_event(event)
+                samples.append(time.perf_counter() - started)
+        if profiler is not None:
+            profiler.disable()
+        elapsed = time.monotonic() - replay_started
+        bot._shutdown()
+
+    samples.sort()
+    return {
+        "records": records,
+        "messages": messages,
+        "handled": handled,
+        "sent": len(bot.sent),
+        "elapsed_s": elapsed,
+        "messages_per_sec": messages / elapsed if elapsed else 0.0,
+        "p50_us": samples[int(0.5 * (len(samples) - 1))] * 1e6 if samples else 0.0,
+        "p99_us": samples[int(0.99 * (len(samples) - 1))] * 1e6 if samples else 0.0,
+        "sent_messages": bot.sent,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("config", help="конфиг бота из каталога configs")
+    parser.add_argument("journal", nargs="+", help="сегменты или каталог журнала")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0.0,
+        help="ускорение относительно записанных интервалов, 0 - без пауз",
+    )
+    parser.add_argument("--sent", help="файл JSON для отправленных сообщений")
+    parser.add_argument("--profile", help="файл статистики cProfile")
+    args = parser.parse_args(argv)
+
+    config = configparser.ConfigParser()
+    if not config.read(args.config):
+        parser.error(f"конфиг {args.config} не найден")
+    profiler = cProfile.Profile() if args.profile else None
+
+    result = replay(config, args.journal, args.speed, profiler)
+    sent_messages = result.pop("sent_messages")
+
+    print(
+        f"Записей: {result['records']}, сообщений: {result['messages']}, "
+        f"обработано: {result['handled']}, отправлено: {result['sent']}"
+    )
+    print(
+        f"Время: {result['elapsed_s']:.2f} с, {result['messages_per_sec']:.0f} сообщений/с, "
+        f"p50 {result['p50_us']:.1f} мкс, p99 {result['p99_us']:.1f} мкс"
+    )
+    if args.sent:
+        with open(args.sent, "w", encoding="utf-8") as file:
+            json.dump(sent_messages, file, ensure_ascii=False, indent=2)
+    else:
+        for message in sent_messages:
+            print(f"-> {message['peer_id']}: {message['message']}")
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,459 @@
+"""
+Набор бенчмарков горячих путей бота с проверкой на регрессии.
+
+Бенчмарки запускают настоящие Bot и register_handlers с заглушкой VK API
+(benchmarks.fake_vk) и временной базой данных. Для каждого случая
+измеряются операции в секунду и задержки p50/p99 одной операции.
+
+Результаты пишутся в JSON и сравниваются с базовым файлом: при падении
+скорости или росте p50 сверх допуска процесс завершается с кодом 1.
+Базовый файл зависит от машины и в репозиторий не добавляется: его
+создают на той же машине с флагом --update-baseline. Без базового файла
+проверка не считается пройденной, и процесс завершается с кодом 2.
+
+Запуск:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --update-baseline
+    python -m benchmarks.suite --filter db. --stats-rows 20000
+"""
+
+import argparse
+import configparser
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from benchmarks.fake_vk import FakeVkApi, make_event
+from bot import Bot, register_handlers
+from bot.classifier import (
+    AUCTION_BOUGHT_PATTERN,
+    FISH_CAUGHT_PATTERN,
+    classify,
+    parse_auction_lots,
+    parse_item_message,
+)
+from bot.db import DatabaseHandler, FishingEventType
+from bot.sender import SendScheduler
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT = "bench_results.json"
+DEFAULT_BASELINE = os.path.join("benchmarks", "baseline.json")
+
+USER_ID = 100
+OTHER_USER_ID = 555
+MAIN_CHAT_ID = 2000000001
+STORAGE_CHAT_ID = 2000000002
+
+ITEM_MESSAGE = "Получено: ✅2*Меч силы: [id555|Вася] =&gt; [id100|Петя]"
+AUCTION_POST = "Игрок продает через аукцион:\n" + "\n".join(
+    f"{i}*предмет {i} - {i * 10} золота ({1000 + i})" for i in range(1, 50)
+)
+FISH_MESSAGE = "Вы успешно выловили рыбу! Окунь (1.25 кг) продан в 40 золота"
+BOUGHT_MESSAGE = (
+    "[id100|Петя], Вы успешно приобрели с аукциона предмет "
+    "3*Меч силы - 300 золота потрачено"
+)
+NOISE_MESSAGE = "Обычное сообщение в чате, которое не относится к игре"
+
+
+def measure(
+    func: Callable[[int], object], iterations: int, warmup: int = 100
+) -> Dict[str, float]:
+    """
+    Замер одной операции.
+
+    :param func: Операция, получает номер итерации.
+    :param iterations: Количество замеряемых вызовов.
+    :param warmup: Количество вызовов для прогрева, не попадающих в замер.
+    :return: Количество вызовов, операций в секунду и задержки p50/p99 в микросекундах.
+    """
+    for i in range(warmup):
+        func(-i - 1)
+    samples: List[float] = []
+    perf_counter = time.perf_counter
+    started = perf_counter()
+    for i in range(iterations):
+        operation_started = perf_counter()
+        func(i)
+        samples.append(perf_counter() - operation_started)
+    total = perf_counter() - started
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "ops_per_sec": iterations / total,
+        "p50_us": samples[int(0.5 * (len(samples) - 1))] * 1e6,
+        "p99_us": samples[int(0.99 * (len(samples) - 1))] * 1e6,
+    }
+
+
+@contextlib.contextmanager
+def workspace() -> Iterator[str]:
+    """
+    Временный рабочий каталог с глобальным конфигом и отдельной базой данных.
+
+    Обработчики читают bot/global_config.ini относительно текущего каталога,
+    поэтому бенчмарк переходит во временный каталог с копией конфига,
+    в которой база данных вынесена туда же, а вывод метрик, журнал событий
+    и политика хранения статистики отключены.
+    """
+    directory = tempfile.mkdtemp(prefix="bench-")
+    global_config = configparser.ConfigParser()
+    global_config.read(os.path.join(REPO_ROOT, "bot", "global_config.ini"))
+    if not global_config.has_section("DATABASE"):
+        global_config.add_section("DATABASE")
+    global_config.set("DATABASE", "path", os.path.join(directory, "bench.db"))
+    if not global_config.has_section("METRICS"):
+        global_config.add_section("METRICS")
+    global_config.set("METRICS", "enabled", "false")
+    if not global_config.has_section("JOURNAL"):
+        global_config.add_section("JOURNAL")
+    global_config.set("JOURNAL", "enabled", "false")
+    if not global_config.has_section("RETENTION"):
+        global_config.add_section("RETENTION")
+    global_config.set("RETENTION", "enabled", "false")
+    os.makedirs(os.path.join(directory, "bot"))
+    with open(os.path.join(directory, "bot", "global_config.ini"), "w") as file:
+        global_config.write(file)
+
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield directory
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def create_bot() -> Bot:
+    """
+    Бот с заглушкой VK API и зарегистрированными обработчиками.
+
+    Ограничение скорости отправки снято, чтобы замер показывал
+    стоимость обработки, а не ожидание лимита VK.
+    """
+    session = FakeVkApi()
+    bot = Bot("bench", name="bench", vk_session=session)
+    bot.sender.close()
+    bot.sender = SendScheduler(session, rate=1e9, burst=1e9, name="sender-bench")
+
+    config = configparser.ConfigParser()
+    config.read_dict(
+        {
+            "PERSONAL": {
+                "token": "bench",
+                "user_id": str(USER_ID),
+                "main_chat_id": str(MAIN_CHAT_ID),
+                "storage_chat_id": str(STORAGE_CHAT_ID),
+            }
+        }
+    )
+    register_handlers(bot, config)
+    # Включение сбора статистики, как это делает пользователь командой
+    bot._handle_event(make_event(USER_ID, "+статистика"))
+    return bot
+
+
+def fill_stats(db: DatabaseHandler, rows: int, days: int = 90) -> None:
+    """
+    Заполнение FishingEvent и FishCatch синтетическими строками рыбалки
+    за последние days дней.
+    """
+    rng = random.Random(42)
+    now = int(time.time())
+    events, catches = [], []
+    for _ in range(rows):
+        ts = now - rng.randint(0, days * 86400)
+        kind = rng.randrange(3)
+        if kind < 2:
+            events.append((USER_ID, ts, FishingEventType(kind + 1)))
+        else:
+            catches.append((USER_ID, ts, rng.randint(100, 5000), rng.randint(10, 100)))
+        if len(events) + len(catches) == 5000:
+            db.add_fishing_records(events, catches)
+            events, catches = [], []
+    if events or catches:
+        db.add_fishing_records(events, catches)
+
+
+def bench_parsers(iterations: int) -> Dict[str, Dict[str, float]]:
+    auction_lower = AUCTION_POST.lower()
+    fish_lower = FISH_MESSAGE.lower()
+    bought_lower = BOUGHT_MESSAGE.lower()
+    return {
+        "parse.item_message": measure(
+            lambda i: parse_item_message(ITEM_MESSAGE), iterations
+        ),
+        "parse.auction_lots": measure(
+            lambda i: parse_auction_lots(auction_lower), iterations
+        ),
+        "parse.fish_caught": measure(
+            lambda i: FISH_CAUGHT_PATTERN.search(fish_lower), iterations
+        ),
+        "parse.auction_bought": measure(
+            lambda i: AUCTION_BOUGHT_PATTERN.search(bought_lower), iterations
+        ),
+        "parse.classify_noise": measure(
+            lambda i: classify(NOISE_MESSAGE, NOISE_MESSAGE.lower()), iterations
+        ),
+    }
+
+
+def bench_dispatch(bot: Bot, iterations: int) -> Dict[str, Dict[str, float]]:
+    constants = configparser.ConfigParser()
+    constants.read(os.path.join("bot", "global_config.ini"))
+    game_group_id = int(constants["CONSTANTS"]["game_group_id"])
+    transfer_bot_id = int(constants["CONSTANTS"]["transfer_bot_id"])
+
+    # Цена выше цены лотов: каждый пост аукциона приводит к покупкам
+    bot._handle_event(make_event(USER_ID, "предмет 1000 золота Предмет 7"))
+    events = {
+        "dispatch.noise": make_event(MAIN_CHAT_ID, NOISE_MESSAGE, OTHER_USER_ID),
+        "dispatch.command": make_event(USER_ID, "пп"),
+        "dispatch.fish_caught": make_event(game_group_id, FISH_MESSAGE),
+        "dispatch.item_transfer": make_event(game_group_id, ITEM_MESSAGE),
+        "dispatch.auction_post": make_event(
+            MAIN_CHAT_ID, AUCTION_POST, transfer_bot_id
+        ),
+    }
+    results = {
+        name: measure(lambda i, event=event: bot._handle_event(event), iterations)
+        for name, event in events.items()
+    }
+    mix = list(events.values())
+    results["dispatch.mix"] = measure(
+        lambda i: bot._handle_event(mix[i % len(mix)]), iterations
+    )
+    return results
+
+
+def bench_statistics(bot: Bot, db: DatabaseHandler, iterations: int):
+    end = int(time.time())
+    start = end - 30 * 86400
+    request = make_event(USER_ID, "рыба за 30 дней")
+    return {
+        "statistics.handler_30_days": measure(
+            lambda i: bot._handle_event(request), iterations, warmup=5
+        ),
+        "statistics.fishing_summary_30_days": measure(
+            lambda i: db.get_fishing_summary(USER_ID, start, end),
+            iterations,
+            warmup=5,
+        ),
+    }
+
+
+def bench_db(db: DatabaseHandler, iterations: int) -> Dict[str, Dict[str, float]]:
+    now = int(time.time())
+    user_id = 200
+    db.add_user(user_id)
+    db.add_autopost(user_id, MAIN_CHAT_ID, "текст")
+    stat_ids: List[int] = []
+    results = {
+        "db.add_user": measure(lambda i: db.add_user(10000 + i), iterations),
+        "db.add_autopost": measure(
+            lambda i: db.add_autopost(user_id, 3000000000 + i, "текст"), iterations
+        ),
+        "db.get_autopost": measure(
+            lambda i: db.get_autopost(user_id, MAIN_CHAT_ID), iterations
+        ),
+        "db.update_autopost_text": measure(
+            lambda i: db.update_autopost_text(user_id, MAIN_CHAT_ID, f"текст {i}"),
+            iterations,
+        ),
+        "db.add_item": measure(
+            lambda i: db.add_item(user_id, f"предмет {i}", 100, "золота"), iterations
+        ),
+        "db.get_items_by_user_id": measure(
+            lambda i: db.get_items_by_user_id(user_id), iterations
+        ),
+        "db.update_item_price": measure(
+            lambda i: db.update_item_price(user_id, f"предмет {abs(i)}", i), iterations
+        ),
+        "db.delete_item": measure(
+            lambda i: db.delete_item(user_id, f"предмет {i}"), iterations
+        ),
+        "db.add_stat": measure(
+            lambda i: stat_ids.append(db.add_stat(user_id, now - i, "NOTE", str(i))),
+            iterations,
+        ),
+        "db.add_stats_100": measure(
+            lambda i: db.add_stats(
+                [(user_id, now - i - j, "FISH_WEIGHT", "1.5") for j in range(100)]
+            ),
+            max(1, iterations // 10),
+            warmup=5,
+        ),
+        "db.add_catch": measure(
+            lambda i: db.add_fishing_records([], [(user_id, now - i, 1500, i)]),
+            iterations,
+        ),
+        "db.add_fishing_records_100": measure(
+            lambda i: db.add_fishing_records(
+                [], [(user_id, now - i - j, 1500, 40) for j in range(100)]
+            ),
+            max(1, iterations // 10),
+            warmup=5,
+        ),
+        "db.update_stat": measure(
+            lambda i: db.update_stat(stat_ids[i % len(stat_ids)], str(i), "NOTE"),
+            iterations,
+        ),
+        "db.delete_stat": measure(
+            lambda i: db.delete_stat(stat_ids.pop()), min(iterations, len(stat_ids))
+        ),
+        "db.get_all_users": measure(lambda i: db.get_all_users(), 20, warmup=1),
+        "db.get_all_autoposts": measure(lambda i: db.get_all_autoposts(), 20, warmup=1),
+        "db.get_all_items": measure(lambda i: db.get_all_items(), 20, warmup=1),
+        "db.get_all_stats": measure(lambda i: db.get_all_stats(), 3, warmup=1),
+        "db.rebuild_daily_stats": measure(
+            lambda i: db.rebuild_daily_stats(user_id), 5, warmup=1
+        ),
+        "db.delete_autopost": measure(
+            lambda i: db.delete_autopost(user_id, 3000000000 + i), iterations
+        ),
+        "db.delete_user": measure(lambda i: db.delete_user(10000 + i), iterations),
+    }
+    return results
+
+
+def run(iterations: int, stats_rows: int, prefix: str = "") -> Dict:
+    def wanted(group: str) -> bool:
+        return group.startswith(prefix) or prefix.startswith(group)
+
+    results: Dict[str, Dict[str, float]] = {}
+    if wanted("parse."):
+        results.update(bench_parsers(iterations * 10))
+    with workspace() as directory:
+        bot = create_bot()
+        db = DatabaseHandler(os.path.join(directory, "bench.db"))
+        if wanted("dispatch."):
+            results.update(bench_dispatch(bot, iterations))
+        if wanted("statistics."):
+            fill_stats(db, stats_rows)
+            db.rebuild_daily_stats()
+            results.update(bench_statistics(bot, db, max(10, iterations // 20)))
+        if wanted("db."):
+            results.update(bench_db(db, iterations))
+        bot._run_shutdown_hooks()
+        bot.sender.close()
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "iterations": iterations,
+            "stats_rows": stats_rows,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": {
+            name: result for name, result in results.items() if name.startswith(prefix)
+        },
+    }
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Сравнение результатов с базовыми.
+
+    :param current: Текущие результаты.
+    :param baseline: Базовые результаты.
+    :param tolerance: Допустимое относительное ухудшение.
+    :return: Описания регрессий.
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if result["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {result['ops_per_sec']:.0f} оп/с против "
+                f"{base['ops_per_sec']:.0f} оп/с в базовом замере"
+            )
+        elif result["p50_us"] > base["p50_us"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p50 {result['p50_us']:.1f} мкс против "
+                f"{base['p50_us']:.1f} мкс в базовом замере"
+            )
+    return regressions
+
+
+def print_results(current: Dict, baseline: Optional[Dict]) -> None:
+    print(
+        f"{'случай':<38} {'оп/с':>12} {'p50, мкс':>10} {'p99, мкс':>10} {'Δ оп/с':>8}"
+    )
+    for name, result in current["results"].items():
+        change = ""
+        base = (baseline or {}).get("results", {}).get(name)
+        if base:
+            change = f"{(result['ops_per_sec'] / base['ops_per_sec'] - 1) * 100:+.0f}%"
+        print(
+            f"{name:<38} {result['ops_per_sec']:>12.0f} "
+            f"{result['p50_us']:>10.1f} {result['p99_us']:>10.1f} {change:>8}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument(
+        "--stats-rows",
+        type=int,
+        default=200000,
+        help="количество строк Stats для замеров статистики",
+    )
+    parser.add_argument(
+        "--filter", default="", help="запускать только случаи с этим префиксом имени"
+    )
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="допустимое относительное ухудшение относительно базового замера",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="записать результаты как новый базовый замер",
+    )
+    args = parser.parse_args(argv)
+
+    current = run(args.iterations, args.stats_rows, args.filter)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(current, file, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_results(current, baseline)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(current, file, ensure_ascii=False, indent=2)
+        print(f"Базовый замер записан в {args.baseline}")
+        return 0
+    if baseline is None:
+        print(
+            f"Базовый замер {args.baseline} не найден, проверка на регрессии "
+            "не выполнена. Создайте его на этой машине с --update-baseline"
+        )
+        return 2
+
+    regressions = compare(current, baseline, args.tolerance)
+    for regression in regressions:
+        print("РЕГРЕССИЯ " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,462 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import Executor, Future
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from vk_api.longpoll import DEFAULT_MODE
+
+from . import metrics
+from .bot import Bot, LongPollState
+from .event import MessageEvent, parse_messages
+from .sender import Priority, new_random_id
+
+# aiohttp - необязательная зависимость, нужна только асинхронному режиму
+# (run_bot.py --mode async), синхронный Bot работает без нее
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - асинхронный режим необязателен
+    aiohttp = None
+
+AIOHTTP_REQUIRED = "The async mode requires aiohttp: pip install aiohttp"
+
+API_URL = "https://api.vk.com/method/"
+# Та же версия API, что по умолчанию использует vk_api.VkApi в синхронном Bot
+API_VERSION = "5.92"
+# Минимальный интервал между запросами к API с одного токена, как в vk_api
+RPS_DELAY = 0.34
+TOO_MANY_RPS_CODE = 6
+
+
+class AsyncApiError(Exception):
+    def __init__(self, method: str, error: Dict):
+        self.method = method
+        self.code = error.get("error_code")
+        self.error = error
+        super().__init__(f"[{self.code}] {error.get('error_msg')} (method {method})")
+
+
+class PriorityLock:
+    """
+    Асинхронная блокировка, которая освобождается для ожидающих в порядке
+    приоритета, при равном приоритете - в порядке очереди.
+    """
+
+    def __init__(self):
+        self._locked = False
+        self._waiters: List[tuple] = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority: int) -> None:
+        """
+        Захватывает блокировку.
+
+        Args:
+            priority (int): Приоритет, меньшее значение получает блокировку раньше.
+        """
+        if not self._locked and not self._waiters:
+            self._locked = True
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Блокировка могла быть передана до отмены, тогда она передается дальше
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """
+        Освобождает блокировку, передавая ее ожидающему с наивысшим приоритетом.
+        """
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._locked = False
+
+
+class AsyncBot(Bot):
+    """
+    Вариант Bot для работы множества ботов в одном цикле событий asyncio.
+
+    Long poll и вызовы API выполняются через общий aiohttp.ClientSession,
+    поэтому бот не держит собственный поток. Требует необязательный пакет
+    aiohttp, без него создание бота завершается ImportError. Синхронные
+    обработчики, зарегистрированные через message_handler, выполняются
+    в общем пуле потоков, события одного бота обрабатываются строго
+    по очереди.
+    Обработчики-корутины выполняются в цикле событий.
+
+    Хранилище позиции long poll, подключенное через set_cursor_store,
+    работает как в Bot: бот продолжает с сохраненной позиции и не
+    обрабатывает повторно полученные сообщения. Передачи позиции
+    преемнику через stop нет, задача бота отменяется целиком.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        session: "aiohttp.ClientSession",
+        executor: Executor,
+        name: str = "",
+        wait: int = 25,
+        message_cache_size: int = 1024,
+        message_cache_ttl: float = 300.0,
+    ):
+        """
+        Args:
+            token (str): Токен пользователя.
+            session (aiohttp.ClientSession): Общая HTTP-сессия.
+            executor (Executor): Общий пул потоков для синхронных обработчиков.
+            name (str): Имя бота для логов.
+            wait (int): Время ожидания long poll запроса в секундах.
+            message_cache_size (int): Размер кэша сообщений.
+            message_cache_ttl (float): Время жизни записи кэша сообщений в секундах.
+        """
+        if aiohttp is None:
+            raise ImportError(AIOHTTP_REQUIRED)
+        self.token = token
+        self.session = session
+        self.executor = executor
+        self.name = name
+        self.wait = wait
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.server: Optional[str] = None
+        self.key: Optional[str] = None
+        self.ts: Optional[int] = None
+        self.pts: Optional[int] = None
+        # Запросы одного токена выполняются по очереди в порядке приоритета
+        self._api_lock = PriorityLock()
+        self._last_request = 0.0
+        self._init_dispatch(message_cache_size, message_cache_ttl)
+        self._init_listen_state()
+
+    async def method(
+        self,
+        method: str,
+        values: Optional[Dict] = None,
+        priority: Priority = Priority.NORMAL,
+    ) -> Any:
+        """
+        Вызывает метод VK API.
+
+        Args:
+            method (str): Название метода.
+            values (Optional[Dict]): Параметры метода.
+            priority (Priority): Приоритет запроса среди ожидающих запросов токена.
+
+        Returns:
+            Any: Поле response ответа API.
+        """
+        data = {"access_token": self.token, "v": API_VERSION}
+        for key, value in (values or {}).items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                value = ",".join(str(item) for item in value)
+            data[key] = str(value)
+
+        started = time.perf_counter()
+        try:
+            for attempt in range(3):
+                await self._api_lock.acquire(priority)
+                try:
+                    delay = RPS_DELAY - (time.monotonic() - self._last_request)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    try:
+                        async with self.session.post(
+                            API_URL + method, data=data
+                        ) as resp:
+                            response = await resp.json(content_type=None)
+                    finally:
+                        self._last_request = time.monotonic()
+                finally:
+                    self._api_lock.release()
+                if "error" not in response:
+                    return response["response"]
+                error = AsyncApiError(method, response["error"])
+                if error.code != TOO_MANY_RPS_CODE:
+                    raise error
+                await asyncio.sleep(0.5)
+            raise error
+        except AsyncApiError as e:
+            metrics.VK_API_ERRORS.labels(self.name, method, e.code).inc()
+            raise
+        except Exception as e:
+            metrics.VK_API_ERRORS.labels(self.name, method, type(e).__name__).inc()
+            raise
+        finally:
+            metrics.VK_API_SECONDS.labels(self.name, method).observe(
+                time.perf_counter() - started
+            )
+
+    async def asend(
+        self,
+        chat: int,
+        text: str,
+        reply_id: Optional[int] = None,
+        forward_messages: Optional[List[int]] = None,
+        priority: Priority = Priority.NORMAL,
+    ) -> int:
+        """
+        Отправляет сообщение из цикла событий.
+
+        Запросы одного токена выполняются по очереди, сообщение с более
+        высоким приоритетом отправляется раньше ожидающих запросов с более
+        низким, как в очереди отправки Bot.send.
+
+        Args:
+            chat (int): ID чата.
+            text (str): Текст сообщения.
+            reply_id (Optional[int]): ID сообщения для ответа.
+            forward_messages (Optional[List[int]]): Список ID сообщений для пересылки.
+            priority (Priority): Приоритет сообщения.
+
+        Returns:
+            int: ID отправленного сообщения.
+        """
+        return await self.method(
+            "messages.send",
+            {
+                "peer_id": chat,
+                "message": text,
+                "random_id": new_random_id(),
+                "reply_to": reply_id,
+                "forward_messages": forward_messages,
+            },
+            priority,
+        )
+
+    async def aget_msg_by_id(self, id: int) -> Dict:
+        """
+        Получает сообщение по его ID из цикла событий, используя кэш сообщений.
+
+        Args:
+            id (int): ID сообщения.
+
+        Returns:
+            Dict: Сообщение.
+        """
+        message = self.message_cache.get(id)
+        if message is None:
+            message = (await self.method("messages.getById", {"message_ids": id}))[
+                "items"
+            ][0]
+            self.message_cache.put(id, message)
+        return message
+
+    def send(
+        self,
+        chat: int,
+        text: str,
+        reply_id: Optional[int] = None,
+        forward_messages: Optional[List[int]] = None,
+        priority: Priority = Priority.NORMAL,
+        wait: bool = True,
+    ) -> Union[int, Future]:
+        """
+        Отправляет сообщение из синхронного обработчика.
+
+        Args:
+            chat (int): ID чата.
+            text (str): Текст сообщения.
+            reply_id (Optional[int]): ID сообщения для ответа.
+            forward_messages (Optional[List[int]]): Список ID сообщений для пересылки.
+            priority (Priority): Приоритет сообщения.
+            wait (bool): Дождаться отправки.
+
+        Returns:
+            Union[int, Future]: ID отправленного сообщения или Future с ним, если wait=False.
+        """
+        future = self._submit(
+            self.asend(chat, text, reply_id, forward_messages, priority)
+        )
+        return future.result() if wait else future
+
+    def _fetch_message(self, id: int) -> Dict:
+        return self._run(self.method("messages.getById", {"message_ids": id}))["items"][
+            0
+        ]
+
+    def _run(self, coro) -> Any:
+        return self._submit(coro).result()
+
+    def _submit(self, coro) -> Future:
+        if self._in_loop():
+            coro.close()
+            raise RuntimeError(
+                "Synchronous AsyncBot methods cannot be called from the event loop, "
+                "use the coroutines"
+            )
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _in_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _handle_event(self, event: MessageEvent):
+        self._start_event(event)
+        for route in self.router.match(event):
+            result = self._call_handler(route.func, event)
+            if asyncio.iscoroutine(result):
+                asyncio.run_coroutine_threadsafe(result, self.loop).result()
+
+    async def _update_longpoll_server(self, update_ts: bool = True) -> None:
+        response = await self.method(
+            "messages.getLongPollServer", {"lp_version": 3, "need_pts": 1}
+        )
+        self.key = response["key"]
+        self.server = response["server"]
+        if update_ts:
+            self.ts = response["ts"]
+            self.pts = response.get("pts")
+
+    async def _poll(self, ts: int, wait: int) -> Dict:
+        params = {
+            "act": "a_check",
+            "key": self.key,
+            "ts": ts,
+            "wait": wait,
+            "mode": DEFAULT_MODE,
+            "version": 3,
+        }
+        async with self.session.get(
+            f"https://{self.server}",
+            params=params,
+            timeout=aiohttp.ClientTimeout(total=self.wait + 10),
+        ) as resp:
+            return await resp.json(content_type=None)
+
+    async def _check(self) -> List[List]:
+        response = await self._poll(self.ts, self.wait)
+        if "failed" not in response:
+            self.ts = response["ts"]
+            self.pts = response.get("pts", self.pts)
+            return response["updates"]
+        if response["failed"] == 1:
+            self.ts = response["ts"]
+        elif response["failed"] == 2:
+            await self._update_longpoll_server(update_ts=False)
+        elif response["failed"] == 3:
+            await self._update_longpoll_server()
+        return []
+
+    async def _check_from_async(self, ts: int) -> Optional[List[List]]:
+        # Как Bot._check_from: None - позиция устарела
+        for _ in range(2):
+            response = await self._poll(ts, 0)
+            if "failed" not in response:
+                self.ts = response["ts"]
+                self.pts = response.get("pts", self.pts)
+                return response["updates"]
+            if response["failed"] != 2:
+                return None
+            await self._update_longpoll_server(update_ts=False)
+        return None
+
+    async def _resume_async(self) -> Tuple[MessageEvent, ...]:
+        # Как Bot._resume, запросы к API выполняются в цикле событий,
+        # чтение позиции из базы - в пуле потоков
+        try:
+            cursor = await self.loop.run_in_executor(self.executor, self._cursor_load)
+        except Exception as e:
+            logging.error(f"Failed to load long poll position of {self.name}: {e}")
+            return ()
+        if cursor is None:
+            return ()
+        self._remember(cursor.message_ids)
+        try:
+            updates = await self._check_from_async(cursor.ts)
+            if updates is None:
+                logging.warning(
+                    f"Long poll position of {self.name} is outdated, "
+                    "loading missed messages from history"
+                )
+                params = self._history_params(cursor.ts, cursor.pts)
+                updates = []
+                if params is not None:
+                    updates = self._history_response_updates(
+                        await self.method("messages.getLongPollHistory", params)
+                    )
+        except (AssertionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            logging.error(f"Failed to resume long poll of {self.name}: {e}")
+            return ()
+        received_at = time.time()
+        self._record(updates, received_at)
+        pending = parse_messages(updates, received_at)
+        logging.info(
+            f"Bot {self.name} resumed long poll from ts {cursor.ts} "
+            f"with {len(pending)} missed messages"
+        )
+        return pending
+
+    def _longpoll_state(self, pending: Tuple[MessageEvent, ...] = ()) -> LongPollState:
+        return LongPollState(self.server, self.key, self.ts, self.pts, pending)
+
+    async def _dispatch(self, event: MessageEvent) -> None:
+        # События одного бота обрабатываются последовательно, ошибка в одном
+        # событии не теряет остальные события из того же ответа long poll
+        if event.message_id in self._recent_set:
+            self.duplicates += 1
+            return
+        self._remember((event.message_id,))
+        self._handled_unsaved = True
+        try:
+            await self.loop.run_in_executor(self.executor, self._handle_event, event)
+        except (AssertionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            logging.error("Error while handling event in " + self.name + ": " + str(e))
+
+    async def listen(self):
+        """
+        Слушает long poll сервер до отмены задачи или команды выключения.
+        """
+        self.loop = asyncio.get_running_loop()
+        logging.info("Starting async listening of " + self.name)
+        try:
+            while True:
+                try:
+                    if self.server is None:
+                        await self._update_longpoll_server()
+                        if self._cursor_load is not None:
+                            for event in await self._resume_async():
+                                await self._dispatch(event)
+                    self._state = self._longpoll_state()
+                    self._save_cursor()
+                    updates = await self._check()
+                    received_at = time.time()
+                    self._record(updates, received_at)
+                    for event in parse_messages(updates, received_at):
+                        await self._dispatch(event)
+                except AssertionError:
+                    logging.info("Shutting down async bot " + self.name)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.error(
+                        "Unexpected error in async bot " + self.name + ": " + str(e)
+                    )
+                    await asyncio.sleep(1)
+        finally:
+            await asyncio.shield(
+                self.loop.run_in_executor(self.executor, self._shutdown_async)
+            )
+
+    def _shutdown_async(self):
+        # Позиция сохраняется до обработчиков остановки, закрывающих базу
+        self._state = self._longpoll_state()
+        self._save_cursor(force=True)
+        self._run_shutdown_hooks()
@@ -1,33 +1,151 @@
 import logging
 import threading
-from typing import Callable, Dict, List, Optional, Union
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
+import requests
 import vk_api
-from vk_api.longpoll import Event, VkEventType, VkLongPoll
+from vk_api.longpoll import VkEventType, VkLongPoll, VkMessageFlag
+
+from .cache import LRUCache
+from . import metrics
+from .classifier import classify
+from .event import CHAT_PEER_ID_START, MessageEvent, parse_messages
+from .latency import LatencyRecorder
+from .router import Router
+from .sender import Priority, SendScheduler
+
+# Время, за которое бот должен остановиться и передать позицию long poll преемнику
+STOP_TIMEOUT = 10.0
+# Максимальное время ожидания отправки сообщения в Bot.send
+SEND_TIMEOUT = 30.0
+# Позиция long poll сохраняется сразу после событий, обработанных хотя бы одним
+# обработчиком, а без таких событий - не чаще раза в CURSOR_SAVE_INTERVAL секунд
+CURSOR_SAVE_INTERVAL = 5.0
+# Количество ID последних обработанных сообщений, повторы которых отбрасываются,
+# и сколько из них сохраняется вместе с позицией long poll
+RECENT_MESSAGES_LIMIT = 1000
+SAVED_MESSAGES_LIMIT = 100
+# Максимальное количество пропущенных сообщений из messages.getLongPollHistory
+HISTORY_MESSAGES_LIMIT = 200
+
+
+class LongPollState(NamedTuple):
+    """
+    Позиция long poll, передаваемая остановленным ботом его преемнику.
+    """
+
+    server: str
+    key: str
+    ts: int
+    pts: Optional[int]
+    # События из последнего ответа сервера, обработку которых бот не начал
+    pending: Tuple[MessageEvent, ...] = ()
 
 
 class Bot:
-    def __init__(self, token: str):
+    def __init__(
+        self,
+        token: str,
+        message_cache_size: int = 1024,
+        message_cache_ttl: float = 300.0,
+        name: Optional[str] = None,
+        vk_session: Optional[vk_api.VkApi] = None,
+        transport: Optional[requests.Session] = None,
+    ):
         self.token = token
-        self.vk_session = vk_api.VkApi(token=token)
+        # Имя бота используется в логах и как метка tenant в метриках
+        self.name = name or threading.current_thread().name
+        # Готовую сессию передают бенчмарки, чтобы работать без сети
+        self.vk_session = vk_session or metrics.InstrumentedVkApi(
+            token=token, tenant=self.name, session=transport
+        )
         self.longpoll = VkLongPoll(self.vk_session)
+        # Общая для ботов процесса HTTP-сессия используется и для long poll
+        if transport is not None:
+            self.longpoll.session = transport
         self.vk = self.vk_session.get_api()
+        self.sender = SendScheduler(self.vk_session, name="sender-" + self.name)
+        self._init_dispatch(message_cache_size, message_cache_ttl)
+        self._init_listen_state()
+
+    def _init_listen_state(self):
+        # Состояние остановки: _state - позиция, с которой продолжит преемник,
+        # _polling - поток бота ждет ответа long poll
+        self._state_lock = threading.Lock()
+        self._state: Optional[LongPollState] = None
+        self._polling = False
+        self._abandoned = False
+        self._stopping = threading.Event()
+        self._released = threading.Event()
+        self._shutdown_lock = threading.Lock()
+        self._is_shut_down = False
+        # Хранилище позиции long poll и отбрасывание повторно полученных сообщений
+        self._cursor_load: Optional[Callable[[], Any]] = None
+        self._cursor_save: Optional[Callable[..., None]] = None
+        self._saved_ts: Optional[int] = None
+        self._saved_at = 0.0
+        self._handled_unsaved = False
+        self._recent_ids: Deque[int] = deque()
+        self._recent_set: Set[int] = set()
+        self.duplicates = 0
+
+    def _init_dispatch(self, message_cache_size: int, message_cache_ttl: float):
         self.handlers: List[Dict[str, Union[Callable, Dict]]] = []
+        self.router = Router(classifier=classify)
+        # Сообщения, запрошенные во время обработки текущего события, и общий кэш между событиями
+        self._event_messages: Dict[int, Dict] = {}
+        self.event_message_hits = 0
+        self.message_cache = LRUCache(message_cache_size, message_cache_ttl)
+        self._shutdown_hooks: List[Callable[[], None]] = []
+        self.latency = LatencyRecorder()
+        self._journal = None
+
+    def listen(self, state: Optional[LongPollState] = None):
+        """
+        Слушает long poll сервер до вызова stop или команды выключения.
 
-    def listen(self):
+        Args:
+            state (Optional[LongPollState]): Позиция, переданная остановленным
+                предшественником. Бот продолжает с нее, поэтому события,
+                пришедшие во время перезапуска, не теряются и не повторяются.
+        """
         logging.info(
             "Starting listening in thread of " + threading.current_thread().name
         )
+        if state is not None:
+            self._restore_longpoll(state)
+        elif self._cursor_load is not None:
+            state = self._longpoll_state(self._resume())
+        with self._state_lock:
+            self._state = state or self._longpoll_state()
         while True:
+            with self._state_lock:
+                if self._stopping.is_set():
+                    break
+                event = self._next_event()
+                self._polling = event is None
+            if event is not None:
+                self._process_event(event)
+                continue
+
+            self._save_cursor()
             try:
-                for event in self.longpoll.listen():
-                    if event.type == VkEventType.MESSAGE_NEW and event.text.lower():
-                        self._handle_event(event)
-            except AssertionError as e:
-                logging.info(
-                    "Shutting down thread of " + threading.current_thread().name
-                )
-                exit(0)
+                updates = self._check()
             except Exception as e:
                 logging.error(
                     "Unexpected error in thread of "
@@ -35,44 +153,386 @@ class Bot:
                     + ": "
                     + str(e)
                 )
-                pass
-
-    def _handle_event(self, event: Event):
-        for handler in self.handlers:
-            func = handler["func"]
-            filters = handler["filters"]
-            if self._apply_filters(event, filters):
-                func(event)
-
-    def _apply_filters(self, event: Event, filters: Dict) -> bool:
-        if "peer_id" in filters and int(filters["peer_id"]) != event.peer_id:
-            return False
-        if "text" in filters and filters["text"].lower() != event.text.lower():
-            return False
-        if (
-            (event.from_user or event.from_chat)
-            and "user_id" in filters
-            and int(filters["user_id"]) != event.user_id
-        ):
-            return False
-        if (
-            event.from_group
-            and "group_id" in filters
-            and abs(int(filters["group_id"])) != event.group_id
+                updates = []
+                self._stopping.wait(1)
+            received_at = time.time()
+            with self._state_lock:
+                self._polling = False
+                if self._abandoned:
+                    # stop уже передал преемнику позицию до этого запроса,
+                    # он получит эти события сам
+                    return
+                self._state = self._longpoll_state(parse_messages(updates, received_at))
+            self._record(updates, received_at)
+
+        logging.info("Shutting down thread of " + threading.current_thread().name)
+        self._shutdown()
+        self._released.set()
+
+    def stop(self, timeout: float = STOP_TIMEOUT) -> Optional[LongPollState]:
+        """
+        Останавливает бота и возвращает позицию long poll для преемника.
+
+        Если бот ждет ответа long poll, запрос бросается, и остановка не ждет
+        его завершения: преемник повторит запрос с той же позиции. Если бот
+        обрабатывает событие, остановка ждет его завершения, необработанные
+        события из того же ответа передаются преемнику. Обработчики остановки
+        и очередь отправки завершаются до передачи позиции.
+
+        Можно вызывать до listen, тогда бот не начнет слушать и вернет
+        позицию, переданную ему в listen.
+
+        Args:
+            timeout (float): Максимальное время ожидания в секундах. Если событие
+                обрабатывается дольше, позиция передается без ожидания, а
+                обработка завершается в потоке бота.
+
+        Returns:
+            Optional[LongPollState]: Позиция long poll или None, если бот
+                не начал слушать за время ожидания.
+        """
+        with self._state_lock:
+            self._stopping.set()
+            if self._polling:
+                self._abandoned = True
+        if self._abandoned:
+            logging.info("Stopping idle bot " + self.name)
+            self._shutdown(timeout)
+            self._released.set()
+        elif not self._released.wait(timeout):
+            logging.warning(
+                f"Bot {self.name} did not stop in {timeout} s, "
+                "handing over long poll while its handler is still running"
+            )
+        with self._state_lock:
+            self._abandoned = True
+            return self._state
+
+    def set_cursor_store(
+        self,
+        load: Callable[[], Any],
+        save: Callable[[int, Optional[int], Tuple[int, ...]], None],
+    ) -> None:
+        """
+        Подключает хранилище позиции long poll для продолжения после перезапуска.
+
+        Бот, запущенный без позиции от предшественника, продолжает с
+        сохраненной позиции, а если сервер ее уже не помнит - получает
+        пропущенные сообщения через messages.getLongPollHistory. Вместе с
+        позицией сохраняются ID последних обработанных сообщений, поэтому
+        события, полученные повторно, не обрабатываются дважды.
+
+        Args:
+            load (Callable[[], Any]): Возвращает сохраненную позицию с полями
+                ts, pts и message_ids или None.
+            save (Callable[[int, Optional[int], Tuple[int, ...]], None]): Сохраняет
+                позицию: save(ts, pts, message_ids).
+        """
+        self._cursor_load = load
+        self._cursor_save = save
+
+    def set_journal(self, journal) -> None:
+        """
+        Подключает журнал, в который записываются все события long poll
+        в исходном виде для последующего воспроизведения.
+
+        Args:
+            journal (bot.journal.JournalWriter): Журнал событий бота.
+        """
+        self._journal = journal
+
+    def _record(self, updates: List[List], received_at: float):
+        if self._journal is None or not updates:
+            return
+        try:
+            self._journal.record(updates, received_at)
+        except Exception as e:
+            logging.error(f"Failed to write events journal of {self.name}: {e}")
+
+    def _resume(self) -> Tuple[MessageEvent, ...]:
+        try:
+            cursor = self._cursor_load()
+        except Exception as e:
+            logging.error(f"Failed to load long poll position of {self.name}: {e}")
+            return ()
+        if cursor is None:
+            return ()
+        self._remember(cursor.message_ids)
+        try:
+            updates = self._check_from(cursor.ts)
+            if updates is None:
+                logging.warning(
+                    f"Long poll position of {self.name} is outdated, "
+                    "loading missed messages from history"
+                )
+                updates = self._history_updates(cursor.ts, cursor.pts)
+        except Exception as e:
+            logging.error(f"Failed to resume long poll of {self.name}: {e}")
+            return ()
+        received_at = time.time()
+        self._record(updates, received_at)
+        pending = parse_messages(updates, received_at)
+        logging.info(
+            f"Bot {self.name} resumed long poll from ts {cursor.ts} "
+            f"with {len(pending)} missed messages"
+        )
+        return pending
+
+    def _check(self) -> List[List]:
+        # Как VkLongPoll.check, но без создания vk_api Event для каждого события:
+        # события возвращаются в исходном виде и разбираются в parse_messages
+        longpoll = self.longpoll
+        response = longpoll.session.get(
+            longpoll.url,
+            params={
+                "act": "a_check",
+                "key": longpoll.key,
+                "ts": longpoll.ts,
+                "wait": longpoll.wait,
+                "mode": longpoll.mode,
+                "version": 3,
+            },
+            timeout=longpoll.wait + 10,
+        ).json()
+        if "failed" not in response:
+            longpoll.ts = response["ts"]
+            longpoll.pts = response.get("pts")
+            return response["updates"]
+        if response["failed"] == 1:
+            longpoll.ts = response["ts"]
+        elif response["failed"] == 2:
+            longpoll.update_longpoll_server(update_ts=False)
+        elif response["failed"] == 3:
+            longpoll.update_longpoll_server()
+        return []
+
+    def _check_from(self, ts: int) -> Optional[List[List]]:
+        # Один запрос long poll без ожидания с сохраненной позиции.
+        # None - позиция устарела, и события с нее сервер уже не отдаст
+        longpoll = self.longpoll
+        for _ in range(2):
+            response = longpoll.session.get(
+                longpoll.url,
+                params={
+                    "act": "a_check",
+                    "key": longpoll.key,
+                    "ts": ts,
+                    "wait": 0,
+                    "mode": longpoll.mode,
+                    "version": 3,
+                },
+                timeout=longpoll.wait + 10,
+            ).json()
+            if "failed" not in response:
+                longpoll.ts = response["ts"]
+                longpoll.pts = response.get("pts", longpoll.pts)
+                return response["updates"]
+            if response["failed"] != 2:
+                return None
+            # Истек ключ, позиция при этом действительна
+            longpoll.update_longpoll_server(update_ts=False)
+        return None
+
+    def _history_updates(self, ts: int, pts: Optional[int]) -> List[List]:
+        params = self._history_params(ts, pts)
+        if params is None:
+            return []
+        response = self.vk_session.method("messages.getLongPollHistory", params)
+        return self._history_response_updates(response)
+
+    def _history_params(self, ts: int, pts: Optional[int]) -> Optional[Dict]:
+        if pts is None:
+            logging.warning(
+                f"No pts saved for {self.name}, messages received while it was "
+                "stopped are lost"
+            )
+            return None
+        return {
+            "ts": ts,
+            "pts": pts,
+            "lp_version": 3,
+            "msgs_limit": HISTORY_MESSAGES_LIMIT,
+        }
+
+    def _history_response_updates(self, response: Dict) -> List[List]:
+        if response.get("more"):
+            logging.warning(
+                f"More than {HISTORY_MESSAGES_LIMIT} messages missed by {self.name}, "
+                "older ones are lost"
+            )
+        messages = sorted(response["messages"]["items"], key=lambda item: item["id"])
+        return [self._history_update(message) for message in messages]
+
+    @staticmethod
+    def _history_update(message: Dict) -> List:
+        # Сообщение из API в формате события long poll: текст экранирован,
+        # переводы строк заменены на <br>, у бесед автор в дополнительных полях
+        text = (
+            message.get("text", "")
+            .replace("&", "&amp;")
+            .replace("<", "&lt;")
+            .replace(">", "&gt;")
+            .replace('"', "&quot;")
+            .replace("\n", "<br>")
+        )
+        extra = (
+            {"from": str(message["from_id"])}
+            if message["peer_id"] > CHAT_PEER_ID_START
+            else {}
+        )
+        return [
+            VkEventType.MESSAGE_NEW.value,
+            message["id"],
+            VkMessageFlag.OUTBOX.value if message.get("out") else 0,
+            message["peer_id"],
+            message["date"],
+            text,
+            extra,
+            {},
+        ]
+
+    def _next_event(self) -> Optional[MessageEvent]:
+        while self._state.pending:
+            event, *pending = self._state.pending
+            self._state = self._state._replace(pending=tuple(pending))
+            if event.message_id in self._recent_set:
+                self.duplicates += 1
+                continue
+            self._remember((event.message_id,))
+            return event
+        return None
+
+    def _remember(self, message_ids: Iterable[int]):
+        for message_id in message_ids:
+            if message_id in self._recent_set:
+                continue
+            if len(self._recent_ids) >= RECENT_MESSAGES_LIMIT:
+                self._recent_set.discard(self._recent_ids.popleft())
+            self._recent_ids.append(message_id)
+            self._recent_set.add(message_id)
+
+    def _save_cursor(self, force: bool = False):
+        if self._cursor_save is None:
+            return
+        with self._state_lock:
+            state = self._state
+            message_ids = tuple(self._recent_ids)[-SAVED_MESSAGES_LIMIT:]
+        if state is None or state.ts is None:
+            return
+        now = time.monotonic()
+        if not force and (
+            state.ts == self._saved_ts
+            or not self._handled_unsaved
+            and now - self._saved_at < CURSOR_SAVE_INTERVAL
         ):
-            return False
-        if "custom_filters" in filters:
-            for custom_filter in filters["custom_filters"]:
-                if not custom_filter(event):
-                    return False
-        return True
+            return
+        self._saved_ts = state.ts
+        self._saved_at = now
+        self._handled_unsaved = False
+        try:
+            self._cursor_save(state.ts, state.pts, message_ids)
+        except Exception as e:
+            logging.error(f"Failed to save long poll position of {self.name}: {e}")
+
+    def _process_event(self, event: MessageEvent) -> bool:
+        try:
+            handled = self._handle_event(event)
+        except AssertionError:
+            # Команда выключения бота
+            self._stopping.set()
+            return True
+        except Exception as e:
+            logging.error(
+                "Unexpected error in thread of "
+                + threading.current_thread().name
+                + ": "
+                + str(e)
+            )
+            return True
+        if handled:
+            self._handled_unsaved = True
+        return handled
+
+    def _longpoll_state(self, pending: Tuple[MessageEvent, ...] = ()) -> LongPollState:
+        return LongPollState(
+            self.longpoll.server,
+            self.longpoll.key,
+            self.longpoll.ts,
+            self.longpoll.pts,
+            pending,
+        )
+
+    def _restore_longpoll(self, state: LongPollState):
+        self.longpoll.server = state.server
+        self.longpoll.key = state.key
+        self.longpoll.ts = state.ts
+        self.longpoll.pts = state.pts
+        self.longpoll.url = f"https://{state.server}"
+
+    def _shutdown(self, timeout: float = STOP_TIMEOUT):
+        # Вызывается из потока бота или из stop, выполняется один раз
+        with self._shutdown_lock:
+            if self._is_shut_down:
+                return
+            self._is_shut_down = True
+        # Позиция сохраняется до обработчиков остановки, закрывающих базу
+        self._save_cursor(force=True)
+        self._run_shutdown_hooks()
+        self.sender.close(timeout)
+
+    def on_shutdown(self, callback: Callable[[], None]) -> None:
+        """
+        Регистрирует функцию, вызываемую в потоке бота при его остановке.
+
+        Args:
+            callback (Callable[[], None]): Функция без аргументов.
+        """
+        self._shutdown_hooks.append(callback)
+
+    def _run_shutdown_hooks(self):
+        for callback in self._shutdown_hooks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error("Error in shutdown hook: " + str(e))
+
+    def _handle_event(self, event: MessageEvent) -> bool:
+        self._start_event(event)
+        handled = False
+        for route in self.router.match(event):
+            handled = True
+            self._call_handler(route.func, event)
+        return handled
+
+    def _start_event(self, event: MessageEvent):
+        self._event_messages = {}
+        metrics.EVENTS.labels(self.name).inc()
+        metrics.EVENT_LAG.labels(self.name).observe(
+            max(0.0, time.time() - event.timestamp)
+        )
+
+    def _call_handler(self, func: Callable, event: MessageEvent):
+        started = time.perf_counter()
+        try:
+            return func(event)
+        except AssertionError:
+            raise
+        except Exception:
+            metrics.HANDLER_ERRORS.labels(self.name, func.__name__).inc()
+            raise
+        finally:
+            metrics.HANDLER_SECONDS.labels(self.name, func.__name__).observe(
+                time.perf_counter() - started
+            )
 
     def message_handler(self, **filters):
         """
         Декоратор для обработки сообщений с заданными фильтрами.
 
         Args:
-            **filters: Фильтры для обработки сообщений (peer_id, from_id, text, custom_filters).
+            **filters: Фильтры для обработки сообщений (peer_id, from_id, text, kind, custom_filters).
+                С fast_lane=True обработчик проверяется первым, и подошедшее ему
+                событие не передается остальным обработчикам.
 
         Returns:
             Callable: Декоратор для обработки сообщений.
@@ -80,9 +540,9 @@ class Bot:
         custom_filters = filters.pop("custom_filters", [])
 
         def decorator(func: Callable) -> Callable:
-            self.handlers.append(
-                {"func": func, "filters": {**filters, "custom_filters": custom_filters}}
-            )
+            handler_filters = {**filters, "custom_filters": custom_filters}
+            self.handlers.append({"func": func, "filters": handler_filters})
+            self.router.add(func, handler_filters)
             return func
 
         return decorator
@@ -91,42 +551,74 @@ class Bot:
         """
         Получает сообщение по его ID.
 
+        В пределах одного события каждое сообщение запрашивается не более одного раза,
+        между событиями результаты хранятся в LRU-кэше с ограниченным временем жизни.
+
         Args:
             id (int): ID сообщения.
 
         Returns:
             Dict: Сообщение.
         """
+        message = self._event_messages.get(id)
+        if message is not None:
+            self.event_message_hits += 1
+            return message
+        message = self.message_cache.get(id)
+        if message is None:
+            message = self._fetch_message(id)
+            self.message_cache.put(id, message)
+        self._event_messages[id] = message
+        return message
+
+    def _fetch_message(self, id: int) -> Dict:
         return self.vk_session.method(
             "messages.getById", {"message_ids": id, "access_token": self.token}
         )["items"][0]
 
+    def message_cache_stats(self) -> Dict[str, int]:
+        """
+        Возвращает счетчики кэша сообщений.
+
+        Returns:
+            Dict[str, int]: Счетчики LRU-кэша и число повторных обращений в пределах события.
+        """
+        return {**self.message_cache.stats(), "event_hits": self.event_message_hits}
+
     def send(
         self,
         chat: int,
         text: str,
         reply_id: Optional[int] = None,
         forward_messages: Optional[List[int]] = None,
-    ) -> int:
+        priority: Priority = Priority.NORMAL,
+        wait: bool = True,
+        timeout: Optional[float] = SEND_TIMEOUT,
+    ) -> Union[int, Future]:
         """
-        Отправляет сообщение.
+        Отправляет сообщение через очередь отправки токена.
 
         Args:
             chat (int): ID чата.
             text (str): Текст сообщения.
             reply_id (Optional[int]): ID сообщения для ответа.
             forward_messages (Optional[List[int]]): Список ID сообщений для пересылки.
+            priority (Priority): Приоритет сообщения в очереди.
+            wait (bool): Дождаться отправки. Без ожидания сообщения, поставленные
+                в очередь подряд, могут уйти одним вызовом execute.
+            timeout (Optional[float]): Максимальное время ожидания отправки в секундах,
+                после него вызывается TimeoutError, а сообщение остается в очереди.
 
         Returns:
-            int: ID отправленного сообщения.
+            Union[int, Future]: ID отправленного сообщения или Future с ним, если wait=False.
         """
-        return self.vk_session.method(
-            "messages.send",
+        future = self.sender.submit(
             {
                 "peer_id": chat,
                 "message": text,
-                "random_id": 0,
                 "reply_to": reply_id,
                 "forward_messages": forward_messages,
             },
+            priority,
         )
+        return future.result(timeout) if wait else future
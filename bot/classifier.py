@@ -0,0 +1,142 @@
+import re
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class MessageKind(Enum):
+    """
+    Типы игровых сообщений, на которые подписываются обработчики.
+    """
+
+    ITEM_TRANSFER = "item_transfer"
+    AUCTION_LOTS = "auction_lots"
+    FISHING_START = "fishing_start"
+    FISHING_MAP_ACTIVATED = "fishing_map_activated"
+    FISH_CAUGHT = "fish_caught"
+    AUCTION_BOUGHT = "auction_bought"
+
+
+ITEM_TRANSFER_PREFIXES = ("получено:", "отправлено:")
+# Маркеры проверяются по тексту в нижнем регистре. Поиск подстроки в CPython
+# заметно дешевле альтернации в одном регулярном выражении для сообщений,
+# не относящихся к игре, а таких большинство.
+KIND_MARKERS = (
+    ("продает через аукцион", MessageKind.AUCTION_LOTS),
+    ("вы готовитесь к рыбалке", MessageKind.FISHING_START),
+    ("карта озера активирована", MessageKind.FISHING_MAP_ACTIVATED),
+    ("вы успешно выловили рыбу!", MessageKind.FISH_CAUGHT),
+    ("успешно приобрели с аукциона предмет", MessageKind.AUCTION_BOUGHT),
+)
+
+ITEM_TRANSFER_PATTERN = re.compile(
+    r"(Получено|Отправлено):.{2}(\d*\*?)?(\S.+\S): \[id(\d+)\|[^]]+] =&gt; \[id(\d+)\|[^]]+]"
+)
+# Один лот - одна строка поста, шаблон применяется к каждой строке отдельно
+AUCTION_LOT_PATTERN = re.compile(
+    r"(\d+)\s*\*\s*([^*-]+?)\s*-\s*(\d+)\s*золота\s*\((\d+)\)"
+)
+FISH_CAUGHT_PATTERN = re.compile(r"\((\d+(?:\.\d+)?)\s*кг\).*в\s(\d+)\sзолота")
+AUCTION_BOUGHT_PATTERN = re.compile(
+    r"\[id(\d+)\|.*?\], вы успешно приобрели с аукциона предмет (\d+)\*(.+?)\s*-\s*\d+ золота потрачено"
+)
+
+
+def parse_item_message(message: str) -> Optional[Dict[str, Any]]:
+    """
+    Парсинг сообщения о передаче предмета.
+
+    :param message: Текст сообщения.
+    :return: Словарь с типом операции, количеством предметов, названием предмета,
+            идентификатором отправителя и получателя.
+    """
+    match = ITEM_TRANSFER_PATTERN.match(message)
+    if not match:
+        return None
+    action, quantity, item_name, sender_id, receiver_id = match.groups()
+    try:
+        quantity = int(quantity[:-1]) if quantity and quantity.endswith("*") else 1
+    except ValueError:
+        return None
+    return {
+        "action": action,
+        "quantity": quantity,
+        "item_name": item_name.lower(),
+        "sender_id": int(sender_id),
+        "receiver_id": int(receiver_id),
+    }
+
+
+def parse_auction_lots(text: str) -> List[Tuple[int, str, int, str]]:
+    """
+    Парсинг лотов из поста аукциона.
+
+    :param text: Текст поста в нижнем регистре.
+    :return: Список кортежей (количество, название предмета, общая цена, номер лота).
+    """
+    lots = []
+    for line in text.split("\n"):
+        match = AUCTION_LOT_PATTERN.search(line)
+        if match:
+            mult, item, total_price, lot_id = match.groups()
+            lots.append((int(mult), item.strip(), int(total_price), lot_id))
+    return lots
+
+
+def _parse_fish_caught(text: str, text_lower: str) -> Optional[Dict]:
+    fish_match = FISH_CAUGHT_PATTERN.search(text_lower)
+    if not fish_match:
+        return None
+    # Вес переводится в граммы один раз при разборе сообщения
+    return {
+        "weight_g": round(float(fish_match.group(1)) * 1000),
+        "price": int(fish_match.group(2)),
+    }
+
+
+def _parse_auction_bought(text: str, text_lower: str) -> Optional[Dict]:
+    bought_match = AUCTION_BOUGHT_PATTERN.search(text_lower)
+    if not bought_match:
+        return None
+    return {
+        "buyer_id": int(bought_match.group(1)),
+        "quantity": int(bought_match.group(2)),
+        "item_name": bought_match.group(3),
+    }
+
+
+# Разбор полей по типу сообщения; типы без полей сюда не входят
+KIND_PARSERS = {
+    MessageKind.AUCTION_LOTS: lambda text, text_lower: {
+        "lots": parse_auction_lots(text_lower)
+    },
+    MessageKind.FISH_CAUGHT: _parse_fish_caught,
+    MessageKind.AUCTION_BOUGHT: _parse_auction_bought,
+}
+
+
+def classify(text: str, text_lower: str) -> Dict[MessageKind, Dict]:
+    """
+    Определение типов игрового сообщения и извлечение их полей.
+
+    Маркеры проверяются независимо друг от друга, как отдельные фильтры
+    обработчиков: сообщение, содержащее несколько маркеров, получает
+    все соответствующие типы.
+
+    :param text: Исходный текст сообщения.
+    :param text_lower: Текст сообщения в нижнем регистре.
+    :return: Словарь {тип сообщения: извлеченные поля}, пустой для
+            сообщений, не относящихся к игре.
+    """
+    kinds = {}
+    if text_lower.startswith(ITEM_TRANSFER_PREFIXES):
+        fields = parse_item_message(text)
+        if fields is not None:
+            kinds[MessageKind.ITEM_TRANSFER] = fields
+    for marker, kind in KIND_MARKERS:
+        if marker not in text_lower:
+            continue
+        parser = KIND_PARSERS.get(kind)
+        fields = parser(text, text_lower) if parser is not None else {}
+        if fields is not None:
+            kinds[kind] = fields
+    return kinds
@@ -1,106 +1,1014 @@
+import atexit
+import functools
+import logging
+import os
+import queue
 import sqlite3
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from enum import IntEnum
 from sqlite3 import Connection, Cursor
-from typing import Optional, List, Tuple, Dict, Any
+from typing import (
+    Optional,
+    List,
+    Tuple,
+    Dict,
+    Any,
+    NamedTuple,
+    Iterable,
+    Set,
+    Callable,
+)
 import datetime
 
+from bot.metrics import measure_queries
 
+FISHING_STAT_TYPES = (
+    "FISHING_START",
+    "FISHING_MAP_ACTIVATED",
+    "FISH_WEIGHT",
+    "FISH_PRICE",
+)
+FISHING_STAT_TYPES_SQL = ", ".join(f"'{stat_type}'" for stat_type in FISHING_STAT_TYPES)
+# Ключ Meta: день, до которого сырые строки рыбалки удалены политикой хранения
+# и остались только в дневной сводке StatsDaily
+STATS_COMPACTED_BEFORE_KEY = "stats_compacted_before"
+# Ключи Meta переноса строк рыбалки из Stats в FishingEvent и FishCatch:
+# stat_id последней обработанной строки основного прохода, stat_id последней
+# обработанной строки прохода по оставшимся без пары строкам и признак
+# завершения переноса
+STATS_MIGRATION_CURSOR_KEY = "stats_migration_cursor"
+STATS_MIGRATION_TAIL_KEY = "stats_migration_tail"
+STATS_MIGRATION_DONE_KEY = "stats_migration_done"
+# Допустимые значения PRAGMA synchronous, значение подставляется в текст запроса
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+class FishingEventType(IntEnum):
+    """
+    Тип события рыбалки в таблице FishingEvent.
+    """
+
+    START = 1
+    MAP_ACTIVATED = 2
+
+
+def _stat_number(text: Optional[str], scale: int) -> Optional[int]:
+    # Как при переносе Stats: пустое значение не учитывается
+    if not text:
+        return None
+    try:
+        value = float(text) * scale
+    except ValueError:
+        return None
+    return round(value) if scale > 1 else int(value)
+
+
+def fishing_records(
+    stats: Iterable[Tuple[int, int, str, Optional[str]]],
+) -> Tuple[
+    List[Tuple[int, int, int]], List[Tuple[int, int, Optional[int], Optional[int]]]
+]:
+    """
+    Преобразование записей рыбалки в формате Stats в строки FishingEvent и FishCatch.
+
+    Вес и цена с одной временной меткой объединяются в одну строку улова,
+    записи других типов пропускаются.
+
+    :param stats: Записи (user_id, timestamp, type, text).
+    :return: Кортеж (события (user_id, ts, type), улов (user_id, ts, weight_g, price)).
+    """
+    events: List[Tuple[int, int, int]] = []
+    catches: List[Tuple[int, int, Optional[int], Optional[int]]] = []
+    # Вес, ожидающий цену той же рыбы: та же метка времени
+    weights: Dict[Tuple[int, int], List[Optional[int]]] = {}
+    prices: List[Tuple[int, int, Optional[int]]] = []
+    for user_id, timestamp, type, text in stats:
+        ts = int(timestamp)
+        if type == "FISHING_START":
+            events.append((user_id, ts, FishingEventType.START))
+        elif type == "FISHING_MAP_ACTIVATED":
+            events.append((user_id, ts, FishingEventType.MAP_ACTIVATED))
+        elif type == "FISH_WEIGHT":
+            weights.setdefault((user_id, ts), []).append(_stat_number(text, 1000))
+        elif type == "FISH_PRICE":
+            prices.append((user_id, ts, _stat_number(text, 1)))
+    for user_id, ts, price in prices:
+        pending = weights.get((user_id, ts))
+        weight_g = pending.pop(0) if pending else None
+        catches.append((user_id, ts, weight_g, price))
+    for (user_id, ts), pending in weights.items():
+        catches += [(user_id, ts, weight_g, None) for weight_g in pending]
+    return events, catches
+
+
+# Агрегаты дневной сводки по строкам Stats: используются и при пересборке
+# StatsDaily, и при подсчете краевых неполных дней периода
+FISHING_AGGREGATES_SQL = """
+    COALESCE(SUM(type = 'FISHING_START'), 0),
+    COALESCE(SUM(type = 'FISHING_MAP_ACTIVATED'), 0),
+    TOTAL(CASE WHEN type = 'FISH_WEIGHT' AND text <> '' THEN CAST(text AS REAL) END),
+    COALESCE(SUM(type = 'FISH_WEIGHT' AND text <> ''), 0),
+    COALESCE(SUM(CASE WHEN type = 'FISH_PRICE' AND text <> '' THEN CAST(text AS INTEGER) END), 0),
+    COALESCE(SUM(type = 'FISH_PRICE' AND text <> ''), 0)
+"""
+
+# Прибавление к сводке за день агрегатов пачки строк FishingEvent и FishCatch,
+# посчитанных при записи
+FISHING_DAILY_ADD_SQL = """
+    INSERT INTO StatsDaily (
+        user_id, day, fishing_starts, map_activations,
+        weight_sum, weight_count, price_sum, price_count
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        fishing_starts = fishing_starts + excluded.fishing_starts,
+        map_activations = map_activations + excluded.map_activations,
+        weight_sum = weight_sum + excluded.weight_sum,
+        weight_count = weight_count + excluded.weight_count,
+        price_sum = price_sum + excluded.price_sum,
+        price_count = price_count + excluded.price_count
+"""
+
+# Агрегаты сводки по типизированным таблицам за полуинтервал [ts, ts)
+FISHING_EVENT_AGGREGATES_SQL = f"""
+    SELECT COALESCE(SUM(type = {FishingEventType.START.value}), 0),
+           COALESCE(SUM(type = {FishingEventType.MAP_ACTIVATED.value}), 0),
+           0, 0, 0, 0
+    FROM FishingEvent
+    WHERE user_id = ? AND ts >= ? AND ts < ?
+"""
+FISH_CATCH_AGGREGATES_SQL = """
+    SELECT 0, 0,
+           TOTAL(weight_g) / 1000.0,
+           COUNT(weight_g),
+           COALESCE(SUM(price), 0),
+           COUNT(price)
+    FROM FishCatch
+    WHERE user_id = ? AND ts >= ? AND ts < ?
+"""
+
+
+def local_day(ts: int) -> str:
+    """
+    День временной метки по локальному времени, в котором ведется дневная сводка.
+
+    :param ts: Временная метка.
+    :return: День в формате YYYY-MM-DD.
+    """
+    return datetime.date.fromtimestamp(ts).isoformat()
+
+
+def local_day_start(day: datetime.date) -> int:
+    """
+    Временная метка начала дня по локальному времени.
+
+    :param day: День.
+    :return: Временная метка полуночи.
+    """
+    return int(datetime.datetime.combine(day, datetime.time()).timestamp())
+
+
+class FishingSummary(NamedTuple):
+    """
+    Сводка рыбалки пользователя за период.
+    """
+
+    fishing_starts: int = 0
+    map_activations: int = 0
+    weight_sum: float = 0.0
+    weight_count: int = 0
+    price_sum: int = 0
+    price_count: int = 0
+
+    @property
+    def avg_weight(self) -> float:
+        return self.weight_sum / self.weight_count if self.weight_count else 0
+
+    @property
+    def avg_price(self) -> float:
+        return self.price_sum / self.price_count if self.price_count else 0
+
+    def merge(self, *others: Tuple) -> "FishingSummary":
+        """
+        Сложение сводки с другими сводками или строками агрегатов.
+        """
+        return FishingSummary(*(sum(values) for values in zip(self, *others)))
+
+
+class LongPollCursor(NamedTuple):
+    """
+    Сохраненная позиция long poll бота и ID последних обработанных сообщений.
+    """
+
+    ts: int
+    pts: Optional[int]
+    message_ids: Tuple[int, ...] = ()
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        db_name: str,
+        wal: bool = True,
+        synchronous: str = "NORMAL",
+        busy_timeout: int = 5000,
+        write_batch: int = 100,
+    ):
+        """
+        Пул соединений SQLite: одно долгоживущее соединение только для чтения
+        на поток и один поток записи DatabaseWriter на файл базы.
+
+        :param db_name: Имя SQLite файла базы данных.
+        :param wal: Включить журналирование WAL.
+        :param synchronous: Значение PRAGMA synchronous.
+        :param busy_timeout: Время ожидания блокировки базы в миллисекундах.
+        :param write_batch: Максимальное количество операций записи в одной транзакции.
+        """
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(
+                f"Invalid synchronous mode {synchronous!r}, "
+                f"expected one of {', '.join(SYNCHRONOUS_MODES)}"
+            )
+        self.db_name = db_name
+        self.wal = wal
+        self.synchronous = synchronous.upper()
+        self.busy_timeout = busy_timeout
+        self.write_batch = write_batch
+        self.writer: Optional[DatabaseWriter] = None
+        self.schema_ready = False
+        # Пары (user_id, chat_id), для которых уже выполнен bootstrap_tenants
+        self.ready_tenants: Set[Tuple[int, int]] = set()
+        # Перенос строк рыбалки из Stats завершен / уже запущен в этом процессе
+        self.stats_migrated = False
+        self.stats_migration_started = False
+        self._local = threading.local()
+        self._connections: Dict[threading.Thread, Connection] = {}
+        self._lock = threading.Lock()
+
+    def get(self) -> Connection:
+        """
+        Получение соединения текущего потока, при первом обращении оно создается.
+
+        :return: Объект соединения с базой данных.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect(read_only=True)
+            self._local.conn = conn
+            with self._lock:
+                self._close_dead()
+                self._connections[threading.current_thread()] = conn
+        return conn
+
+    def get_writer(self) -> "DatabaseWriter":
+        """
+        Получение потока записи файла базы, при первом обращении он запускается.
+
+        :return: Поток записи.
+        """
+        with self._lock:
+            if self.writer is None:
+                self.writer = DatabaseWriter(self, self.write_batch)
+            return self.writer
+
+    def _connect(self, read_only: bool = False) -> Connection:
+        # check_same_thread=False нужен только для close_all при завершении процесса,
+        # каждое соединение используется одним потоком
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA foreign_keys = ON")
+        # Действует только для новой базы, до создания таблиц: освобожденные
+        # удалением страницы возвращаются через PRAGMA incremental_vacuum
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        if self.wal:
+            conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        if read_only:
+            # Изменения выполняет только поток записи
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _after_fork(self) -> None:
+        # Соединения и поток записи родительского процесса в дочернем
+        # не используются, подготовленные пользователи остаются
+        self._local = threading.local()
+        self._connections = {}
+        self._lock = threading.Lock()
+        self.writer = None
+
+    def _close_dead(self) -> None:
+        for thread in [t for t in self._connections if not t.is_alive()]:
+            self._connections.pop(thread).close()
+
+    def close(self) -> None:
+        """
+        Закрытие соединения текущего потока.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            self._connections.pop(threading.current_thread(), None)
+        conn.close()
+
+    def close_all(self) -> None:
+        """
+        Закрытие всех соединений пула и остановка потока записи.
+        """
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+            writer = self.writer
+        if writer is not None:
+            writer.close()
+        for conn in connections:
+            conn.close()
+
+    def size(self) -> int:
+        """
+        Количество открытых соединений.
+
+        :return: Число соединений в пуле.
+        """
+        with self._lock:
+            return len(self._connections)
+
+
+_STOP = object()
+
+
+class DatabaseWriter:
+    def __init__(self, pool: "ConnectionPool", max_batch: int = 100):
+        """
+        Единственный поток записи в файл базы данных.
+
+        Все изменения базы выполняет этот поток через собственное соединение:
+        операции из очереди объединяются в группы до max_batch и выполняются
+        одной транзакцией, каждая в своей точке сохранения SAVEPOINT, поэтому
+        ошибка одной операции откатывает только ее. Результат операции
+        передается через Future после фиксации транзакции, тогда же
+        выполняются отложенные операцией обновления кэшей. Потоки ботов не
+        ждут друг друга на блокировке файла базы, а читают через соединения
+        пула только для чтения.
+
+        Поток записи единственный в пределах процесса: в режиме шардов у
+        каждого процесса-шарда свой поток записи, и между процессами
+        транзакции BEGIN IMMEDIATE ждут друг друга до busy_timeout.
+
+        :param pool: Пул соединений файла базы.
+        :param max_batch: Максимальное количество операций в одной транзакции.
+        """
+        self.pool = pool
+        self.max_batch = max_batch
+        self.conn: Optional[Connection] = None
+        self.transactions = 0
+        self.operations = 0
+        self.failed = 0
+        self._queue: "queue.Queue" = queue.Queue()
+        # Действия выполняемой операции группы, ожидающие фиксации транзакции
+        self._after_commit: Optional[List[Callable[[], None]]] = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, operation: Callable[[], Any], transaction: bool = True) -> Future:
+        """
+        Постановка операции в очередь потока записи.
+
+        :param operation: Функция без аргументов, выполняемая потоком записи.
+        :param transaction: Выполнить операцию в общей транзакции группы,
+                False - отдельно, вне транзакции, например VACUUM.
+        :return: Future с результатом операции.
+        """
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                future.set_exception(RuntimeError("Database writer is closed"))
+            else:
+                self._queue.put((operation, transaction, future))
+        return future
+
+    def after_commit(self, action: Callable[[], None]) -> None:
+        """
+        Откладывание действия операции записи до фиксации ее транзакции.
+
+        Вызывается из операции в потоке записи, например для обновления кэша.
+        Если операция или транзакция откатывается, действие не выполняется.
+        Вне транзакции группы действие выполняется сразу.
+
+        :param action: Функция без аргументов.
+        """
+        if self._after_commit is None:
+            action()
+        else:
+            self._after_commit.append(action)
+
+    def owns_thread(self) -> bool:
+        """
+        Проверка, что вызов выполняется потоком записи.
+
+        :return: True в потоке записи.
+        """
+        return threading.current_thread() is self._thread
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Выполнение операций, поставленных в очередь, и остановка потока записи.
+
+        :param timeout: Максимальное время ожидания в секундах.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики потока записи.
+
+        :return: Глубина очереди, число транзакций, выполненных и неудачных операций.
+        """
+        return {
+            "queue_depth": self._queue.qsize(),
+            "transactions": self.transactions,
+            "operations": self.operations,
+            "failed": self.failed,
+        }
+
+    def _run(self) -> None:
+        self.conn = self.pool._connect()
+        while True:
+            item = self._queue.get()
+            batch: List[Tuple[Callable[[], Any], Future]] = []
+            # Группа набирается только из уже ожидающих операций, поток записи
+            # не ждет новых, поэтому одиночная операция не задерживается
+            while item is not _STOP:
+                operation, transaction, future = item
+                if transaction:
+                    batch.append((operation, future))
+                else:
+                    self._execute_batch(batch)
+                    batch = []
+                    self._execute(operation, future)
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._execute_batch(batch)
+            if item is _STOP:
+                self.conn.close()
+                return
+
+    def _execute(self, operation: Callable[[], Any], future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        self.operations += 1
+        try:
+            future.set_result(operation())
+        except Exception as e:
+            self.failed += 1
+            future.set_exception(e)
+
+    def _execute_batch(self, batch: List[Tuple[Callable[[], Any], Future]]) -> None:
+        if not batch:
+            return
+        results: List[Tuple[Future, Any, Optional[BaseException]]] = []
+        actions: List[Callable[[], None]] = []
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for operation, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.conn.execute("SAVEPOINT operation")
+                self._after_commit = []
+                try:
+                    result = operation()
+                except Exception as e:
+                    self.conn.execute("ROLLBACK TO operation")
+                    self.conn.execute("RELEASE operation")
+                    results.append((future, None, e))
+                    continue
+                finally:
+                    operation_actions, self._after_commit = self._after_commit, None
+                self.conn.execute("RELEASE operation")
+                actions += operation_actions
+                results.append((future, result, None))
+            self.conn.commit()
+        except Exception as e:
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            logging.error(f"Database write transaction failed: {e}")
+            self.failed += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.transactions += 1
+        self.operations += len(results)
+        # Кэши обновляются только после фиксации и до передачи результатов
+        for action in actions:
+            try:
+                action()
+            except Exception as e:
+                logging.error(f"Database post-commit update failed: {e}")
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                self.failed += 1
+                future.set_exception(error)
+
+
+def write_operation(method: Callable) -> Callable:
+    """
+    Декоратор метода DatabaseHandler, изменяющего базу.
+
+    Метод выполняется потоком записи файла базы в общей транзакции группы
+    операций и сам ее не фиксирует. Вызывающий поток ждет результат метода,
+    а с wait=False сразу получает Future, ошибки которого пишутся в лог.
+    Вызов из потока записи, например из другой операции, выполняется сразу.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, wait: bool = True, **kwargs):
+        if self.writer.owns_thread():
+            return method(self, *args, **kwargs)
+        future = self.writer.submit(functools.partial(method, self, *args, **kwargs))
+        if wait:
+            return future.result()
+        future.add_done_callback(functools.partial(_log_write_error, method.__name__))
+        return future
+
+    return wrapper
+
+
+def _log_write_error(name: str, future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Database write {name} failed: {future.exception()}")
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name: str, **options) -> ConnectionPool:
+    """
+    Получение общего для процесса пула соединений к файлу базы данных.
+
+    :param db_name: Имя SQLite файла базы данных.
+    :param options: Параметры пула, используются при его создании.
+    :return: Пул соединений.
+    """
+    with _pools_lock:
+        pool = _pools.get(db_name)
+        if pool is None:
+            pool = _pools[db_name] = ConnectionPool(db_name, **options)
+        return pool
+
+
+class ItemsCache:
+    def __init__(self):
+        """
+        Кэш списков цен пользователей из таблицы Items.
+
+        Словари пользователей не изменяются на месте: при записи создается новый
+        словарь и атомарно подменяет старый, поэтому чтение не требует блокировок,
+        а полученный словарь остается согласованным снимком.
+        """
+        self._items: Dict[int, Dict[str, Tuple[int, str]]] = {}
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Dict[str, Tuple[int, str]]]:
+        """
+        Получение закэшированного списка цен.
+
+        :param user_id: Идентификатор пользователя.
+        :return: Словарь предметов или None, если список еще не загружен.
+        """
+        return self._items.get(user_id)
+
+    def generation(self, user_id: int) -> int:
+        """
+        Номер версии списка пользователя, увеличивается при каждой записи.
+
+        :param user_id: Идентификатор пользователя.
+        :return: Номер версии.
+        """
+        return self._generations.get(user_id, 0)
+
+    def load(
+        self, user_id: int, items: Dict[str, Tuple[int, str]], generation: int
+    ) -> Dict[str, Tuple[int, str]]:
+        """
+        Сохранение списка, прочитанного из базы.
+
+        Если после начала чтения список успел измениться, прочитанные данные
+        считаются устаревшими и в кэш не попадают.
+
+        :param user_id: Идентификатор пользователя.
+        :param items: Словарь предметов.
+        :param generation: Номер версии, полученный до чтения из базы.
+        :return: Словарь предметов.
+        """
+        with self._lock:
+            if self._generations.get(user_id, 0) == generation:
+                self._items[user_id] = items
+        return items
+
+    def set_item(self, user_id: int, item_name: str, value: Tuple[int, str]) -> None:
+        """
+        Добавление или замена предмета в списке пользователя.
+
+        :param user_id: Идентификатор пользователя.
+        :param item_name: Название предмета.
+        :param value: Кортеж (цена, валюта).
+        """
+        with self._lock:
+            self._bump(user_id)
+            items = self._items.get(user_id)
+            if items is not None:
+                self._items[user_id] = {**items, item_name: value}
+
+    def update_price(self, user_id: int, item_name: str, price: int) -> None:
+        """
+        Обновление цены предмета в списке пользователя.
+
+        :param user_id: Идентификатор пользователя.
+        :param item_name: Название предмета.
+        :param price: Новая цена.
+        """
+        with self._lock:
+            self._bump(user_id)
+            items = self._items.get(user_id)
+            if items is not None and item_name in items:
+                self._items[user_id] = {
+                    **items,
+                    item_name: (price, items[item_name][1]),
+                }
+
+    def delete_item(self, user_id: int, item_name: str) -> None:
+        """
+        Удаление предмета из списка пользователя.
+
+        :param user_id: Идентификатор пользователя.
+        :param item_name: Название предмета.
+        """
+        with self._lock:
+            self._bump(user_id)
+            items = self._items.get(user_id)
+            if items is not None and item_name in items:
+                items = dict(items)
+                del items[item_name]
+                self._items[user_id] = items
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """
+        Сброс списка пользователя или всего кэша.
+
+        :param user_id: Идентификатор пользователя, None - сбросить всех.
+        """
+        with self._lock:
+            user_ids = list(self._items) if user_id is None else [user_id]
+            for uid in user_ids:
+                self._bump(uid)
+                self._items.pop(uid, None)
+
+    def _bump(self, user_id: int) -> None:
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+
+_items_caches: Dict[str, ItemsCache] = {}
+
+
+def get_items_cache(db_name: str) -> ItemsCache:
+    """
+    Получение общего для процесса кэша списков цен для файла базы данных.
+
+    :param db_name: Имя SQLite файла базы данных.
+    :return: Кэш списков цен.
+    """
+    with _pools_lock:
+        return _items_caches.setdefault(db_name, ItemsCache())
+
+
+def _reset_after_fork() -> None:
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    for pool in _pools.values():
+        pool._after_fork()
+    for cache in _items_caches.values():
+        cache._lock = threading.Lock()
+
+
+# Процесс, созданный fork после открытия базы, не должен пользоваться
+# соединениями и потоком записи родителя
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@measure_queries(exclude=("convert_timestamp",))
 class DatabaseHandler:
-    def __init__(self, db_name: str = "data/database.db"):
+    def __init__(
+        self,
+        db_name: str = "data/database.db",
+        wal: bool = True,
+        synchronous: str = "NORMAL",
+        busy_timeout: int = 5000,
+        tenant: str = "",
+        write_batch: int = 100,
+    ):
         """
         Инициализация DatabaseHandler с именем базы данных.
 
+        Все экземпляры для одного файла используют общий пул соединений,
+        таблицы создаются один раз за время работы процесса.
+
         :param db_name: Имя SQLite файла базы данных.
+        :param wal: Включить журналирование WAL.
+        :param synchronous: Значение PRAGMA synchronous.
+        :param busy_timeout: Время ожидания блокировки базы в миллисекундах.
+        :param tenant: Имя бота для меток метрик запросов.
+        :param write_batch: Максимальное количество операций записи в одной транзакции.
         """
         self.db_name = db_name
-        self._create_tables()
+        self.tenant = tenant
+        self.pool = get_pool(
+            db_name,
+            wal=wal,
+            synchronous=synchronous,
+            busy_timeout=busy_timeout,
+            write_batch=write_batch,
+        )
+        self.writer = self.pool.get_writer()
+        self.items_cache = get_items_cache(db_name)
+        if not self.pool.schema_ready:
+            self._create_tables()
+            self.pool.schema_ready = True
 
+    @write_operation
     def _create_tables(self) -> None:
         """
-        Создание таблиц User, Autopost, Items и Stats в базе данных, если они еще не созданы.
+        Создание таблиц User, Autopost, Items, Stats, FishingEvent, FishCatch, StatsDaily, LongPollCursor, Meta и индексов в базе данных, если они еще не созданы.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS User (
-                    user_id INTEGER PRIMARY KEY NOT NULL
-                )
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'StatsDaily'"
+        )
+        daily_exists = cursor.fetchone() is not None
+        cursor.execute(
             """
+            CREATE TABLE IF NOT EXISTS User (
+                user_id INTEGER PRIMARY KEY NOT NULL
             )
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS Autopost (
-                    user_id INTEGER NOT NULL,
-                    chat_id INTEGER NOT NULL,
-                    text TEXT,
-                    PRIMARY KEY (user_id, chat_id),
-                    FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE ON UPDATE CASCADE
-                )
+        """
+        )
+        cursor.execute(
             """
+            CREATE TABLE IF NOT EXISTS Autopost (
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                text TEXT,
+                PRIMARY KEY (user_id, chat_id),
+                FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE ON UPDATE CASCADE
             )
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS Items (
-                    user_id INTEGER NOT NULL,
-                    item_name TEXT NOT NULL,
-                    price INTEGER NOT NULL,
-                    currency TEXT NOT NULL,
-                    PRIMARY KEY (user_id, item_name),
-                    FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE ON UPDATE CASCADE
-                )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Items (
+                user_id INTEGER NOT NULL,
+                item_name TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                currency TEXT NOT NULL,
+                PRIMARY KEY (user_id, item_name),
+                FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE ON UPDATE CASCADE
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Stats (
+                stat_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+                user_id INTEGER NOT NULL,
+                timestamp DATETIME NOT NULL,
+                type TEXT NOT NULL,
+                text TEXT,
+                FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE ON UPDATE CASCADE
+            )
+        """
+        )
+        # События рыбалки и улов с метками времени в секундах и числовыми
+        # значениями: одна строка на событие или пойманную рыбу
+        cursor.execute(
             """
+            CREATE TABLE IF NOT EXISTS FishingEvent (
+                user_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                type INTEGER NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE ON UPDATE CASCADE
             )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_fishing_event_user_ts
+            ON FishingEvent (user_id, ts, type)
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS FishCatch (
+                user_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                weight_g INTEGER,
+                price INTEGER,
+                FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE ON UPDATE CASCADE
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_fish_catch_user_ts
+            ON FishCatch (user_id, ts, weight_g, price)
+        """
+        )
+        # Дневная сводка рыбалки, поддерживается при каждой записи строк рыбалки
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS StatsDaily (
+                user_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                fishing_starts INTEGER NOT NULL DEFAULT 0,
+                map_activations INTEGER NOT NULL DEFAULT 0,
+                weight_sum REAL NOT NULL DEFAULT 0,
+                weight_count INTEGER NOT NULL DEFAULT 0,
+                price_sum INTEGER NOT NULL DEFAULT 0,
+                price_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day),
+                FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE ON UPDATE CASCADE
+            ) WITHOUT ROWID
+        """
+        )
+        # Позиция long poll для продолжения после перезапуска процесса
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS LongPollCursor (
+                user_id INTEGER PRIMARY KEY NOT NULL,
+                ts INTEGER NOT NULL,
+                pts INTEGER,
+                message_ids TEXT NOT NULL DEFAULT '',
+                updated_at INTEGER NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE ON UPDATE CASCADE
+            )
+        """
+        )
+        # Служебные значения базы: состояние политики хранения и миграций
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Meta (
+                key TEXT PRIMARY KEY NOT NULL,
+                value TEXT
+            )
+        """
+        )
+        # Покрывающий индекс для выборок статистики пользователя по типу и периоду
+        # нужен, пока строки рыбалки не перенесены из Stats: до этого сводка
+        # читает из Stats краевые дни. Последняя пачка переноса удаляет его
+        cursor.execute("SELECT 1 FROM Meta WHERE key = ?", (STATS_MIGRATION_DONE_KEY,))
+        if cursor.fetchone() is None:
             cursor.execute(
                 """
-                CREATE TABLE IF NOT EXISTS Stats (
-                    stat_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    timestamp DATETIME NOT NULL,
-                    type TEXT NOT NULL,
-                    text TEXT,
-                    FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE ON UPDATE CASCADE
-                )
+                CREATE INDEX IF NOT EXISTS idx_stats_user_type_timestamp
+                ON Stats (user_id, type, timestamp, text)
             """
             )
-            conn.commit()
+        if not daily_exists:
+            self._rebuild_daily_stats(cursor)
 
     def _get_connection(self) -> Connection:
         """
-        Получение соединения с базой данных с включенной поддержкой внешних ключей.
+        Получение соединения текущего потока с включенной поддержкой внешних ключей:
+        в потоке записи - соединения записи, в остальных - только для чтения.
 
         :return: Объект соединения с базой данных.
         """
-        conn = sqlite3.connect(self.db_name)
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+        if self.writer.owns_thread():
+            return self.writer.conn
+        return self.pool.get()
+
+    def close(self) -> None:
+        """
+        Закрытие соединения текущего потока.
+        """
+        self.pool.close()
 
+    @write_operation
     def add_user(self, user_id: int) -> int:
         """
         Добавление пользователя в таблицу User.
 
         :param user_id: Идентификатор пользователя.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO User (user_id) VALUES (?)", (user_id,))
+        return cursor.lastrowid
+
+    @write_operation
+    def bootstrap_tenants(self, tenants: Iterable[Tuple[int, int]]) -> None:
+        """
+        Подготовка базы к запуску ботов: добавление пользователей и их автопостов
+        одной транзакцией и загрузка их списков цен в кэш.
+
+        При запуске процесса вызывается один раз для всех ботов, а затем
+        каждым ботом для себя. Повторный вызов для уже подготовленных пар
+        не обращается к базе.
+
+        :param tenants: Пары (user_id, chat_id) пользователей и чатов автопоста.
+        """
+        tenants = [
+            tenant
+            for tenant in dict.fromkeys(tenants)
+            if tenant not in self.pool.ready_tenants
+        ]
+        if not tenants:
+            return
+        user_ids = list(dict.fromkeys(user_id for user_id, _ in tenants))
+        generations = {
+            user_id: self.items_cache.generation(user_id) for user_id in user_ids
+        }
+        items: Dict[int, Dict[str, Tuple[int, str]]] = {
+            user_id: {} for user_id in user_ids
+        }
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT OR IGNORE INTO User (user_id) VALUES (?)",
+            [(user_id,) for user_id in user_ids],
+        )
+        cursor.executemany(
+            "INSERT OR IGNORE INTO Autopost (user_id, chat_id) VALUES (?, ?)",
+            tenants,
+        )
+        # Количество параметров запроса SQLite ограничено
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start : start + 500]
             cursor.execute(
-                "INSERT OR IGNORE INTO User (user_id) VALUES (?)", (user_id,)
+                "SELECT user_id, item_name, price, currency FROM Items "
+                f"WHERE user_id IN ({', '.join('?' * len(chunk))})",
+                chunk,
             )
-            conn.commit()
-            return cursor.lastrowid
+            for user_id, item_name, price, currency in cursor:
+                items[user_id][item_name] = (price, currency)
+        self.writer.after_commit(
+            functools.partial(self._bootstrap_done, tenants, items, generations)
+        )
+
+    def _bootstrap_done(
+        self,
+        tenants: List[Tuple[int, int]],
+        items: Dict[int, Dict[str, Tuple[int, str]]],
+        generations: Dict[int, int],
+    ) -> None:
+        for user_id, user_items in items.items():
+            if self.items_cache.get(user_id) is None:
+                self.items_cache.load(user_id, user_items, generations[user_id])
+        self.pool.ready_tenants.update(tenants)
 
+    @write_operation
     def delete_user(self, user_id: int) -> int:
         """
         Удаление пользователя из таблицы User.
 
         :param user_id: Идентификатор пользователя.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM User WHERE user_id = ?", (user_id,))
-            conn.commit()
-            return cursor.rowcount
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM User WHERE user_id = ?", (user_id,))
+        self.writer.after_commit(
+            functools.partial(self.items_cache.invalidate, user_id)
+        )
+        self.pool.ready_tenants.difference_update(
+            [tenant for tenant in list(self.pool.ready_tenants) if tenant[0] == user_id]
+        )
+        return cursor.rowcount
 
+    @write_operation
     def add_autopost(
         self, user_id: int, chat_id: int, text: Optional[str] = None
     ) -> int:
@@ -111,15 +1019,15 @@ class DatabaseHandler:
         :param chat_id: Идентификатор чата.
         :param text: Текст автопоста.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT OR IGNORE INTO Autopost (user_id, chat_id, text) VALUES (?, ?, ?)",
-                (user_id, chat_id, text),
-            )
-            conn.commit()
-            return cursor.lastrowid
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR IGNORE INTO Autopost (user_id, chat_id, text) VALUES (?, ?, ?)",
+            (user_id, chat_id, text),
+        )
+        return cursor.lastrowid
 
+    @write_operation
     def delete_autopost(self, user_id: int, chat_id: int) -> int:
         """
         Удаление записи из таблицы Autopost.
@@ -127,15 +1035,16 @@ class DatabaseHandler:
         :param user_id: Идентификатор пользователя.
         :param chat_id: Идентификатор чата.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "DELETE FROM Autopost WHERE user_id = ? AND chat_id = ?",
-                (user_id, chat_id),
-            )
-            conn.commit()
-            return cursor.rowcount
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM Autopost WHERE user_id = ? AND chat_id = ?",
+            (user_id, chat_id),
+        )
+        self.pool.ready_tenants.discard((user_id, chat_id))
+        return cursor.rowcount
 
+    @write_operation
     def add_item(self, user_id: int, item_name: str, price: int, currency: str) -> int:
         """
         Добавление записи в таблицу Items.
@@ -145,15 +1054,20 @@ class DatabaseHandler:
         :param price: Цена предмета.
         :param currency: Валюта.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT OR REPLACE INTO Items (user_id, item_name, price, currency) VALUES (?, ?, ?, ?)",
-                (user_id, item_name, price, currency),
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO Items (user_id, item_name, price, currency) VALUES (?, ?, ?, ?)",
+            (user_id, item_name, price, currency),
+        )
+        self.writer.after_commit(
+            functools.partial(
+                self.items_cache.set_item, user_id, item_name, (price, currency)
             )
-            conn.commit()
-            return cursor.lastrowid
+        )
+        return cursor.lastrowid
 
+    @write_operation
     def delete_item(self, user_id: int, item_name: str) -> int:
         """
         Удаление записи из таблицы Items.
@@ -161,48 +1075,505 @@ class DatabaseHandler:
         :param user_id: Идентификатор пользователя.
         :param item_name: Название предмета.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "DELETE FROM Items WHERE user_id = ? AND item_name = ?",
-                (user_id, item_name),
-            )
-            conn.commit()
-            return cursor.rowcount
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM Items WHERE user_id = ? AND item_name = ?",
+            (user_id, item_name),
+        )
+        self.writer.after_commit(
+            functools.partial(self.items_cache.delete_item, user_id, item_name)
+        )
+        return cursor.rowcount
 
+    @write_operation
     def add_stat(
         self, user_id: int, timestamp: int, type: str, text: Optional[str] = None
-    ) -> int:
+    ) -> Optional[int]:
         """
-        Добавление записи в таблицу Stats.
+        Добавление записи статистики.
+
+        Записи рыбалки сохраняются в FishingEvent и FishCatch, остальные типы -
+        в таблицу Stats.
 
         :param user_id: Идентификатор пользователя.
         :param timestamp: Временная метка в виде int.
         :param text: Текст статистики.
         :param type: Тип статистики.
+        :return: Идентификатор записи Stats или None для записи рыбалки.
         """
-        datetime_str = self.convert_timestamp(timestamp)
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT OR IGNORE INTO Stats (user_id, timestamp, text, type) VALUES (?, ?, ?, ?)",
-                (user_id, datetime_str, text, type),
+        if type in FISHING_STAT_TYPES:
+            self.add_stats([(user_id, timestamp, type, text)])
+            return None
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR IGNORE INTO Stats (user_id, timestamp, text, type) VALUES (?, ?, ?, ?)",
+            (user_id, self.convert_timestamp(timestamp), text, type),
+        )
+        return cursor.lastrowid
+
+    @write_operation
+    def add_stats(self, stats: List[Tuple[int, int, str, Optional[str]]]) -> int:
+        """
+        Добавление нескольких записей статистики одной транзакцией.
+
+        Записи рыбалки сохраняются в FishingEvent и FishCatch: сводка читает
+        Stats только до завершения переноса, и записанные туда строки
+        рыбалки в ней бы не учитывались. Вес и цена одной рыбы с одной
+        временной меткой объединяются в одну строку FishCatch. Остальные
+        типы записываются в таблицу Stats.
+
+        :param stats: Список кортежей (user_id, timestamp, type, text).
+        :return: Количество добавленных записей.
+        """
+        events, catches = fishing_records(stats)
+        rows = [
+            (user_id, self.convert_timestamp(timestamp), text, type)
+            for user_id, timestamp, type, text in stats
+            if type not in FISHING_STAT_TYPES
+        ]
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT OR IGNORE INTO Stats (user_id, timestamp, text, type) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        added = cursor.rowcount if rows else 0
+        if events or catches:
+            added += self.add_fishing_records(events, catches)
+        return added
+
+    @write_operation
+    def add_fishing_records(
+        self,
+        events: List[Tuple[int, int, int]],
+        catches: List[Tuple[int, int, Optional[int], Optional[int]]],
+    ) -> int:
+        """
+        Добавление событий рыбалки и улова одной транзакцией.
+
+        Пойманная рыба записывается одной строкой FishCatch с весом и ценой.
+        Строки сразу учитываются в дневной сводке StatsDaily: агрегаты
+        считаются при записи, и сводка за каждый день пачки обновляется одним
+        запросом.
+
+        :param events: Список кортежей (user_id, ts, type), type - FishingEventType.
+        :param catches: Список кортежей (user_id, ts, weight_g, price), вес в граммах.
+        :return: Количество добавленных записей.
+        """
+        daily: Dict[Tuple[int, str], List[float]] = {}
+        for user_id, ts, type in events:
+            totals = daily.setdefault((user_id, local_day(ts)), [0, 0, 0.0, 0, 0, 0])
+            totals[0 if type == FishingEventType.START else 1] += 1
+        for user_id, ts, weight_g, price in catches:
+            totals = daily.setdefault((user_id, local_day(ts)), [0, 0, 0.0, 0, 0, 0])
+            if weight_g is not None:
+                totals[2] += weight_g / 1000
+                totals[3] += 1
+            if price is not None:
+                totals[4] += price
+                totals[5] += 1
+        conn = self._get_connection()
+        conn.executemany(
+            "INSERT INTO FishingEvent (user_id, ts, type) VALUES (?, ?, ?)",
+            events,
+        )
+        conn.executemany(
+            "INSERT INTO FishCatch (user_id, ts, weight_g, price) VALUES (?, ?, ?, ?)",
+            catches,
+        )
+        conn.executemany(
+            FISHING_DAILY_ADD_SQL,
+            [(user_id, day, *totals) for (user_id, day), totals in daily.items()],
+        )
+        return len(events) + len(catches)
+
+    def _insert_daily_stats(
+        self,
+        cursor: Cursor,
+        condition: str,
+        params: Tuple,
+        legacy_condition: str,
+        legacy_params: Tuple,
+    ) -> None:
+        # Сводка собирается из типизированных таблиц и строк Stats, еще не
+        # перенесенных миграцией; condition - отбор строк по user_id и ts,
+        # legacy_condition - по user_id и timestamp в Stats
+        cursor.execute(
+            f"""
+            INSERT INTO StatsDaily
+            SELECT user_id, day, SUM(fishing_starts), SUM(map_activations),
+                   TOTAL(weight_sum), SUM(weight_count), SUM(price_sum), SUM(price_count)
+            FROM (
+                SELECT user_id, date(ts, 'unixepoch', 'localtime') AS day,
+                       SUM(type = {FishingEventType.START.value}) AS fishing_starts,
+                       SUM(type = {FishingEventType.MAP_ACTIVATED.value}) AS map_activations,
+                       0 AS weight_sum, 0 AS weight_count, 0 AS price_sum, 0 AS price_count
+                FROM FishingEvent
+                WHERE {condition}
+                GROUP BY 1, 2
+                UNION ALL
+                SELECT user_id, date(ts, 'unixepoch', 'localtime'), 0, 0,
+                       TOTAL(weight_g) / 1000.0, COUNT(weight_g),
+                       COALESCE(SUM(price), 0), COUNT(price)
+                FROM FishCatch
+                WHERE {condition}
+                GROUP BY 1, 2
+                UNION ALL
+                SELECT user_id, substr(timestamp, 1, 10), {FISHING_AGGREGATES_SQL}
+                FROM Stats
+                WHERE type IN ({FISHING_STAT_TYPES_SQL}) AND {legacy_condition}
+                GROUP BY 1, 2
+            )
+            GROUP BY user_id, day
+        """,
+            (*params, *params, *legacy_params),
+        )
+
+    def _refresh_daily_stats(self, conn: Connection, user_id: int, day: str) -> None:
+        start = datetime.date.fromisoformat(day)
+        next_day = start + datetime.timedelta(days=1)
+        conn.execute(
+            "DELETE FROM StatsDaily WHERE user_id = ? AND day = ?", (user_id, day)
+        )
+        self._insert_daily_stats(
+            conn.cursor(),
+            "user_id = ? AND ts >= ? AND ts < ?",
+            (user_id, local_day_start(start), local_day_start(next_day)),
+            "user_id = ? AND timestamp >= ? AND timestamp < ?",
+            (user_id, day, next_day.isoformat()),
+        )
+
+    def _rebuild_daily_stats(
+        self, cursor: Cursor, user_id: Optional[int] = None
+    ) -> None:
+        # Пересобираются только дни, по которым есть сырые строки: сводка за дни,
+        # сырые строки которых удалены политикой хранения, остается как есть
+        condition = "1" if user_id is None else "user_id = ?"
+        params = () if user_id is None else (user_id,)
+        cursor.execute(
+            f"""
+            DELETE FROM StatsDaily
+            WHERE (user_id, day) IN (
+                SELECT user_id, date(ts, 'unixepoch', 'localtime')
+                FROM FishingEvent
+                WHERE {condition}
+                UNION
+                SELECT user_id, date(ts, 'unixepoch', 'localtime')
+                FROM FishCatch
+                WHERE {condition}
+                UNION
+                SELECT user_id, substr(timestamp, 1, 10)
+                FROM Stats
+                WHERE type IN ({FISHING_STAT_TYPES_SQL}) AND {condition}
+            )
+        """,
+            params * 3,
+        )
+        self._insert_daily_stats(cursor, condition, params, condition, params)
+
+    @write_operation
+    def rebuild_daily_stats(self, user_id: Optional[int] = None) -> None:
+        """
+        Пересборка дневной сводки StatsDaily из строк FishingEvent, FishCatch
+        и строк рыбалки в Stats.
+
+        Дни без сырых строк, в том числе удаленных политикой хранения,
+        не пересобираются.
+
+        :param user_id: Идентификатор пользователя, None - пересобрать для всех.
+        """
+        conn = self._get_connection()
+        self._rebuild_daily_stats(conn.cursor(), user_id)
+
+    @write_operation
+    def delete_old_stats(self, user_id: int, before_day: str, limit: int) -> int:
+        """
+        Удаление одной пачки сырых строк рыбалки старше заданного дня.
+
+        Из FishingEvent, FishCatch и Stats удаляется не больше limit строк
+        из каждой таблицы. Строки уже учтены в дневной сводке StatsDaily,
+        которая не изменяется. Строки Stats других типов не удаляются,
+        так как сводки по ним нет.
+
+        :param user_id: Идентификатор пользователя.
+        :param before_day: День в формате YYYY-MM-DD, строки до начала которого удаляются.
+        :param limit: Максимальное количество удаляемых строк из одной таблицы.
+        :return: Количество удаленных строк.
+        """
+        before_ts = local_day_start(datetime.date.fromisoformat(before_day))
+        deleted = 0
+        conn = self._get_connection()
+        for table in ("FishingEvent", "FishCatch"):
+            deleted += conn.execute(
+                f"""
+                DELETE FROM {table} WHERE rowid IN (
+                    SELECT rowid FROM {table}
+                    WHERE user_id = ? AND ts < ?
+                    LIMIT ?
+                )
+            """,
+                (user_id, before_ts, limit),
+            ).rowcount
+        deleted += conn.execute(
+            f"""
+            DELETE FROM Stats WHERE stat_id IN (
+                SELECT stat_id FROM Stats
+                WHERE user_id = ? AND type IN ({FISHING_STAT_TYPES_SQL})
+                  AND timestamp < ?
+                LIMIT ?
+            )
+        """,
+            (user_id, before_day, limit),
+        ).rowcount
+        return deleted
+
+    def stats_migration_pending(self) -> bool:
+        """
+        Проверка, нужно ли запускать перенос строк рыбалки из Stats.
+
+        Возвращает True не больше одного раза за время работы процесса для
+        файла базы, чтобы перенос выполняла одна задача, а не каждый бот.
+
+        :return: True, если перенос не завершен и еще не запущен.
+        """
+        with _pools_lock:
+            if self.pool.stats_migration_started:
+                return False
+            self.pool.stats_migration_started = True
+        return not self._stats_migrated()
+
+    def _stats_migrated(self) -> bool:
+        if not self.pool.stats_migrated:
+            self.pool.stats_migrated = (
+                self.get_meta(STATS_MIGRATION_DONE_KEY) is not None
+            )
+        return self.pool.stats_migrated
+
+    def migrate_stats(self, chunk_size: int = 1000, pause: float = 0.05) -> int:
+        """
+        Перенос строк рыбалки из Stats в FishingEvent и FishCatch.
+
+        Строки переносятся пачками по chunk_size в порядке stat_id, каждая
+        пачка - отдельной операцией потока записи с паузой между ними,
+        поэтому боты продолжают писать и читать статистику во время переноса. Позиция
+        сохраняется в Meta, после перезапуска перенос продолжается с нее.
+        Строки веса и цены одной рыбы объединяются в одну строку FishCatch,
+        строки, оставшиеся без пары, переносятся вторым проходом такими же
+        пачками. Дневная сводка не изменяется: перенесенные строки в ней
+        уже учтены.
+
+        :param chunk_size: Количество строк Stats в одной пачке.
+        :param pause: Пауза между пачками в секундах.
+        :return: Количество перенесенных строк Stats.
+        """
+        started = time.monotonic()
+        migrated = 0
+        while True:
+            count, done = self._migrate_stats_chunk(chunk_size)
+            migrated += count
+            if done:
+                break
+            time.sleep(pause)
+        self.pool.stats_migrated = True
+        if migrated:
+            logging.info(
+                f"Migrated {migrated} fishing stats rows in "
+                f"{time.monotonic() - started:.1f} s"
+            )
+        return migrated
+
+    @write_operation
+    def _migrate_stats_chunk(self, chunk_size: int) -> Tuple[int, bool]:
+        # Основной проход переносит строки по порядку stat_id, строка веса
+        # без строки цены в той же пачке остается в Stats до второго прохода.
+        # Второй проход теми же ограниченными пачками забирает оставшиеся
+        # строки, в том числе без пары, перенос завершается пустой пачкой
+        select = f"""
+            SELECT stat_id, user_id,
+                   CAST(strftime('%s', timestamp, 'utc') AS INTEGER),
+                   type,
+                   CASE WHEN text <> '' THEN CAST(round(CAST(text AS REAL) * 1000) AS INTEGER) END,
+                   CASE WHEN text <> '' THEN CAST(text AS INTEGER) END
+            FROM Stats
+            WHERE type IN ({FISHING_STAT_TYPES_SQL})
+              AND stat_id > ?
+            ORDER BY stat_id
+            LIMIT ?
+        """
+        conn = self._get_connection()
+        meta = dict(
+            conn.execute(
+                "SELECT key, value FROM Meta WHERE key IN (?, ?, ?)",
+                (
+                    STATS_MIGRATION_CURSOR_KEY,
+                    STATS_MIGRATION_TAIL_KEY,
+                    STATS_MIGRATION_DONE_KEY,
+                ),
+            ).fetchall()
+        )
+        if STATS_MIGRATION_DONE_KEY in meta:
+            return 0, True
+        tail = STATS_MIGRATION_TAIL_KEY in meta
+        key = STATS_MIGRATION_TAIL_KEY if tail else STATS_MIGRATION_CURSOR_KEY
+        position = int(meta.get(key, 0))
+        rows = conn.execute(select, (position, chunk_size)).fetchall()
+        if tail and not rows:
+            conn.execute("DROP INDEX IF EXISTS idx_stats_user_type_timestamp")
+            conn.execute(
+                "DELETE FROM Meta WHERE key IN (?, ?)",
+                (STATS_MIGRATION_CURSOR_KEY, STATS_MIGRATION_TAIL_KEY),
             )
-            conn.commit()
-            return cursor.lastrowid
+            self.set_meta(STATS_MIGRATION_DONE_KEY, "1")
+            return 0, True
+        full = len(rows) == chunk_size
+        if tail and full and len(rows) > 1 and rows[-1][3] == "FISH_WEIGHT":
+            # Цена последней строки веса может оказаться в следующей пачке
+            rows.pop()
+
+        events: List[Tuple[int, int, int]] = []
+        catches: List[Tuple[int, int, Optional[int], Optional[int]]] = []
+        stat_ids: List[Tuple[int]] = []
+        # Строки веса, ожидающие строку цены той же рыбы: та же метка времени
+        weights: Dict[Tuple[int, int], List[Tuple[int, Optional[int]]]] = {}
+        for stat_id, user_id, ts, type, weight_g, price in rows:
+            if type == "FISHING_START":
+                events.append((user_id, ts, FishingEventType.START))
+                stat_ids.append((stat_id,))
+            elif type == "FISHING_MAP_ACTIVATED":
+                events.append((user_id, ts, FishingEventType.MAP_ACTIVATED))
+                stat_ids.append((stat_id,))
+            elif type == "FISH_WEIGHT":
+                weights.setdefault((user_id, ts), []).append((stat_id, weight_g))
+            elif weights.get((user_id, ts)):
+                weight_id, weight_g = weights[(user_id, ts)].pop(0)
+                catches.append((user_id, ts, weight_g, price))
+                stat_ids += [(weight_id,), (stat_id,)]
+            elif tail:
+                catches.append((user_id, ts, None, price))
+                stat_ids.append((stat_id,))
+        if tail:
+            for (user_id, ts), pending in weights.items():
+                for stat_id, weight_g in pending:
+                    catches.append((user_id, ts, weight_g, None))
+                    stat_ids.append((stat_id,))
+
+        conn.executemany(
+            "INSERT INTO FishingEvent (user_id, ts, type) VALUES (?, ?, ?)",
+            events,
+        )
+        conn.executemany(
+            "INSERT INTO FishCatch (user_id, ts, weight_g, price) VALUES (?, ?, ?, ?)",
+            catches,
+        )
+        conn.executemany("DELETE FROM Stats WHERE stat_id = ?", stat_ids)
+        if tail:
+            self.set_meta(STATS_MIGRATION_TAIL_KEY, str(rows[-1][0]))
+        elif full:
+            self.set_meta(STATS_MIGRATION_CURSOR_KEY, str(rows[-1][0]))
+        else:
+            # Основной проход дошел до конца таблицы
+            self.set_meta(STATS_MIGRATION_TAIL_KEY, "0")
+        return len(stat_ids), False
+
+    def get_meta(self, key: str) -> Optional[str]:
+        """
+        Получение служебного значения из таблицы Meta.
+
+        :param key: Ключ.
+        :return: Значение или None, если ключа нет.
+        """
+        with self._get_connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM Meta WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    @write_operation
+    def set_meta(self, key: str, value: Optional[str]) -> None:
+        """
+        Сохранение служебного значения в таблицу Meta.
+
+        :param key: Ключ.
+        :param value: Значение.
+        """
+        conn = self._get_connection()
+        conn.execute(
+            "INSERT INTO Meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def get_storage_stats(self) -> Dict[str, int]:
+        """
+        Размер файла базы в страницах и режим освобождения места.
+
+        :return: Словарь с page_size, page_count, freelist_count и
+                auto_vacuum (0 - выключен, 1 - полный, 2 - инкрементальный).
+        """
+        conn = self._get_connection()
+        return {
+            pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+            for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum")
+        }
+
+    @write_operation
+    def incremental_vacuum(self, pages: int) -> int:
+        """
+        Возврат свободных страниц файловой системе, не больше pages за вызов.
+
+        Работает только в режиме auto_vacuum = INCREMENTAL, в остальных
+        режимах ничего не делает.
+
+        :param pages: Максимальное количество освобождаемых страниц.
+        :return: Количество свободных страниц, оставшихся в файле.
+        """
+        conn = self._get_connection()
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def enable_incremental_vacuum(self) -> None:
+        """
+        Перевод существующей базы в режим auto_vacuum = INCREMENTAL.
+
+        Требует полного VACUUM, который перезаписывает весь файл и на это
+        время блокирует запись в базу.
+        """
 
+        def vacuum() -> None:
+            conn = self._get_connection()
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+
+        # VACUUM нельзя выполнить в транзакции, поток записи выполняет его
+        # отдельно от группы операций
+        self.writer.submit(vacuum, transaction=False).result()
+
+    @write_operation
     def delete_stat(self, stat_id: int) -> int:
         """
         Удаление записи из таблицы Stats.
 
         :param stat_id: Идентификатор статистики.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM Stats WHERE stat_id = ?", (stat_id,))
-            conn.commit()
-            return cursor.rowcount
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        day = self._get_stat_day(conn, stat_id)
+        cursor.execute("DELETE FROM Stats WHERE stat_id = ?", (stat_id,))
+        if day:
+            self._refresh_daily_stats(conn, *day)
+        return cursor.rowcount
+
+    def _get_stat_day(
+        self, conn: Connection, stat_id: int
+    ) -> Optional[Tuple[int, str]]:
+        return conn.execute(
+            "SELECT user_id, substr(timestamp, 1, 10) FROM Stats WHERE stat_id = ?",
+            (stat_id,),
+        ).fetchone()
 
+    @write_operation
     def update_stat(self, stat_id: int, text: str, type: Optional[str] = None) -> None:
         """
         Обновление текста и типа записи в таблице Stats.
@@ -211,14 +1582,17 @@ class DatabaseHandler:
         :param text: Новый текст статистики.
         :param type: Новый тип статистики.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE Stats SET text = ?, type = ? WHERE stat_id = ?",
-                (text, type, stat_id),
-            )
-            conn.commit()
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE Stats SET text = ?, type = ? WHERE stat_id = ?",
+            (text, type, stat_id),
+        )
+        day = self._get_stat_day(conn, stat_id)
+        if day:
+            self._refresh_daily_stats(conn, *day)
 
+    @write_operation
     def update_autopost_text(self, user_id: int, chat_id: int, new_text: str) -> None:
         """
         Обновление текста записи в таблице Autopost.
@@ -227,14 +1601,14 @@ class DatabaseHandler:
         :param chat_id: Идентификатор чата.
         :param new_text: Новый текст автопоста.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE Autopost SET text = ? WHERE user_id = ? AND chat_id = ?",
-                (new_text, user_id, chat_id),
-            )
-            conn.commit()
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE Autopost SET text = ? WHERE user_id = ? AND chat_id = ?",
+            (new_text, user_id, chat_id),
+        )
 
+    @write_operation
     def update_item_price(self, user_id: int, item_name: str, new_price: int) -> None:
         """
         Обновление цены записи в таблице Items.
@@ -243,24 +1617,86 @@ class DatabaseHandler:
         :param item_name: Название предмета.
         :param new_price: Новая цена.
         """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE Items SET price = ? WHERE user_id = ? AND item_name = ?",
+            (new_price, user_id, item_name),
+        )
+        self.writer.after_commit(
+            functools.partial(
+                self.items_cache.update_price, user_id, item_name, new_price
+            )
+        )
+
+    @write_operation
+    def save_longpoll_cursor(
+        self,
+        user_id: int,
+        ts: int,
+        pts: Optional[int],
+        message_ids: Tuple[int, ...] = (),
+    ) -> None:
+        """
+        Сохранение позиции long poll бота пользователя.
+
+        :param user_id: Идентификатор пользователя.
+        :param ts: Номер последнего полученного события long poll.
+        :param pts: Номер последнего события для messages.getLongPollHistory.
+        :param message_ids: ID последних обработанных сообщений.
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO LongPollCursor (user_id, ts, pts, message_ids, updated_at)
+            VALUES (?, ?, ?, ?, strftime('%s', 'now'))
+            ON CONFLICT (user_id) DO UPDATE SET
+                ts = excluded.ts,
+                pts = COALESCE(excluded.pts, pts),
+                message_ids = excluded.message_ids,
+                updated_at = excluded.updated_at
+            """,
+            (user_id, ts, pts, ",".join(map(str, message_ids))),
+        )
+
+    def get_longpoll_cursor(self, user_id: int) -> Optional[LongPollCursor]:
+        """
+        Получение сохраненной позиции long poll бота пользователя.
+
+        :param user_id: Идентификатор пользователя.
+        :return: Позиция long poll или None, если она не сохранялась.
+        """
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "UPDATE Items SET price = ? WHERE user_id = ? AND item_name = ?",
-                (new_price, user_id, item_name),
+                "SELECT ts, pts, message_ids FROM LongPollCursor WHERE user_id = ?",
+                (user_id,),
             )
-            conn.commit()
+            result = cursor.fetchone()
+        if result is None:
+            return None
+        ts, pts, message_ids = result
+        return LongPollCursor(
+            ts, pts, tuple(int(id) for id in message_ids.split(",") if id)
+        )
 
+    @write_operation
     def clear_table(self, table_name: str) -> None:
         """
         Очистка таблицы без удаления.
 
         :param table_name: Название таблицы.
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(f"DELETE FROM {table_name}")
-            conn.commit()
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"DELETE FROM {table_name}")
+        if table_name.lower() == "stats":
+            cursor.execute("DELETE FROM StatsDaily")
+        if table_name.lower() in ("items", "user"):
+            self.writer.after_commit(self.items_cache.invalidate)
+        if table_name.lower() in ("user", "autopost"):
+            self.pool.ready_tenants.clear()
 
     def get_all_users(self) -> List[Tuple[int]]:
         """
@@ -306,13 +1742,109 @@ class DatabaseHandler:
             cursor.execute("SELECT * FROM Stats")
             return cursor.fetchall()
 
+    def get_fishing_summary(self, user_id: int, start: int, end: int) -> FishingSummary:
+        """
+        Сводка рыбалки пользователя за период.
+
+        Полные дни периода берутся из дневной сводки StatsDaily, строки
+        FishingEvent и FishCatch читаются только для неполных краевых дней,
+        поэтому время ответа не зависит от длины периода и объема истории.
+        Границы периода включаются, дни считаются по локальному времени.
+        Начальный день, сырые строки которого удалены политикой хранения,
+        учитывается целиком. Пока перенос старых строк не завершен, краевые
+        дни дополнительно читаются из Stats.
+
+        :param user_id: Идентификатор пользователя.
+        :param start: Начало периода, временная метка.
+        :param end: Конец периода, временная метка.
+        :return: Сводка рыбалки.
+        """
+        start = int(start)
+        end = int(end) + 1
+        first_day = datetime.date.fromtimestamp(start)
+        # Если сырые строки начального дня уже удалены политикой хранения,
+        # этот день берется из дневной сводки целиком
+        compacted_before = self.get_meta(STATS_COMPACTED_BEFORE_KEY)
+        if start != local_day_start(first_day) and (
+            compacted_before is None or first_day.isoformat() >= compacted_before
+        ):
+            first_day += datetime.timedelta(days=1)
+        last_day = datetime.date.fromtimestamp(end)
+
+        # Полуинтервалы [начало, конец) по сырым строкам и по дневной сводке
+        if first_day < last_day:
+            raw_ranges = [
+                (start, local_day_start(first_day)),
+                (local_day_start(last_day), end),
+            ]
+        else:
+            raw_ranges = [(start, end)]
+        migrated = self._stats_migrated()
+
+        with self._get_connection() as conn:
+            if not migrated:
+                # Все запросы читают один снимок базы, чтобы строки пачки,
+                # перенесенной между запросами, не учитывались дважды
+                conn.execute("BEGIN")
+            rows = []
+            for range_start, range_end in raw_ranges:
+                if range_start >= range_end:
+                    continue
+                for query in (FISHING_EVENT_AGGREGATES_SQL, FISH_CATCH_AGGREGATES_SQL):
+                    rows.append(
+                        conn.execute(
+                            query, (user_id, range_start, range_end)
+                        ).fetchone()
+                    )
+                if not migrated:
+                    rows.append(
+                        conn.execute(
+                            f"""
+                            SELECT {FISHING_AGGREGATES_SQL}
+                            FROM Stats
+                            WHERE user_id = ? AND type IN ({FISHING_STAT_TYPES_SQL})
+                              AND timestamp >= ? AND timestamp < ?
+                        """,
+                            (
+                                user_id,
+                                self.convert_timestamp(range_start),
+                                self.convert_timestamp(range_end),
+                            ),
+                        ).fetchone()
+                    )
+            if first_day < last_day:
+                rows.append(
+                    conn.execute(
+                        """
+                        SELECT COALESCE(SUM(fishing_starts), 0),
+                               COALESCE(SUM(map_activations), 0),
+                               TOTAL(weight_sum),
+                               COALESCE(SUM(weight_count), 0),
+                               COALESCE(SUM(price_sum), 0),
+                               COALESCE(SUM(price_count), 0)
+                        FROM StatsDaily
+                        WHERE user_id = ? AND day >= ? AND day < ?
+                    """,
+                        (user_id, first_day.isoformat(), last_day.isoformat()),
+                    ).fetchone()
+                )
+        return FishingSummary().merge(*rows)
+
     def get_items_by_user_id(self, user_id: int) -> Dict[str, Tuple[int, str]]:
         """
         Получение всех предметов по идентификатору пользователя.
 
+        Список читается из базы один раз и дальше отдается из кэша, который
+        обновляется методами add_item, delete_item и update_item_price.
+        Возвращаемый словарь изменять нельзя.
+
         :param user_id: Идентификатор пользователя.
         :return: Словарь предметов, где ключ - название предмета, значение - кортеж (цена, валюта).
         """
+        items = self.items_cache.get(user_id)
+        if items is not None:
+            return items
+        generation = self.items_cache.generation(user_id)
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
@@ -320,9 +1852,11 @@ class DatabaseHandler:
                 (user_id,),
             )
             items = cursor.fetchall()
-            return {
-                item_name: (price, currency) for item_name, price, currency in items
-            }
+        return self.items_cache.load(
+            user_id,
+            {item_name: (price, currency) for item_name, price, currency in items},
+            generation,
+        )
 
     def get_autopost(self, user_id: int, chat_id: int) -> Optional[str]:
         """
@@ -354,6 +1888,4 @@ class DatabaseHandler:
 
 if __name__ == "__main__":
     db = DatabaseHandler("data/database.db")
-    cursor = db._get_connection().cursor()
-    cursor.execute("DROP TABLE STATS")
-    db._get_connection().commit()
+    db.writer.submit(lambda: db._get_connection().execute("DROP TABLE STATS")).result()
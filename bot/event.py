@@ -0,0 +1,150 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from vk_api.longpoll import VkEventType, VkMessageFlag
+
+CHAT_PEER_ID_START = 2000000000
+MESSAGE_NEW = VkEventType.MESSAGE_NEW.value
+OUTBOX = VkMessageFlag.OUTBOX.value
+
+
+class MessageEvent:
+    """
+    Событие нового сообщения long poll.
+
+    Заменяет vk_api.longpoll.Event для событий, которые обрабатывает бот.
+    При создании из события в формате long poll
+    [4, message_id, flags, peer_id, timestamp, text, extra, attachments, ...]
+    копируются только числовые поля, остальные вычисляются при обращении:
+    текст - один раз при первом чтении, отправитель и тип диалога - по peer_id.
+    Атрибуты ограничены __slots__, включая поля, которые заполняют
+    роутер (kinds, kind, fields) и фильтры обработчиков (price, currency, item_name).
+    """
+
+    __slots__ = (
+        "raw",
+        "message_id",
+        "flags",
+        "peer_id",
+        "timestamp",
+        "received_at",
+        "kinds",
+        "kind",
+        "fields",
+        "price",
+        "currency",
+        "item_name",
+        "_text",
+    )
+
+    type = VkEventType.MESSAGE_NEW
+
+    def __init__(self, raw: List, received_at: Optional[float] = None):
+        """
+        Args:
+            raw (List): Событие в формате long poll.
+            received_at (Optional[float]): Время получения события ботом,
+                по умолчанию время сообщения.
+        """
+        self.raw = raw
+        self.message_id: int = raw[1]
+        self.flags: int = raw[2]
+        self.peer_id: int = raw[3]
+        self.timestamp: int = raw[4]
+        self.received_at: float = raw[4] if received_at is None else received_at
+        self.kinds: Dict[Any, Dict[str, Any]] = {}
+        self.kind = None
+        self.fields: Dict[str, Any] = {}
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        # Текст экранирован VK, как в vk_api, заменяются только переводы строк
+        if self._text is None:
+            self._text = self.raw[5].replace("<br>", "\n")
+        return self._text
+
+    @property
+    def message(self) -> str:
+        return (
+            self.text.replace("&lt;", "<")
+            .replace("&gt;", ">")
+            .replace("&quot;", '"')
+            .replace("&amp;", "&")
+        )
+
+    @property
+    def extra_values(self) -> Dict[str, str]:
+        return self.raw[6] if len(self.raw) > 6 else {}
+
+    @property
+    def attachments(self) -> Dict[str, str]:
+        return self.raw[7] if len(self.raw) > 7 else {}
+
+    @property
+    def from_user(self) -> bool:
+        return 0 <= self.peer_id <= CHAT_PEER_ID_START
+
+    @property
+    def from_chat(self) -> bool:
+        return self.peer_id > CHAT_PEER_ID_START
+
+    @property
+    def from_group(self) -> bool:
+        return self.peer_id < 0
+
+    @property
+    def from_me(self) -> bool:
+        return bool(self.flags & OUTBOX)
+
+    @property
+    def to_me(self) -> bool:
+        return not self.flags & OUTBOX
+
+    @property
+    def user_id(self) -> Optional[int]:
+        # Автор сообщения в беседе передается в дополнительных полях
+        if self.peer_id > CHAT_PEER_ID_START:
+            author = self.extra_values.get("from")
+            return int(author) if author is not None else None
+        if self.peer_id < 0:
+            return None
+        return self.peer_id
+
+    @property
+    def group_id(self) -> Optional[int]:
+        return -self.peer_id if self.peer_id < 0 else None
+
+    @property
+    def chat_id(self) -> Optional[int]:
+        if self.peer_id > CHAT_PEER_ID_START:
+            return self.peer_id - CHAT_PEER_ID_START
+        return None
+
+    def __repr__(self) -> str:
+        return (
+            f"MessageEvent(message_id={self.message_id}, peer_id={self.peer_id}, "
+            f"text={self.text!r})"
+        )
+
+
+def parse_messages(
+    updates: Iterable[List], received_at: Optional[float] = None
+) -> Tuple[MessageEvent, ...]:
+    """
+    Выбирает из ответа long poll новые сообщения с текстом.
+
+    События других типов и сообщения без текста отбрасываются по полям
+    исходного списка, объекты для них не создаются.
+
+    Args:
+        updates (Iterable[List]): События в формате long poll.
+        received_at (Optional[float]): Время получения ответа ботом.
+
+    Returns:
+        Tuple[MessageEvent, ...]: События новых сообщений в порядке получения.
+    """
+    return tuple(
+        MessageEvent(raw, received_at)
+        for raw in updates
+        if raw[0] == MESSAGE_NEW and len(raw) > 5 and raw[5]
+    )
@@ -1,14 +1,28 @@
 import configparser
-import threading
-from time import sleep
+import time
+from functools import partial
 import re
-from vk_api.longpoll import Event
 import logging
 from typing import Optional, List, Dict
-from bot.bot import Bot
-from bot.db import DatabaseHandler
+from bot.bot import STOP_TIMEOUT, Bot
+from bot.classifier import MessageKind
+from bot.db import DatabaseHandler, FishingEventType
+from bot.event import MessageEvent
+from bot.journal import open_journal
+from bot.metrics import start_exporter
+from bot.retention import schedule_retention
+from bot.scheduler import get_scheduler
+from bot.sender import Priority
+from bot.stats_writer import get_stats_writer
 import datetime
-import pytz
+
+ADD_ITEM_COMMAND_PATTERN = re.compile(r"предмет (\d+) (\w+) (.+)", re.IGNORECASE)
+STATISTICS_PERIOD_PATTERN = re.compile(
+    r"рыба за (\d+)\s*(день|дня|дней|месяца|месяцев|месяц)"
+)
+# Период автопоста и задержка команды складирования купленного предмета в секундах
+AUTOPOST_COOLDOWN = 10800
+STORE_DELAY = 10
 
 
 class Settings:
@@ -30,42 +44,119 @@ class Settings:
         self.auto_store_items = auto_store_items
 
 
-def autopost(bot, user_id, chat_id, parent_thread, settings, cooldown=10800):
-    while parent_thread.is_alive():
-        if settings.autopost:
-            try:
-                db = DatabaseHandler("data/database.db")
-                autopost_text = db.get_autopost(user_id, chat_id)
-                bot.send(chat_id, autopost_text)
-            except Exception:
-                pass
-            sleep(cooldown)
-        sleep(1)
+def create_database(
+    global_config: configparser.ConfigParser, tenant: str = ""
+) -> DatabaseHandler:
+    """
+    Создание DatabaseHandler с параметрами из секции DATABASE глобального конфига.
+    """
+    return DatabaseHandler(
+        global_config.get("DATABASE", "path", fallback="data/database.db"),
+        wal=global_config.getboolean("DATABASE", "wal", fallback=True),
+        synchronous=global_config.get("DATABASE", "synchronous", fallback="NORMAL"),
+        busy_timeout=global_config.getint("DATABASE", "busy_timeout", fallback=5000),
+        tenant=tenant,
+        write_batch=global_config.getint("DATABASE", "write_batch", fallback=100),
+    )
+
+
+def autopost(bot, db, user_id, chat_id):
+    """
+    Отправка автопоста, выполняется планировщиком раз в AUTOPOST_COOLDOWN
+    секунд, пока автопост включен.
+    """
+    try:
+        autopost_text = db.get_autopost(user_id, chat_id)
+        bot.send(chat_id, autopost_text, priority=Priority.LOW, wait=False)
+    except Exception as e:
+        logging.error("Failed to send autopost: " + str(e))
+
+
+def record_auction_buy(bot, event, lot_id, future):
+    """
+    Замер задержки покупки лота, вызывается после завершения отправки команды.
+
+    Задержка считается от получения события ботом и от времени сообщения
+    по данным VK (с точностью до секунды).
+    """
+    if future.exception() is not None:
+        logging.error(f"Failed to buy auction lot {lot_id}: {future.exception()}")
+        return
+    sent_at = time.time()
+    received_at = event.received_at
+    bot.latency.record("auction_buy", sent_at - received_at)
+    bot.latency.record("auction_buy_since_message", sent_at - event.timestamp)
+    logging.info(
+        f"Auction lot {lot_id} buy sent in {(sent_at - received_at) * 1000:.0f} ms "
+        f"({sent_at - event.timestamp:.1f} s since message)"
+    )
 
 
 def register_handlers(bot: Bot, config: configparser.ConfigParser):
     main_chat_id = int(config["PERSONAL"]["main_chat_id"])
     user_id = int(config["PERSONAL"]["user_id"])
-    db = DatabaseHandler("data/database.db")
-
-    db.add_user(user_id)
-    db.add_autopost(user_id, main_chat_id)
-
     settings = Settings()
-    autopost_thread = threading.Thread(
-        target=autopost,
-        args=(bot, user_id, main_chat_id, threading.current_thread(), settings),
-    ).start()
+    start_exporter(settings.global_config)
+    db = create_database(settings.global_config, bot.name)
+    # Писатель статистики общий для ботов процесса, поэтому его запросы
+    # помечаются в метриках отдельным tenant, а не именем первого бота
+    stats_writer = get_stats_writer(create_database(settings.global_config, "stats"))
+
+    # При запуске процесса база уже подготовлена для всех ботов одной
+    # транзакцией, тогда вызов не обращается к базе. Заодно прогревается кэш
+    # цен, чтобы первая покупка с аукциона не ждала чтения с диска
+    db.bootstrap_tenants([(user_id, main_chat_id)])
+    journal = open_journal(settings.global_config, bot.name)
+    if journal is not None:
+        bot.set_journal(journal)
+        bot.on_shutdown(journal.close)
+    # Позиция long poll хранится в базе, чтобы после перезапуска процесса
+    # бот обработал сообщения, пришедшие за время простоя. Поток long poll
+    # не ждет записи позиции, ее выполняет поток записи базы
+    bot.set_cursor_store(
+        partial(db.get_longpoll_cursor, user_id),
+        partial(db.save_longpoll_cursor, user_id, wait=False),
+    )
+
+    # Автопост и отложенные команды выполняются общим планировщиком процесса,
+    # задачи бота отменяются при его остановке, в том числе в асинхронном режиме
+    scheduler = get_scheduler(
+        settings.global_config.getint("SCHEDULER", "workers", fallback=4),
+        settings.global_config.get("SCHEDULER", "state_file", fallback="") or None,
+    )
+    bot.on_shutdown(lambda: scheduler.cancel_group(bot, STOP_TIMEOUT))
+    # Политика хранения статистики ставится один раз на файл базы, а не на бота
+    schedule_retention(
+        settings.global_config,
+        scheduler,
+        create_database(settings.global_config, "retention"),
+    )
+    # Старые строки рыбалки переносятся из Stats в FishingEvent и FishCatch
+    # в фоне короткими транзакциями, пока боты работают. Перенос и очистка
+    # выполняются служебным пулом и не задерживают автопост
+    if db.stats_migration_pending():
+        scheduler.schedule(
+            0,
+            create_database(settings.global_config, "migration").migrate_stats,
+            maintenance=True,
+        )
+    autopost_job = None
+    # База закрывается после завершения задач, которые к ней обращаются
+    bot.on_shutdown(lambda: stats_writer.flush(timeout=STOP_TIMEOUT))
+    bot.on_shutdown(db.close)
 
     transfer_message = None
 
+    # Ответы обработчиков не ждут отправки, чтобы поток обработчика не стоял
+    # в очереди токена, ошибки отправки записывает в лог очередь отправки
+
     # Проверка, что бот работает
     @bot.message_handler(text="пп", peer_id=user_id, user_id=user_id)
-    def check(event: Event):
-        bot.send(user_id, "Живой!")
+    def check(event: MessageEvent):
+        bot.send(user_id, "Живой!", wait=False)
 
     @bot.message_handler(text="инфо", peer_id=user_id, user_id=user_id)
-    def get_settings(event: Event):
+    def get_settings(event: MessageEvent):
         bot.send(
             event.peer_id,
             (
@@ -78,6 +169,7 @@ def register_handlers(bot: Bot, config: configparser.ConfigParser):
                 f"Автоматическое складирование: {'✅' if settings.auto_store_items else '❌'}\n\n"
                 "Для помощи в настройке используйте команду Помощь"
             ),
+            wait=False,
         )
 
     @bot.message_handler(
@@ -85,47 +177,63 @@ def register_handlers(bot: Bot, config: configparser.ConfigParser):
         custom_filters=[lambda event: event.text.lower().startswith("объявление\n")],
         user_id=user_id,
     )
-    def update_autopost(event: Event):
+    def update_autopost(event: MessageEvent):
         autopost_text = event.text.split("\n", 1)[1]
         db.update_autopost_text(user_id, main_chat_id, autopost_text)
-        bot.send(user_id, "Объявление обновлено")
+        bot.send(user_id, "Объявление обновлено", wait=False)
 
     @bot.message_handler(peer_id=user_id, text="спам", user_id=user_id)
-    def send_autopost(event: Event):
+    def send_autopost(event: MessageEvent):
         autopost_text = db.get_autopost(user_id, main_chat_id)
         if autopost_text:
-            bot.send(event.peer_id, autopost_text)
+            bot.send(event.peer_id, autopost_text, wait=False)
 
     @bot.message_handler(text="стартспам", peer_id=user_id, user_id=user_id)
-    def enable_autopost(event: Event):
+    def enable_autopost(event: MessageEvent):
+        nonlocal autopost_job
         settings.autopost = True
-        bot.send(user_id, "Автопост включён")
+        # Время следующего автопоста хранится по ключу, поэтому повторное
+        # включение, в том числе после перезапуска, не сокращает перерыв
+        autopost_job = scheduler.schedule(
+            0,
+            autopost,
+            bot,
+            db,
+            user_id,
+            main_chat_id,
+            interval=AUTOPOST_COOLDOWN,
+            key=f"autopost:{user_id}:{main_chat_id}",
+            group=bot,
+        )
+        bot.send(user_id, "Автопост включён", wait=False)
 
     @bot.message_handler(text="не спамим", peer_id=user_id, user_id=user_id)
-    def disable_autopost(event: Event):
+    def disable_autopost(event: MessageEvent):
         settings.autopost = False
-        bot.send(user_id, "Автопост отключен")
+        if autopost_job is not None:
+            scheduler.cancel(autopost_job)
+        bot.send(user_id, "Автопост отключен", wait=False)
 
     @bot.message_handler(text="плати", peer_id=user_id, user_id=user_id)
-    def enable_pay(event: Event):
+    def enable_pay(event: MessageEvent):
         settings.pay = True
-        bot.send(user_id, "Автооплата включена")
+        bot.send(user_id, "Автооплата включена", wait=False)
 
     @bot.message_handler(text="не плати", peer_id=user_id, user_id=user_id)
-    def disable_pay(event: Event):
+    def disable_pay(event: MessageEvent):
         settings.pay = False
-        bot.send(user_id, "Автооплата отключена")
+        bot.send(user_id, "Автооплата отключена", wait=False)
 
     @bot.message_handler(text="+аук", peer_id=user_id, user_id=user_id)
-    def enable_auction(event: Event):
+    def enable_auction(event: MessageEvent):
         settings.auction = True
 
     @bot.message_handler(text="-аук", peer_id=user_id, user_id=user_id)
-    def disable_auction(event: Event):
+    def disable_auction(event: MessageEvent):
         settings.auction = False
 
     @bot.message_handler(text="помощь", peer_id=user_id, user_id=user_id)
-    def help(event: Event):
+    def help(event: MessageEvent):
         help_text = (
             "Доступные команды:\n"
             "Пп - проверка, бот ответит, если работает\n"
@@ -144,17 +252,16 @@ def register_handlers(bot: Bot, config: configparser.ConfigParser):
             "+склад или -склад - автоматическое складывание всех покупаемых предметов на склад (ТРЕБУЕТ НАЛИЧИЯ storage_chat_id В КОНФИГЕ)\n"
             "Выкл - выключить бота (не рекомендуется)"
         )
-        bot.send(user_id, help_text)
+        bot.send(user_id, help_text, wait=False)
 
     @bot.message_handler(text="выкл", peer_id=user_id, user_id=user_id)
-    def shut_down(event: Event):
-        bot.send(user_id, "Бот выключен")
+    def shut_down(event: MessageEvent):
+        bot.send(user_id, "Бот выключен", wait=False)
         raise AssertionError("Bot shut down")
 
     # фильтр для регулярного выражения добавления предмета
-    def add_item_command_filter(event: Event):
-        pattern = r"предмет (\d+) (\w+) (.+)"
-        match = re.match(pattern, event.text, re.IGNORECASE)
+    def add_item_command_filter(event: MessageEvent):
+        match = ADD_ITEM_COMMAND_PATTERN.match(event.text)
         if match:
             event.price = int(match.group(1))
             event.currency = match.group(2).lower()
@@ -165,10 +272,12 @@ def register_handlers(bot: Bot, config: configparser.ConfigParser):
     @bot.message_handler(
         peer_id=user_id, custom_filters=[add_item_command_filter], user_id=user_id
     )
-    def save_item(event: Event):
+    def save_item(event: MessageEvent):
         db.add_item(user_id, event.item_name, event.price, event.currency)
         bot.send(
-            user_id, f"{event.item_name} за {event.price} {event.currency} сохранен"
+            user_id,
+            f"{event.item_name} за {event.price} {event.currency} сохранен",
+            wait=False,
         )
 
     @bot.message_handler(
@@ -176,26 +285,26 @@ def register_handlers(bot: Bot, config: configparser.ConfigParser):
         custom_filters=[lambda event: event.text.lower().startswith("удали")],
         user_id=user_id,
     )
-    def delete_item(event: Event):
+    def delete_item(event: MessageEvent):
         item_name = event.text.split(" ", 1)[1]
         if db.delete_item(user_id, item_name) > 0:
-            bot.send(user_id, f"{item_name} удален")
+            bot.send(user_id, f"{item_name} удален", wait=False)
         else:
-            bot.send(user_id, f"{item_name} не найден")
+            bot.send(user_id, f"{item_name} не найден", wait=False)
 
     @bot.message_handler(peer_id=user_id, text="скуп", user_id=user_id)
-    def get_items(event: Event):
+    def get_items(event: MessageEvent):
         items = db.get_items_by_user_id(user_id)
         if not items:
-            bot.send(user_id, "Список пуст")
+            bot.send(user_id, "Список пуст", wait=False)
             return
         res = "Ваши предметы:\n\n"
         res += "\n".join(
             f"{key} - {price} {currency}" for key, (price, currency) in items.items()
         )
-        bot.send(user_id, res)
+        bot.send(user_id, res, wait=False)
 
-    def get_mention(event: Event, bot: Bot = bot) -> Optional[dict]:
+    def get_mention(event: MessageEvent, bot: Bot = bot) -> Optional[dict]:
         msg = bot.get_msg_by_id(event.message_id)
         if msg.get("reply_message"):
             return msg["reply_message"]
@@ -204,13 +313,13 @@ def register_handlers(bot: Bot, config: configparser.ConfigParser):
         return None
 
     def is_mention_of_the_user(
-        event: Event, bot: Bot = bot, user_id: int = user_id
+        event: MessageEvent, bot: Bot = bot, user_id: int = user_id
     ) -> bool:
         mention = get_mention(event, bot)
         return mention and mention["from_id"] == user_id
 
     @bot.message_handler(peer_id=main_chat_id, custom_filters=[is_mention_of_the_user])
-    def remember_mention(event: Event):
+    def remember_mention(event: MessageEvent):
         nonlocal transfer_message
         if event.text.lower().startswith("передать"):
             transfer_message = event
@@ -252,156 +361,114 @@ def register_handlers(bot: Bot, config: configparser.ConfigParser):
             lambda event: get_mention(event) is not None and event.text.startswith("/")
         ],
     )
-    def give_adm(event: Event):
+    def give_adm(event: MessageEvent):
         transfer_message = send_item(event.text)
         if transfer_message:
             bot.send(
                 event.peer_id,
                 transfer_message,
                 forward_messages=get_mention(event)["id"],
+                priority=Priority.HIGH,
+                wait=False,
             )
 
     # АВТООПЛАТА
-    def parse_item_message(message):
-        """
-        Парсинг сообщения о передаче предмета.
-        :param message: Текст сообщения.
-        :return: Словарь с типом операции, количеством предметов, названием предмета,
-                идентификатором отправителя и получателя.
-        """
-        # Регулярное выражение для парсинга сообщений
-        item_regex = re.compile(
-            r"(Получено|Отправлено):.{2}(\d*\*?)?(\S.+\S): \[id(\d+)\|[^]]+] =&gt; \[id(\d+)\|[^]]+]"
-        )
-        match = item_regex.match(message)
-        if match:
-            action, quantity, item_name, sender_id, receiver_id = match.groups()
-            quantity = int(quantity[:-1]) if quantity and quantity.endswith("*") else 1
-            return {
-                "action": action,
-                "quantity": quantity,
-                "item_name": item_name.lower(),
-                "sender_id": int(sender_id),
-                "receiver_id": int(receiver_id),
-            }
-        return None
-
-    def item_transfer_filter(event):
-        """
-        Фильтр для сообщений о передаче предметов.
-        :param event: Ивент, содержащий сообщение.
-        :return: True если сообщение соответствует шаблону, иначе False.
-        """
-        message_data = parse_item_message(event.text)
-        if message_data:
-            event.action = message_data["action"]
-            event.quantity = message_data["quantity"]
-            event.item_name = message_data["item_name"]
-            event.sender_id = message_data["sender_id"]
-            event.receiver_id = message_data["receiver_id"]
-            return True
-        return False
-
     @bot.message_handler(
         group_id=settings.global_config["CONSTANTS"]["game_group_id"],
-        custom_filters=[item_transfer_filter],
+        kind=MessageKind.ITEM_TRANSFER,
     )
-    def handle_item_transfer(event: Event):
-        if event.action == "Получено":
+    def handle_item_transfer(event: MessageEvent):
+        transfer = event.fields
+        if transfer["action"] == "Получено":
             if (
                 transfer_message
-                and transfer_message.user_id == event.sender_id
+                and transfer_message.user_id == transfer["sender_id"]
                 and settings.pay
             ):
-                item = db.get_items_by_user_id(user_id).get(event.item_name)
+                quantity = transfer["quantity"]
+                item_name = transfer["item_name"]
+                item = db.get_items_by_user_id(user_id).get(item_name)
                 if item:
                     price, currency = item
                     bot.send(
                         transfer_message.peer_id,
-                        f"Передать {event.quantity * price} {currency}",
+                        f"Передать {quantity * price} {currency}",
                         transfer_message.message_id,
+                        priority=Priority.HIGH,
+                        wait=False,
                     )
                     bot.send(
                         user_id,
-                        f"Заплачено {event.quantity * price} {currency} за {event.quantity} {event.item_name}",
+                        f"Заплачено {quantity * price} {currency} за {quantity} {item_name}",
+                        priority=Priority.LOW,
+                        wait=False,
                     )
                     # АВТОСКЛАД
                     if settings.auto_store_items:
+                        scheduler.schedule(
+                            STORE_DELAY,
+                            partial(bot.send, wait=False),
+                            int(config["PERSONAL"]["storage_chat_id"]),
+                            f"положить {item_name} - {quantity} штук",
+                            group=bot,
+                        )
 
-                        def delayed_send(delay=10):
-                            sleep(delay)
-                            bot.send(
-                                int(config["PERSONAL"]["storage_chat_id"]),
-                                f"положить {event.item_name} - {event.quantity} штук",
-                            )
-
-                        threading.Thread(target=delayed_send).start()
+    game_group_id = int(settings.global_config["CONSTANTS"]["game_group_id"])
 
+    # Посты аукциона обрабатываются вне очереди остальных обработчиков,
+    # цены берутся из прогретого кэша, замеры и логи - после отправки покупок
     @bot.message_handler(
         user_id=settings.global_config["CONSTANTS"]["transfer_bot_id"],
-        custom_filters=[
-            lambda event: "продает через аукцион" in event.text.lower()
-            and settings.auction
-        ],
+        kind=MessageKind.AUCTION_LOTS,
+        custom_filters=[lambda event: settings.auction],
+        fast_lane=True,
     )
-    def handle_auction(event: Event):
-        pattern = re.compile(
-            r"(\d+)\s*\*\s*([^\*-]+?)\s*-\s*(\d+)\s*золота\s*\((\d+)\)"
-        )
-        lines = event.text.lower().split("\n")
-        for line in lines:
-            match = pattern.search(line)
-            if match:
-                try:
-                    mult = int(match.group(1))
-                    item = match.group(2).strip()
-                    total_price = int(match.group(3))
-                    lot_id = match.group(4)
-                    items = db.get_items_by_user_id(user_id)
-                    if item not in items.keys():
-                        continue
-
-                    price, currency = items[item]
-                    if price >= total_price / mult:
-                        bot.send(
-                            int(settings.global_config["CONSTANTS"]["game_group_id"]),
-                            f"купить лот {lot_id}",
-                        )
-                except (ValueError, IndexError) as e:
-                    continue
+    def handle_auction(event: MessageEvent):
+        items = db.get_items_by_user_id(user_id)
+        buys = []
+        for mult, item, total_price, lot_id in event.fields["lots"]:
+            if item not in items or not mult:
+                continue
+            price, currency = items[item]
+            if price >= total_price / mult:
+                # Без ожидания: покупки из одного поста уходят одним вызовом execute
+                future = bot.send(
+                    game_group_id,
+                    f"купить лот {lot_id}",
+                    priority=Priority.HIGH,
+                    wait=False,
+                )
+                buys.append((lot_id, future))
+        for lot_id, future in buys:
+            future.add_done_callback(partial(record_auction_buy, bot, event, lot_id))
 
     @bot.message_handler(
         group_id=settings.global_config["CONSTANTS"]["game_group_id"],
-        custom_filters=[
-            lambda event: "вы готовитесь к рыбалке" in event.text.lower()
-            and settings.track_fish
-        ],
+        kind=MessageKind.FISHING_START,
+        custom_filters=[lambda event: settings.track_fish],
     )
-    def log_fish_start(event: Event):
-        db.add_stat(user_id, event.timestamp, "FISHING_START")
+    def log_fish_start(event: MessageEvent):
+        stats_writer.add_fishing_event(user_id, event.timestamp, FishingEventType.START)
 
     @bot.message_handler(
         group_id=settings.global_config["CONSTANTS"]["game_group_id"],
-        custom_filters=[
-            lambda event: "карта озера активирована" in event.text.lower()
-            and settings.track_fish
-        ],
+        kind=MessageKind.FISHING_MAP_ACTIVATED,
+        custom_filters=[lambda event: settings.track_fish],
     )
-    def log_fish_end(event: Event):
-        db.add_stat(user_id, event.timestamp, "FISHING_MAP_ACTIVATED")
+    def log_fish_end(event: MessageEvent):
+        stats_writer.add_fishing_event(
+            user_id, event.timestamp, FishingEventType.MAP_ACTIVATED
+        )
 
     @bot.message_handler(
         group_id=settings.global_config["CONSTANTS"]["game_group_id"],
-        custom_filters=[
-            lambda event: "вы успешно выловили рыбу!" in event.text.lower()
-            and settings.track_fish
-        ],
+        kind=MessageKind.FISH_CAUGHT,
+        custom_filters=[lambda event: settings.track_fish],
     )
-    def get_fish_weight(event: Event):
-        match = re.search(r"\(([\d.]+)\s*кг\).*в\s(\d+)\sзолота", event.text)
-        if match:
-            db.add_stat(user_id, event.timestamp, "FISH_WEIGHT", match.group(1))
-            db.add_stat(user_id, event.timestamp, "FISH_PRICE", match.group(2))
+    def get_fish_weight(event: MessageEvent):
+        stats_writer.add_catch(
+            user_id, event.timestamp, event.fields["weight_g"], event.fields["price"]
+        )
 
     @bot.message_handler(
         peer_id=user_id,
@@ -410,15 +477,12 @@ def register_handlers(bot: Bot, config: configparser.ConfigParser):
             lambda event: "рыба за" in event.text.lower() and settings.track_fish
         ],
     )
-    def get_statistics(event: Event):
-        stats = (
-            db.get_all_stats()
-        )  # -> List[Tuple[int, int, str, str, Optional[str]]] - (id, user_id, date, type, value(optional))
+    def get_statistics(event: MessageEvent):
+        # Статистика, еще лежащая в очереди, тоже должна попасть в отчет
+        stats_writer.flush(timeout=5)
 
         # Парсинг периода
-        period_match = re.search(
-            r"рыба за (\d+)\s*(день|дня|дней|месяца|месяцев|месяц)", event.text.lower()
-        )
+        period_match = STATISTICS_PERIOD_PATTERN.search(event.text.lower())
         # if not period_match:
         #     bot.send(user_id, "Не удалось распознать период.")
 
@@ -431,117 +495,83 @@ def register_handlers(bot: Bot, config: configparser.ConfigParser):
             period = datetime.timedelta(days=quantity)
 
         # Определение границ периода
-        end_date = datetime.datetime.now(pytz.timezone("Europe/Moscow"))
-        start_date = end_date - period
-
-        # Переменные для накопления статистики
-        fish_start_count = 0
-        fish_map_count = 0
-        total_weight = 0.0
-        total_price = 0
-        weight_count = 0
-        price_count = 0
-
-        # Проход по отфильтрованной статистике
-        for stat in stats:
-            _, stat_user_id, stat_date, stat_type, stat_value = stat
-
-            if stat_user_id != user_id:
-                continue
-
-            stat_datetime = pytz.timezone("Europe/Moscow").localize(
-                datetime.datetime.fromisoformat(stat_date)
-            )
-            if not (start_date <= stat_datetime <= end_date):
-                continue
+        end = int(time.time())
+        start = end - int(period.total_seconds())
 
-            if stat_type == "FISHING_START":
-                fish_start_count += 1
-            elif stat_type == "FISHING_MAP_ACTIVATED":
-                fish_map_count += 1
-            elif stat_type == "FISH_WEIGHT" and stat_value:
-                total_weight += float(stat_value)
-                weight_count += 1
-            elif stat_type == "FISH_PRICE" and stat_value:
-                total_price += int(stat_value)
-                price_count += 1
-
-        # Вычисление средних значений
-        avg_weight = (total_weight / weight_count) if weight_count else 0
-        avg_price = (total_price / price_count) if price_count else 0
+        # Полные дни берутся из дневной сводки, сырые строки - только за краевые дни
+        summary = db.get_fishing_summary(user_id, start, end)
 
         # Формирование ответа
         response = (
             f"Ваша статистика за {quantity} {period_type}:\n"
-            f"Всего рыбалок: {fish_start_count}\n"
-            f"Рыбалок по картам: {fish_map_count}\n"
-            f"Общий вес рыбы за этот период: {total_weight:.2f} кг\n"
-            f"Общая цена рыбы за этот период: {total_price} золота\n"
-            f"Средний вес рыбы: {avg_weight:.2f} кг\n"
-            f"Средняя цена рыбы: {avg_price:.2f} золота"
+            f"Всего рыбалок: {summary.fishing_starts}\n"
+            f"Рыбалок по картам: {summary.map_activations}\n"
+            f"Общий вес рыбы за этот период: {summary.weight_sum:.2f} кг\n"
+            f"Общая цена рыбы за этот период: {summary.price_sum} золота\n"
+            f"Средний вес рыбы: {summary.avg_weight:.2f} кг\n"
+            f"Средняя цена рыбы: {summary.avg_price:.2f} золота"
         )
-        bot.send(user_id, response)
+        bot.send(user_id, response, wait=False)
 
     @bot.message_handler(text="+статистика", peer_id=user_id, user_id=user_id)
-    def stats_on(event: Event):
+    def stats_on(event: MessageEvent):
         settings.track_fish = True
         bot.send(
             user_id,
             "Сбор игровой статистики запущен. Команды работы со статистикой доступны.",
+            wait=False,
         )
 
     @bot.message_handler(text="-статистика", peer_id=user_id, user_id=user_id)
-    def stats_off(event: Event):
+    def stats_off(event: MessageEvent):
         settings.track_fish = False
         bot.send(
             user_id,
             "Сбор игровой статистики остановлен. Команды работы со статистикой больше недоступны.",
+            wait=False,
         )
 
     @bot.message_handler(text="+склад", peer_id=user_id, user_id=user_id)
-    def stats_on(event: Event):
+    def stats_on(event: MessageEvent):
         if config.has_option("PERSONAL", "storage_chat_id"):
             settings.auto_store_items = True
             bot.send(
                 user_id,
                 "Автоматическая разгрузка предметов в склад включена",
+                wait=False,
             )
         else:
             bot.send(
                 user_id,
                 "Внимание, работа с данной командой возможна только при наличии поля storage_chat_id в вашем конфиге.\n Добавьте поле в конфиг и повторите попытку",
+                wait=False,
             )
 
     @bot.message_handler(text="-склад", peer_id=user_id, user_id=user_id)
-    def stats_off(event: Event):
+    def stats_off(event: MessageEvent):
         if config.has_option("PERSONAL", "storage_chat_id"):
             settings.auto_store_items = False
             bot.send(
                 user_id,
                 "Автоматическая разгрузка предметов в склад отключена",
+                wait=False,
             )
         else:
             bot.send(
                 user_id,
                 "Внимание, работа с данной командой возможна только при наличии поля storage_chat_id в вашем конфиге.\nДобавьте поле в конфиг и повторите попытку",
+                wait=False,
             )
 
     @bot.message_handler(
         group_id=settings.global_config["CONSTANTS"]["game_group_id"],
-        custom_filters=[
-            lambda event: "успешно приобрели с аукциона предмет" in event.text.lower()
-            and settings.auto_store_items
-        ],
+        kind=MessageKind.AUCTION_BOUGHT,
+        custom_filters=[lambda event: settings.auto_store_items],
     )
-    def auction_item_bought(event: Event):
-        pattern = r"\[id(\d+)\|.*?\], Вы успешно приобрели с аукциона предмет (\d+)\*(.+?)\s*-\s*\d+ золота потрачено"
-        match = re.search(pattern, event.text)
-        if match:
-            buyer_id = int(match.group(1))
-            quantity = int(match.group(2))
-            item_name = match.group(3).lower()
-            if buyer_id == user_id:
-                bot.send(
-                    int(config["PERSONAL"]["storage_chat_id"]),
-                    f"положить {item_name} - {quantity} штук",
-                )
+    def auction_item_bought(event: MessageEvent):
+        if event.fields["buyer_id"] == user_id:
+            bot.send(
+                int(config["PERSONAL"]["storage_chat_id"]),
+                f"положить {event.fields['item_name']} - {event.fields['quantity']} штук",
+                wait=False,
+            )
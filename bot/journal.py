@@ -0,0 +1,182 @@
+import configparser
+import gzip
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Запись журнала: длина в 4 байтах big-endian и JSON [received_at, событие]
+RECORD_HEADER = struct.Struct(">I")
+SEGMENT_SUFFIX = ".jnl.gz"
+
+
+class JournalWriter:
+    """
+    Журнал событий long poll одного бота.
+
+    События пишутся без изменений в том виде, в котором их вернул сервер,
+    в сжатые gzip сегменты только на дозапись. Сегмент закрывается и
+    начинается новый, когда объем записанных в него данных превышает
+    segment_bytes, самые старые сегменты сверх max_segments удаляются.
+    Сегменты бота лежат в отдельном каталоге, имя сегмента - время его
+    создания в миллисекундах, поэтому сортировка имен совпадает с порядком записи.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        tenant: str,
+        segment_bytes: int = 16 * 2**20,
+        max_segments: int = 50,
+        flush_interval: float = 5.0,
+    ):
+        """
+        Args:
+            directory (str): Каталог журналов всех ботов.
+            tenant (str): Имя бота, подкаталог его сегментов.
+            segment_bytes (int): Объем несжатых данных одного сегмента в байтах.
+            max_segments (int): Количество хранимых сегментов бота.
+            flush_interval (float): Период сброса сжатых данных на диск в секундах.
+                При аварийном завершении теряются события не более чем за этот период.
+        """
+        self.directory = os.path.join(directory, tenant)
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._file: Optional[gzip.GzipFile] = None
+        self._written = 0
+        self._flushed_at = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def record(self, updates: Sequence[List], received_at: float) -> None:
+        """
+        Добавляет события одного ответа long poll в журнал.
+
+        Args:
+            updates (Sequence[List]): События в формате long poll.
+            received_at (float): Время получения ответа ботом.
+        """
+        if not updates:
+            return
+        with self._lock:
+            if self._file is None or self._written >= self.segment_bytes:
+                self._rotate()
+            for update in updates:
+                data = json.dumps(
+                    [received_at, update], ensure_ascii=False, separators=(",", ":")
+                ).encode("utf-8")
+                self._file.write(RECORD_HEADER.pack(len(data)) + data)
+                self._written += RECORD_HEADER.size + len(data)
+                self.records += 1
+            now = time.monotonic()
+            if now - self._flushed_at >= self.flush_interval:
+                self._file.flush()
+                self._flushed_at = now
+
+    def close(self) -> None:
+        """
+        Закрывает текущий сегмент.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(
+            self.directory, f"{int(time.time() * 1000):013d}{SEGMENT_SUFFIX}"
+        )
+        self._file = gzip.open(path, "ab")
+        self._written = 0
+        self._flushed_at = time.monotonic()
+        for old_path in journal_segments(self.directory)[: -self.max_segments]:
+            try:
+                os.remove(old_path)
+            except OSError as e:
+                logging.error(f"Failed to remove journal segment {old_path}: {e}")
+
+
+def journal_segments(path: str) -> List[str]:
+    """
+    Возвращает сегменты журнала в порядке записи.
+
+    Args:
+        path (str): Файл сегмента или каталог сегментов одного бота.
+
+    Returns:
+        List[str]: Пути к сегментам.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def read_journal(paths: Iterable[str]) -> Iterator[Tuple[float, List]]:
+    """
+    Читает события из сегментов журнала.
+
+    Оборванная запись в конце сегмента (после аварийного завершения
+    процесса) пропускается вместе с остатком сегмента.
+
+    Args:
+        paths (Iterable[str]): Сегменты или каталоги сегментов.
+
+    Yields:
+        Tuple[float, List]: Время получения и событие в формате long poll.
+    """
+    for path in paths:
+        for segment in journal_segments(path):
+            with gzip.open(segment, "rb") as file:
+                try:
+                    while True:
+                        header = file.read(RECORD_HEADER.size)
+                        if len(header) < RECORD_HEADER.size:
+                            break
+                        (length,) = RECORD_HEADER.unpack(header)
+                        data = file.read(length)
+                        if len(data) < length:
+                            break
+                        received_at, update = json.loads(data)
+                        yield received_at, update
+                except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+                    logging.warning(f"Journal segment {segment} is truncated: {e}")
+
+
+def open_journal(
+    global_config: configparser.ConfigParser, tenant: str
+) -> Optional[JournalWriter]:
+    """
+    Создает журнал бота по настройкам секции JOURNAL глобального конфига.
+
+    Args:
+        global_config (configparser.ConfigParser): Глобальный конфиг.
+        tenant (str): Имя бота.
+
+    Returns:
+        Optional[JournalWriter]: Журнал или None, если запись выключена.
+    """
+    if not global_config.getboolean("JOURNAL", "enabled", fallback=False):
+        return None
+    return JournalWriter(
+        global_config.get("JOURNAL", "directory", fallback="data/journal"),
+        tenant,
+        segment_bytes=int(
+            global_config.getfloat("JOURNAL", "segment_size_mb", fallback=16) * 2**20
+        ),
+        max_segments=global_config.getint("JOURNAL", "max_segments", fallback=50),
+        flush_interval=global_config.getfloat(
+            "JOURNAL", "flush_interval", fallback=5.0
+        ),
+    )
@@ -0,0 +1,62 @@
+import threading
+from collections import deque
+from typing import Deque, Dict
+
+
+class LatencyRecorder:
+    """
+    Последние замеры задержек по этапам обработки.
+
+    Для каждого этапа хранится не более window замеров, по ним считаются
+    перцентили. Потокобезопасен: замеры пишутся из потоков обработчиков
+    и из потока отправки сообщений.
+    """
+
+    def __init__(self, window: int = 1000):
+        """
+        Args:
+            window (int): Количество последних замеров, хранимых для каждого этапа.
+        """
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        """
+        Сохраняет замер.
+
+        Args:
+            stage (str): Название этапа.
+            seconds (float): Задержка в секундах.
+        """
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+                self._counts[stage] = 0
+            samples.append(seconds)
+            self._counts[stage] += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Возвращает сводку по этапам.
+
+        Returns:
+            Dict[str, Dict[str, float]]: Для каждого этапа общее число замеров и
+                p50, p99, максимум по последним замерам в миллисекундах.
+        """
+        with self._lock:
+            snapshot = {
+                stage: (self._counts[stage], sorted(samples))
+                for stage, samples in self._samples.items()
+            }
+        return {
+            stage: {
+                "count": count,
+                "p50_ms": samples[int(0.5 * (len(samples) - 1))] * 1000,
+                "p99_ms": samples[int(0.99 * (len(samples) - 1))] * 1000,
+                "max_ms": samples[-1] * 1000,
+            }
+            for stage, (count, samples) in snapshot.items()
+        }
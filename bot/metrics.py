@@ -0,0 +1,442 @@
+import configparser
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import vk_api
+from vk_api.exceptions import ApiError
+
+# Границы корзин гистограмм в секундах: от запросов к SQLite до long poll
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> object:
+        """
+        Возвращает метрику с заданными значениями меток.
+
+        Args:
+            *values: Значения меток в порядке labelnames.
+        """
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def _samples(self, key: Tuple[str, ...], child) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            lines.extend(self._samples(key, child))
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Монотонно растущий счетчик.
+    """
+
+    type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def _samples(self, key, child) -> List[str]:
+        labels = _format_labels(self.labelnames, key)
+        return [f"{self.name}{labels} {_format_number(child.value)}"]
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма значений с фиксированными границами корзин.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def _samples(self, key, child) -> List[str]:
+        with child._lock:
+            counts = list(child.counts)
+            total, count = child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else _format_number(bound)
+            labels = _format_labels(self.labelnames, key, f'le="{le}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Набор метрик процесса, выводимый в текстовом формате Prometheus.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.setdefault(metric.name, metric)
+        return existing
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        """
+        Регистрирует счетчик или возвращает уже зарегистрированный.
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """
+        Регистрирует гистограмму или возвращает уже зарегистрированную.
+        """
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Возвращает все метрики в текстовом формате Prometheus.
+
+        Returns:
+            str: Текст для ответа /metrics.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+EVENTS = REGISTRY.counter(
+    "vkbot_events_total", "Обработанные события long poll", ("tenant",)
+)
+EVENT_LAG = REGISTRY.histogram(
+    "vkbot_event_lag_seconds",
+    "Задержка от времени сообщения до начала обработки",
+    ("tenant",),
+)
+HANDLER_SECONDS = REGISTRY.histogram(
+    "vkbot_handler_duration_seconds",
+    "Время выполнения обработчика",
+    ("tenant", "handler"),
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "vkbot_handler_errors_total",
+    "Исключения в обработчиках",
+    ("tenant", "handler"),
+)
+VK_API_SECONDS = REGISTRY.histogram(
+    "vkbot_vk_api_duration_seconds",
+    "Время вызова метода VK API, включая ожидание лимита запросов",
+    ("tenant", "method"),
+)
+VK_API_ERRORS = REGISTRY.counter(
+    "vkbot_vk_api_errors_total",
+    "Ошибки вызовов VK API",
+    ("tenant", "method", "code"),
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "vkbot_db_query_duration_seconds",
+    "Время выполнения метода DatabaseHandler",
+    ("tenant", "query"),
+)
+DB_QUERY_ERRORS = REGISTRY.counter(
+    "vkbot_db_query_errors_total",
+    "Ошибки методов DatabaseHandler",
+    ("tenant", "query"),
+)
+BOOT_SECONDS = REGISTRY.histogram(
+    "vkbot_boot_seconds",
+    "Время от начала запуска бота до готовности к приему событий",
+    ("tenant",),
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+
+class InstrumentedVkApi(vk_api.VkApi):
+    """
+    VkApi, замеряющий время и ошибки вызовов методов API.
+    """
+
+    def __init__(self, *args, tenant: str = "", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tenant = tenant
+
+    def method(self, method, values=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().method(method, values, *args, **kwargs)
+        except ApiError as e:
+            VK_API_ERRORS.labels(self.tenant, method, e.code).inc()
+            raise
+        except Exception as e:
+            VK_API_ERRORS.labels(self.tenant, method, type(e).__name__).inc()
+            raise
+        finally:
+            VK_API_SECONDS.labels(self.tenant, method).observe(
+                time.perf_counter() - started
+            )
+
+
+def measure_queries(exclude: Sequence[str] = ()) -> Callable:
+    """
+    Декоратор класса: замеряет время и ошибки публичных методов.
+
+    Метка tenant берется из атрибута tenant экземпляра, метка query -
+    имя метода.
+
+    Args:
+        exclude (Sequence[str]): Публичные методы, которые не замеряются.
+    """
+
+    def decorator(cls):
+        for name, func in list(vars(cls).items()):
+            if name.startswith("_") or name in exclude or not inspect.isfunction(func):
+                continue
+            setattr(cls, name, _measured_query(name, func))
+        return cls
+
+    return decorator
+
+
+def _measured_query(name: str, func: Callable) -> Callable:
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        except Exception:
+            DB_QUERY_ERRORS.labels(self.tenant, name).inc()
+            raise
+        finally:
+            DB_QUERY_SECONDS.labels(self.tenant, name).observe(
+                time.perf_counter() - started
+            )
+
+    return wrapper
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(host: str, port: int) -> ThreadingHTTPServer:
+    """
+    Запускает HTTP-сервер с метриками в фоновом потоке.
+
+    Args:
+        host (str): Адрес для прослушивания.
+        port (int): Порт.
+
+    Returns:
+        ThreadingHTTPServer: Запущенный сервер.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-http", daemon=True
+    ).start()
+    return server
+
+
+def start_file_writer(path: str, interval: float) -> threading.Thread:
+    """
+    Запускает периодическую запись метрик в файл.
+
+    Файл заменяется атомарно, поэтому читатель никогда не видит его частично записанным.
+
+    Args:
+        path (str): Путь к файлу.
+        interval (float): Период записи в секундах.
+
+    Returns:
+        threading.Thread: Поток записи.
+    """
+
+    def write_forever():
+        while True:
+            try:
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as file:
+                    file.write(REGISTRY.render())
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logging.error("Failed to write metrics file: " + str(e))
+            time.sleep(interval)
+
+    thread = threading.Thread(target=write_forever, name="metrics-file", daemon=True)
+    thread.start()
+    return thread
+
+
+# Смещение порта и суффикс файла метрик для процессов-шардов run_bot.py
+port_offset = 0
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+
+def start_exporter(global_config: configparser.ConfigParser) -> None:
+    """
+    Запускает вывод метрик по настройкам секции METRICS глобального конфига.
+
+    Вызывается при регистрации обработчиков каждого бота, но запускает
+    сервер и запись в файл только один раз за время работы процесса.
+
+    Args:
+        global_config (configparser.ConfigParser): Глобальный конфиг.
+    """
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started or not global_config.getboolean(
+            "METRICS", "enabled", fallback=False
+        ):
+            return
+        _exporter_started = True
+
+    port = global_config.getint("METRICS", "port", fallback=0)
+    if port:
+        host = global_config.get("METRICS", "host", fallback="127.0.0.1")
+        try:
+            start_http_server(host, port + port_offset)
+            logging.info(
+                f"Metrics available at http://{host}:{port + port_offset}/metrics"
+            )
+        except OSError as e:
+            logging.error("Failed to start metrics server: " + str(e))
+
+    path = global_config.get("METRICS", "file", fallback="")
+    if path:
+        if port_offset:
+            path = f"{path}.{port_offset}"
+        start_file_writer(
+            path, global_config.getfloat("METRICS", "interval", fallback=15.0)
+        )
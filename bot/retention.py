@@ -0,0 +1,189 @@
+import configparser
+import datetime
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from bot.db import STATS_COMPACTED_BEFORE_KEY, DatabaseHandler
+from bot.scheduler import Job, Scheduler
+
+
+class RetentionPolicy:
+    """
+    Политика хранения статистики.
+
+    Сырые строки рыбалки в FishingEvent, FishCatch и не перенесенные строки
+    Stats хранятся raw_days дней, после этого от них остается только дневная
+    сводка StatsDaily, которая поддерживается при каждой записи. Строки
+    удаляются короткими транзакциями по batch_size строк с паузой между ними,
+    поэтому запись статистики и другие запросы не ждут блокировку базы дольше
+    одной пачки. После удаления освободившиеся страницы возвращаются файловой
+    системе через PRAGMA incremental_vacuum, тоже частями.
+    """
+
+    def __init__(
+        self,
+        db: DatabaseHandler,
+        raw_days: int = 90,
+        batch_size: int = 500,
+        batch_pause: float = 0.05,
+        vacuum_pages: int = 1000,
+        vacuum_min_pages: int = 256,
+        full_vacuum: bool = False,
+    ):
+        """
+        Args:
+            db (DatabaseHandler): База данных.
+            raw_days (int): Сколько дней хранятся сырые строки.
+            batch_size (int): Количество строк, удаляемых одной транзакцией.
+            batch_pause (float): Пауза между транзакциями в секундах.
+            vacuum_pages (int): Количество страниц, освобождаемых за один шаг.
+            vacuum_min_pages (int): Минимальное количество свободных страниц,
+                с которого выполняется освобождение места.
+            full_vacuum (bool): Разрешить однократный полный VACUUM для перевода
+                базы, созданной без auto_vacuum, в инкрементальный режим.
+                Полный VACUUM блокирует запись на время перезаписи файла.
+        """
+        self.db = db
+        self.raw_days = raw_days
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.vacuum_pages = vacuum_pages
+        self.vacuum_min_pages = vacuum_min_pages
+        self.full_vacuum = full_vacuum
+
+    @classmethod
+    def from_config(
+        cls, global_config: configparser.ConfigParser, db: DatabaseHandler
+    ) -> "RetentionPolicy":
+        """
+        Создает политику по настройкам секции RETENTION глобального конфига.
+
+        Args:
+            global_config (configparser.ConfigParser): Глобальный конфиг.
+            db (DatabaseHandler): База данных.
+
+        Returns:
+            RetentionPolicy: Политика хранения.
+        """
+        return cls(
+            db,
+            raw_days=global_config.getint("RETENTION", "raw_days", fallback=90),
+            batch_size=global_config.getint("RETENTION", "batch_size", fallback=500),
+            batch_pause=global_config.getfloat(
+                "RETENTION", "batch_pause", fallback=0.05
+            ),
+            vacuum_pages=global_config.getint(
+                "RETENTION", "vacuum_pages", fallback=1000
+            ),
+            vacuum_min_pages=global_config.getint(
+                "RETENTION", "vacuum_min_pages", fallback=256
+            ),
+            full_vacuum=global_config.getboolean(
+                "RETENTION", "full_vacuum", fallback=False
+            ),
+        )
+
+    def run(self, today: Optional[datetime.date] = None) -> Dict[str, int]:
+        """
+        Удаляет устаревшие сырые строки и освобождает место в файле базы.
+
+        Args:
+            today (Optional[datetime.date]): Текущий день по локальному времени,
+                в котором ведется дневная сводка.
+
+        Returns:
+            Dict[str, int]: Количество удаленных строк и освобожденных страниц.
+        """
+        started = time.monotonic()
+        cutoff = (today or datetime.date.today()) - datetime.timedelta(
+            days=self.raw_days
+        )
+        # Граница сохраняется до удаления: сводка за удаляемые дни уже полная,
+        # и запрос статистики не должен ждать сырых строк, которых скоро не будет
+        compacted_before = self.db.get_meta(STATS_COMPACTED_BEFORE_KEY)
+        if compacted_before is None or compacted_before < cutoff.isoformat():
+            self.db.set_meta(STATS_COMPACTED_BEFORE_KEY, cutoff.isoformat())
+        deleted = self._delete_raw(cutoff.isoformat())
+        freed = self._vacuum() if deleted else 0
+        logging.info(
+            f"Stats retention: deleted {deleted} rows before {cutoff}, "
+            f"freed {freed} pages in {time.monotonic() - started:.1f} s"
+        )
+        return {"deleted": deleted, "freed_pages": freed}
+
+    def _delete_raw(self, before_day: str) -> int:
+        deleted = 0
+        for (user_id,) in self.db.get_all_users():
+            while True:
+                count = self.db.delete_old_stats(user_id, before_day, self.batch_size)
+                deleted += count
+                if count < self.batch_size:
+                    break
+                time.sleep(self.batch_pause)
+        return deleted
+
+    def _vacuum(self) -> int:
+        storage = self.db.get_storage_stats()
+        if storage["freelist_count"] < self.vacuum_min_pages:
+            return 0
+        if storage["auto_vacuum"] != 2:
+            if not self.full_vacuum:
+                logging.warning(
+                    "Database was created without auto_vacuum, freed pages are "
+                    "reused but the file does not shrink. Set full_vacuum in "
+                    "RETENTION to convert it once"
+                )
+                return 0
+            logging.info("Converting database to incremental auto_vacuum")
+            self.db.enable_incremental_vacuum()
+            return storage["freelist_count"]
+        remaining = storage["freelist_count"]
+        while remaining:
+            left = self.db.incremental_vacuum(self.vacuum_pages)
+            if left >= remaining:
+                break
+            remaining = left
+            time.sleep(self.batch_pause)
+        return storage["freelist_count"] - remaining
+
+
+_scheduled: Dict[str, Job] = {}
+_scheduled_lock = threading.Lock()
+
+
+def schedule_retention(
+    global_config: configparser.ConfigParser,
+    scheduler: Scheduler,
+    db: DatabaseHandler,
+) -> Optional[Job]:
+    """
+    Ставит политику хранения в планировщик, один раз на файл базы за время
+    работы процесса.
+
+    Args:
+        global_config (configparser.ConfigParser): Глобальный конфиг.
+        scheduler (Scheduler): Планировщик процесса.
+        db (DatabaseHandler): База данных.
+
+    Returns:
+        Optional[Job]: Задача или None, если политика выключена или уже поставлена.
+    """
+    if not global_config.getboolean("RETENTION", "enabled", fallback=True):
+        return None
+    with _scheduled_lock:
+        if db.db_name in _scheduled:
+            return None
+        policy = RetentionPolicy.from_config(global_config, db)
+        # Первый запуск откладывается, чтобы не мешать запуску ботов, время
+        # следующего запуска сохраняется планировщиком по ключу
+        _scheduled[db.db_name] = scheduler.schedule(
+            global_config.getfloat("RETENTION", "start_delay", fallback=300),
+            policy.run,
+            interval=global_config.getfloat("RETENTION", "interval_hours", fallback=24)
+            * 3600,
+            key="retention:" + db.db_name,
+            maintenance=True,
+        )
+        return _scheduled[db.db_name]
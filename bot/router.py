@@ -0,0 +1,204 @@
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .event import MessageEvent
+
+
+class Route:
+    """
+    Зарегистрированный обработчик с заранее нормализованными фильтрами.
+    """
+
+    __slots__ = (
+        "func",
+        "filters",
+        "order",
+        "peer_id",
+        "text",
+        "user_id",
+        "group_id",
+        "kind",
+        "custom_filters",
+        "fast_lane",
+    )
+
+    def __init__(self, func: Callable, filters: Dict, order: int):
+        self.func = func
+        self.filters = filters
+        self.order = order
+        # Приведение значений выполняется один раз при регистрации, а не на каждое событие
+        self.peer_id = int(filters["peer_id"]) if "peer_id" in filters else None
+        self.text = filters["text"].lower() if "text" in filters else None
+        self.user_id = int(filters["user_id"]) if "user_id" in filters else None
+        self.group_id = abs(int(filters["group_id"])) if "group_id" in filters else None
+        self.kind = filters.get("kind")
+        self.custom_filters = tuple(filters.get("custom_filters", ()))
+        self.fast_lane = bool(filters.get("fast_lane"))
+
+    def matches(self, event: MessageEvent, text: str) -> bool:
+        """
+        Проверяет событие на соответствие фильтрам обработчика.
+
+        Args:
+            event (MessageEvent): Событие long poll.
+            text (str): Текст события в нижнем регистре.
+
+        Returns:
+            bool: True, если обработчик должен быть вызван.
+        """
+        if self.kind is not None and self.kind not in event.kinds:
+            return False
+        if self.peer_id is not None and self.peer_id != event.peer_id:
+            return False
+        if self.text is not None and self.text != text:
+            return False
+        if (
+            self.user_id is not None
+            and (event.from_user or event.from_chat)
+            and self.user_id != event.user_id
+        ):
+            return False
+        if (
+            self.group_id is not None
+            and event.from_group
+            and self.group_id != event.group_id
+        ):
+            return False
+        for custom_filter in self.custom_filters:
+            if not custom_filter(event):
+                return False
+        return True
+
+
+class Router:
+    """
+    Индекс обработчиков сообщений.
+
+    Каждый обработчик попадает ровно в одну корзину по самому избирательному
+    из своих фильтров (kind, text, peer_id, user_id, group_id), поэтому событие
+    проверяется только против обработчиков, которые в принципе могут
+    ему соответствовать. Порядок вызова совпадает с порядком регистрации.
+
+    Если есть обработчики с фильтром kind, событие один раз размечается
+    классификатором: в event.kinds записываются все типы сообщения с
+    извлеченными полями. Событие с несколькими типами попадает во все
+    соответствующие корзины. Перед проверкой и вызовом обработчика с
+    фильтром kind в event.kind и event.fields записываются его тип и поля,
+    поэтому обработчик должен вызываться до перехода к следующему маршруту.
+
+    Обработчики с fast_lane=True проверяются раньше всех остальных. Если
+    событие подошло хотя бы одному из них, остальные обработчики для него
+    не вызываются.
+    """
+
+    def __init__(
+        self,
+        classifier: Optional[Callable[[str, str], Dict[Any, Dict]]] = None,
+    ):
+        self.classifier = classifier
+        self.routes: List[Route] = []
+        self._by_kind: Dict[Any, List[Route]] = {}
+        self._by_text: Dict[str, List[Route]] = {}
+        self._by_peer: Dict[int, List[Route]] = {}
+        self._by_user: Dict[int, List[Route]] = {}
+        self._by_group: Dict[int, List[Route]] = {}
+        # Фильтр user_id не действует на сообщения от групп, а group_id - на все
+        # остальные, поэтому такие обработчики остаются кандидатами для этих событий
+        self._user_routes: List[Route] = []
+        self._group_routes: List[Route] = []
+        self._wildcard: List[Route] = []
+        self._fast_lane: List[Route] = []
+
+    def add(self, func: Callable, filters: Dict) -> Route:
+        """
+        Регистрирует обработчик в индексе.
+
+        Args:
+            func (Callable): Функция-обработчик.
+            filters (Dict): Фильтры обработчика.
+
+        Returns:
+            Route: Созданный маршрут.
+        """
+        route = Route(func, filters, len(self.routes))
+        self.routes.append(route)
+        if route.fast_lane:
+            self._fast_lane.append(route)
+        elif route.kind is not None:
+            self._by_kind.setdefault(route.kind, []).append(route)
+        elif route.text is not None:
+            self._by_text.setdefault(route.text, []).append(route)
+        elif route.peer_id is not None:
+            self._by_peer.setdefault(route.peer_id, []).append(route)
+        elif route.user_id is not None:
+            self._by_user.setdefault(route.user_id, []).append(route)
+            self._user_routes.append(route)
+        elif route.group_id is not None:
+            self._by_group.setdefault(route.group_id, []).append(route)
+            self._group_routes.append(route)
+        else:
+            self._wildcard.append(route)
+        return route
+
+    def _candidates(self, event: MessageEvent, text: str) -> List[Route]:
+        buckets = [self._by_kind[kind] for kind in event.kinds if kind in self._by_kind]
+        for bucket in (
+            self._by_text.get(text),
+            self._by_peer.get(event.peer_id),
+            (
+                self._by_user.get(event.user_id)
+                if event.from_user or event.from_chat
+                else self._user_routes
+            ),
+            (
+                self._by_group.get(event.group_id)
+                if event.from_group
+                else self._group_routes
+            ),
+            self._wildcard,
+        ):
+            if bucket:
+                buckets.append(bucket)
+        if not buckets:
+            return []
+        if len(buckets) == 1:
+            return buckets[0]
+        return sorted(chain.from_iterable(buckets), key=lambda route: route.order)
+
+    def match(self, event: MessageEvent) -> Iterator[Route]:
+        """
+        Возвращает обработчики, подходящие под событие, в порядке регистрации.
+
+        Args:
+            event (MessageEvent): Событие long poll.
+
+        Returns:
+            Iterator[Route]: Подходящие маршруты.
+        """
+        text = event.text.lower()
+        event.kinds = self.classifier(event.text, text) if self._by_kind else {}
+        if self._fast_lane:
+            fast_routes = [
+                route for route in self._fast_lane if self._check(route, event, text)
+            ]
+            if fast_routes:
+                for route in fast_routes:
+                    self._bind(route, event)
+                    yield route
+                return
+        for route in self._candidates(event, text):
+            if self._check(route, event, text):
+                yield route
+
+    @staticmethod
+    def _bind(route: Route, event: MessageEvent):
+        # Тип и поля события выставляются под маршрут до проверки фильтров,
+        # чтобы пользовательские фильтры и обработчик видели свои поля
+        if route.kind is not None and route.kind in event.kinds:
+            event.kind, event.fields = route.kind, event.kinds[route.kind]
+        else:
+            event.kind, event.fields = None, {}
+
+    def _check(self, route: Route, event: MessageEvent, text: str) -> bool:
+        self._bind(route, event)
+        return route.matches(event, text)
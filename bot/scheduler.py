@@ -0,0 +1,385 @@
+import fcntl
+import heapq
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set
+
+
+class Job:
+    """
+    Задача планировщика, возвращается из Scheduler.schedule.
+    """
+
+    __slots__ = (
+        "func",
+        "args",
+        "run_at",
+        "interval",
+        "key",
+        "group",
+        "maintenance",
+        "cancelled",
+        "future",
+        "_seq",
+    )
+
+    def __init__(
+        self,
+        func: Callable,
+        args: tuple,
+        run_at: float,
+        interval: Optional[float],
+        key: Optional[str],
+        group: Optional[Hashable],
+        maintenance: bool = False,
+    ):
+        self.func = func
+        self.args = args
+        self.run_at = run_at
+        self.interval = interval
+        self.key = key
+        self.group = group
+        self.maintenance = maintenance
+        self.cancelled = False
+        self.future: Optional[Future] = None
+        self._seq = 0
+
+
+class Scheduler:
+    """
+    Общий для процесса планировщик отложенных и периодических задач.
+
+    Задачи хранятся в куче по времени запуска, один поток ждет ближайшую
+    задачу и передает ее на выполнение в небольшой пул потоков, поэтому
+    ожидание не занимает потоков. Для задач с ключом время следующего
+    запуска может сохраняться в файл: задача с тем же ключом, поставленная
+    после перезапуска, не запустится раньше сохраненного времени. Долгие
+    служебные задачи, например перенос и очистка статистики, выполняются
+    отдельным пулом и не занимают потоки автопоста и отложенных команд.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        state_path: Optional[str] = None,
+        name: str = "scheduler",
+        maintenance_workers: int = 1,
+    ):
+        """
+        Args:
+            workers (int): Количество потоков, выполняющих задачи.
+            state_path (Optional[str]): JSON-файл времени следующего запуска задач
+                с ключом, None - не сохранять.
+            name (str): Имя потока планировщика.
+            maintenance_workers (int): Количество потоков, выполняющих служебные задачи.
+        """
+        self.state_path = state_path
+        self.executed = 0
+        self.failed = 0
+        self._heap: List = []
+        self._counter = itertools.count(1)
+        self._jobs_by_key: Dict[str, Job] = {}
+        self._groups: Dict[Hashable, Set[Job]] = {}
+        self._next_runs: Dict[str, Optional[float]] = {}
+        self._saved_runs = self._load_state()
+        self._condition = threading.Condition()
+        self._save_lock = threading.Lock()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix=name + "-job")
+        self._maintenance_executor = ThreadPoolExecutor(
+            maintenance_workers, thread_name_prefix=name + "-maintenance"
+        )
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(
+        self,
+        delay: float,
+        func: Callable,
+        *args: Any,
+        interval: Optional[float] = None,
+        key: Optional[str] = None,
+        group: Optional[Hashable] = None,
+        maintenance: bool = False,
+    ) -> Job:
+        """
+        Ставит задачу в очередь.
+
+        Args:
+            delay (float): Задержка первого запуска в секундах.
+            func (Callable): Функция задачи.
+            *args: Аргументы функции.
+            interval (Optional[float]): Период повторения в секундах, None - разовая задача.
+            key (Optional[str]): Уникальный ключ задачи. Задача с тем же ключом
+                заменяет ранее поставленную, время следующего запуска сохраняется.
+            group (Optional[Hashable]): Группа задач для cancel_group, например бот.
+            maintenance (bool): Долгая служебная задача, выполняется отдельным пулом.
+
+        Returns:
+            Job: Задача для cancel и reschedule.
+        """
+        run_at = time.time() + delay
+        job = Job(func, args, run_at, interval, key, group, maintenance)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Scheduler is closed")
+            if key is not None:
+                previous = self._jobs_by_key.get(key)
+                if previous is not None:
+                    self._cancel(previous)
+                saved = self._next_runs.get(key, self._saved_runs.get(key))
+                if saved is not None and saved > run_at:
+                    job.run_at = saved
+                self._jobs_by_key[key] = job
+            if group is not None:
+                self._groups.setdefault(group, set()).add(job)
+            self._push(job)
+        if key is not None:
+            self._save()
+        return job
+
+    def reschedule(self, job: Job, delay: float) -> bool:
+        """
+        Переносит следующий запуск задачи.
+
+        Args:
+            job (Job): Задача.
+            delay (float): Новая задержка от текущего момента в секундах.
+
+        Returns:
+            bool: False, если задача уже отменена или выполнена.
+        """
+        with self._condition:
+            if job.cancelled or not job._seq:
+                return False
+            job.run_at = time.time() + delay
+            self._push(job)
+        if job.key is not None:
+            self._save()
+        return True
+
+    def cancel(self, job: Job) -> bool:
+        """
+        Отменяет задачу. Уже начатое выполнение не прерывается.
+
+        Сохраненное время следующего запуска задачи с ключом не удаляется,
+        поэтому повторно поставленная задача не запустится раньше него.
+
+        Args:
+            job (Job): Задача.
+
+        Returns:
+            bool: False, если задача уже отменена или выполнена.
+        """
+        with self._condition:
+            return self._cancel(job)
+
+    def cancel_group(self, group: Hashable, timeout: Optional[float] = None) -> int:
+        """
+        Отменяет все задачи группы и ждет завершения уже начатых.
+
+        Args:
+            group (Hashable): Группа задач.
+            timeout (Optional[float]): Максимальное время ожидания начатых задач в секундах.
+
+        Returns:
+            int: Количество отмененных задач.
+        """
+        with self._condition:
+            jobs = self._groups.pop(group, set())
+            cancelled = sum(self._cancel(job) for job in list(jobs))
+        running = [
+            job.future
+            for job in jobs
+            if job.future is not None
+            and not job.future.done()
+            and job.future is not self._current_future()
+        ]
+        if running:
+            wait(running, timeout)
+        return cancelled
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Останавливает планировщик, дожидаясь начатых задач.
+
+        Args:
+            timeout (Optional[float]): Максимальное время ожидания потока планировщика.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+        self._maintenance_executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Возвращает счетчики планировщика.
+
+        Returns:
+            Dict[str, int]: Количество ожидающих, выполненных и упавших задач.
+        """
+        with self._condition:
+            pending = sum(
+                1 for _, seq, job in self._heap if seq == job._seq and not job.cancelled
+            )
+        return {"pending": pending, "executed": self.executed, "failed": self.failed}
+
+    def _push(self, job: Job) -> None:
+        # Прежняя запись задачи в куче становится устаревшей и пропускается
+        job._seq = next(self._counter)
+        heapq.heappush(self._heap, (job.run_at, job._seq, job))
+        if job.key is not None:
+            self._next_runs[job.key] = job.run_at
+        self._condition.notify()
+
+    def _cancel(self, job: Job) -> bool:
+        if job.cancelled or not job._seq:
+            return False
+        job.cancelled = True
+        job._seq = 0
+        self._forget(job)
+        return True
+
+    def _forget(self, job: Job) -> None:
+        if job.key is not None and self._jobs_by_key.get(job.key) is job:
+            del self._jobs_by_key[job.key]
+        if job.group is not None:
+            self._groups.get(job.group, set()).discard(job)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        return
+                    while self._heap and self._heap[0][1] != self._heap[0][2]._seq:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                _, _, job = heapq.heappop(self._heap)
+                if job.interval is not None:
+                    # Следующий запуск считается от запланированного времени,
+                    # пропущенные за время простоя запуски не повторяются
+                    job.run_at = max(job.run_at + job.interval, time.time())
+                    self._push(job)
+                else:
+                    # Разовая задача остается в группе до конца выполнения,
+                    # чтобы cancel_group дождался ее
+                    job._seq = 0
+                    if job.key is not None:
+                        self._next_runs[job.key] = None
+                executor = (
+                    self._maintenance_executor if job.maintenance else self._executor
+                )
+                job.future = executor.submit(self._execute, job)
+            if job.key is not None:
+                self._save()
+
+    def _execute(self, job: Job) -> None:
+        _local.future = job.future
+        try:
+            job.func(*job.args)
+            self.executed += 1
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Error in scheduled job {job.func.__name__}: {e}")
+        finally:
+            _local.future = None
+            if job.interval is None:
+                with self._condition:
+                    self._forget(job)
+
+    @staticmethod
+    def _current_future() -> Optional[Future]:
+        # Задача, отменяющая свою группу, не ждет сама себя
+        return getattr(_local, "future", None)
+
+    def _load_state(self) -> Dict[str, float]:
+        if not self.state_path:
+            return {}
+        try:
+            with open(self.state_path, encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.error("Failed to load scheduler state: " + str(e))
+            return {}
+
+    def _save(self) -> None:
+        if not self.state_path:
+            return
+        with self._save_lock:
+            with self._condition:
+                own_runs = dict(self._next_runs)
+            try:
+                directory = os.path.dirname(self.state_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # Файл может быть общим для нескольких процессов-шардов, поэтому
+                # чтение, объединение с записями других процессов и запись
+                # выполняются под блокировкой файла
+                with open(self.state_path + ".lock", "a") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    self._write_state(own_runs)
+            except OSError as e:
+                logging.error("Failed to save scheduler state: " + str(e))
+
+    def _write_state(self, own_runs: Dict[str, float]) -> None:
+        runs = self._load_state()
+        runs.update(own_runs)
+        now = time.time()
+        runs = {
+            key: run_at
+            for key, run_at in runs.items()
+            if run_at is not None and run_at > now
+        }
+        # Временный файл уникален для процесса и потока записи
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=os.path.basename(self.state_path) + ".",
+            suffix=".tmp",
+            dir=os.path.dirname(self.state_path) or ".",
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(runs, file)
+            os.replace(tmp_path, self.state_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+_local = threading.local()
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(workers: int = 4, state_path: Optional[str] = None) -> Scheduler:
+    """
+    Возвращает общий для процесса планировщик, создавая его при первом вызове.
+
+    Args:
+        workers (int): Количество потоков, выполняющих задачи.
+        state_path (Optional[str]): JSON-файл времени следующего запуска задач с ключом.
+
+    Returns:
+        Scheduler: Планировщик.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(workers, state_path)
+        return _scheduler
@@ -0,0 +1,379 @@
+import heapq
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+from enum import IntEnum
+from typing import Any, Dict, List, Optional
+
+import requests
+import vk_api
+from vk_api.exceptions import ApiError, ApiHttpError
+
+# Лимит VK API для пользовательского токена - 3 запроса в секунду
+SEND_RATE = 3.0
+# Максимальное количество обращений к API в одном вызове execute
+EXECUTE_LIMIT = 25
+RANDOM_ID_LIMIT = 2**31 - 1
+
+
+class Priority(IntEnum):
+    """
+    Классы приоритета исходящих сообщений, меньшее значение отправляется раньше.
+    """
+
+    HIGH = 0  # оплата и покупки на аукционе
+    NORMAL = 1  # ответы на команды
+    LOW = 2  # автопост и уведомления о состоянии
+
+
+class TokenBucket:
+    """
+    Ведро токенов: не более rate запросов в секунду в среднем, до capacity подряд.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate (float): Скорость пополнения в токенах в секунду.
+            capacity (float): Вместимость ведра.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def ready_at(self) -> float:
+        """
+        Возвращает момент появления токена по часам time.monotonic.
+
+        Returns:
+            float: Время, с которого можно забрать токен без ожидания.
+        """
+        self._refill()
+        if self._tokens >= 1:
+            return self._updated
+        return self._updated + (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        """
+        Забирает токен без ожидания, количество токенов может стать отрицательным.
+        """
+        self._refill()
+        self._tokens -= 1
+
+    def acquire(self) -> None:
+        """
+        Забирает токен, ожидая его появления при необходимости.
+        """
+        delay = self.ready_at() - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.take()
+
+
+def new_random_id() -> int:
+    """
+    Генерирует random_id для messages.send.
+
+    VK не отправляет повторно сообщение с уже использованным random_id,
+    поэтому повтор запроса после сетевой ошибки не дублирует сообщение.
+
+    Returns:
+        int: Случайный идентификатор.
+    """
+    return random.randint(1, RANDOM_ID_LIMIT)
+
+
+class _SendLoop:
+    """
+    Общий для процесса поток отправки очередей всех токенов.
+
+    Очереди с сообщениями хранятся в куче по времени, когда ведро токенов
+    очереди разрешит следующий запрос. Поток ждет ближайшую по времени
+    очередь и отправляет из нее одну пачку, поэтому количество потоков не
+    растет с количеством токенов.
+    """
+
+    def __init__(self):
+        self._heap: List = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def wake(self, scheduler: "SendScheduler") -> None:
+        """
+        Ставит очередь токена в кучу, если ее там еще нет.
+
+        Args:
+            scheduler (SendScheduler): Очередь, в которой появились сообщения.
+        """
+        with self._condition:
+            if scheduler._scheduled:
+                return
+            self._push(scheduler)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="sender", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def is_current(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def _push(self, scheduler: "SendScheduler") -> None:
+        scheduler._scheduled = True
+        heapq.heappush(
+            self._heap,
+            (scheduler._bucket.ready_at(), next(self._counter), scheduler),
+        )
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    # Новая очередь может оказаться готовой раньше ближайшей
+                    self._condition.wait(delay)
+                scheduler = heapq.heappop(self._heap)[2]
+            scheduler._send_next()
+            with self._condition:
+                if scheduler._pending():
+                    self._push(scheduler)
+                else:
+                    scheduler._scheduled = False
+
+
+_send_loop = _SendLoop()
+
+
+class _SendRequest:
+    __slots__ = ("values", "future", "attempts")
+
+    def __init__(self, values: Dict[str, Any], future: Future):
+        self.values = values
+        self.future = future
+        self.attempts = 0
+
+
+class SendScheduler:
+    """
+    Очередь исходящих сообщений одного токена.
+
+    Сообщения отправляются общим для процесса потоком отправки в порядке
+    приоритета, а внутри одного приоритета - в порядке постановки в очередь.
+    Скорость запросов ограничивается ведром токенов очереди. Если к моменту
+    очередного запроса в очереди несколько сообщений, они отправляются одним
+    вызовом execute.
+    """
+
+    def __init__(
+        self,
+        vk_session: vk_api.VkApi,
+        rate: float = SEND_RATE,
+        burst: float = SEND_RATE,
+        max_batch: int = EXECUTE_LIMIT,
+        retries: int = 3,
+        name: str = "sender",
+    ):
+        """
+        Args:
+            vk_session (vk_api.VkApi): Сессия VK API.
+            rate (float): Максимальное среднее количество запросов в секунду.
+            burst (float): Максимальное количество запросов подряд.
+            max_batch (int): Максимальное количество сообщений в одном execute.
+            retries (int): Количество попыток отправки при сетевых ошибках.
+            name (str): Имя очереди для логов.
+        """
+        self.vk_session = vk_session
+        self.name = name
+        self.max_batch = min(max_batch, EXECUTE_LIMIT)
+        self.retries = retries
+        self.sent = 0
+        self.failed = 0
+        self.requests = 0
+        self.batches = 0
+        self._bucket = TokenBucket(rate, burst)
+        self._queue: List = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        # Очередь стоит в куче потока отправки, поле защищено его блокировкой
+        self._scheduled = False
+        # Количество сообщений, снятых с очереди и еще не отправленных
+        self._in_flight = 0
+
+    def submit(
+        self, values: Dict[str, Any], priority: Priority = Priority.NORMAL
+    ) -> Future:
+        """
+        Ставит сообщение в очередь отправки.
+
+        Args:
+            values (Dict[str, Any]): Параметры messages.send, None-значения отбрасываются.
+            priority (Priority): Приоритет сообщения.
+
+        Returns:
+            Future: Результат messages.send - ID отправленного сообщения.
+        """
+        values = {key: value for key, value in values.items() if value is not None}
+        if not values.get("random_id"):
+            values["random_id"] = new_random_id()
+        future: Future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Message send queue is closed")
+            self._push(priority, _SendRequest(values, future))
+        _send_loop.wake(self)
+        return future
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Закрывает очередь для новых сообщений и ждет отправки оставшихся.
+
+        Args:
+            timeout (Optional[float]): Максимальное время ожидания в секундах.
+        """
+        with self._condition:
+            self._closed = True
+            # Из потока отправки, например из обратного вызова Future, ждать нельзя
+            if not _send_loop.is_current():
+                self._condition.wait_for(lambda: not self._pending(), timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Возвращает счетчики очереди отправки.
+
+        Returns:
+            Dict[str, int]: Глубина очереди, отправленные и неотправленные сообщения,
+                количество запросов и вызовов execute.
+        """
+        with self._condition:
+            depth = len(self._queue)
+        return {
+            "queue_depth": depth,
+            "sent": self.sent,
+            "failed": self.failed,
+            "requests": self.requests,
+            "batches": self.batches,
+        }
+
+    def _push(self, priority: int, request: _SendRequest) -> None:
+        heapq.heappush(self._queue, (priority, next(self._counter), request))
+
+    def _pending(self) -> bool:
+        return bool(self._queue) or self._in_flight > 0
+
+    def _send_next(self) -> None:
+        # Вызывается потоком отправки, когда ведро токенов разрешает запрос
+        self._bucket.take()
+        with self._condition:
+            batch = [
+                heapq.heappop(self._queue)
+                for _ in range(min(self.max_batch, len(self._queue)))
+            ]
+            self._in_flight = len(batch)
+        self.requests += 1
+        try:
+            if len(batch) == 1:
+                self._send_one(batch[0])
+            elif batch:
+                self._send_batch(batch)
+        except Exception as e:
+            logging.error("Unexpected error while sending messages: " + str(e))
+            for _, _, request in batch:
+                self._fail(request, e)
+        with self._condition:
+            self._in_flight = 0
+            self._condition.notify_all()
+
+    def _send_one(self, item) -> None:
+        priority, _, request = item
+        try:
+            result = self.vk_session.method("messages.send", request.values)
+        except (requests.RequestException, ApiHttpError) as e:
+            self._retry(priority, request, e)
+            return
+        except Exception as e:
+            self._fail(request, e)
+            return
+        self.sent += 1
+        request.future.set_result(result)
+
+    def _send_batch(self, batch) -> None:
+        code = "return [%s];" % ",".join(
+            "API.messages.send(%s)" % self._script_args(request.values)
+            for _, _, request in batch
+        )
+        try:
+            response = self.vk_session.method("execute", {"code": code}, raw=True)
+        except (requests.RequestException, ApiHttpError) as e:
+            for priority, _, request in batch:
+                self._retry(priority, request, e)
+            return
+        except Exception as e:
+            for _, _, request in batch:
+                self._fail(request, e)
+            return
+        self.batches += 1
+
+        # Ошибки отдельных вызовов приходят в execute_errors в порядке вызовов,
+        # а на месте их результатов в response стоит false
+        errors = iter(response.get("execute_errors", []))
+        for (_, _, request), result in zip(batch, response["response"]):
+            if result is False:
+                error = next(errors, {"error_code": 0, "error_msg": "execute error"})
+                self._fail(
+                    request,
+                    ApiError(
+                        self.vk_session, "messages.send", request.values, False, error
+                    ),
+                )
+            else:
+                self.sent += 1
+                request.future.set_result(result)
+
+    @staticmethod
+    def _script_args(values: Dict[str, Any]) -> str:
+        args = {
+            key: (
+                ",".join(str(item) for item in value)
+                if isinstance(value, (list, tuple))
+                else value
+            )
+            for key, value in values.items()
+        }
+        return json.dumps(args, ensure_ascii=False)
+
+    def _retry(self, priority: int, request: _SendRequest, error: Exception) -> None:
+        request.attempts += 1
+        if request.attempts >= self.retries:
+            self._fail(request, error)
+            return
+        # random_id сохраняется, поэтому повтор не создаст дубликат сообщения
+        with self._condition:
+            self._push(priority, request)
+
+    def _fail(self, request: _SendRequest, error: Exception) -> None:
+        self.failed += 1
+        logging.error(
+            f"Failed to send message to {request.values.get('peer_id')}: {error}"
+        )
+        if not request.future.done():
+            request.future.set_exception(error)
@@ -0,0 +1,209 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from bot.db import DatabaseHandler, FishingEventType
+
+# Элемент очереди: таблица и строка для нее
+FISHING_EVENT = "FishingEvent"
+FISH_CATCH = "FishCatch"
+QueueItem = Tuple[str, tuple]
+
+_STOP = object()
+
+
+class StatsWriter:
+    def __init__(
+        self,
+        db: DatabaseHandler,
+        max_queue: int = 10000,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+    ):
+        """
+        Фоновая запись статистики пачками.
+
+        Обработчики событий только кладут строки в ограниченную очередь,
+        отдельный поток собирает их в пачки и пишет одной транзакцией через
+        executemany: по достижении batch_size строк или через flush_interval
+        секунд после первой строки пачки. При переполнении очереди строки
+        отбрасываются и учитываются в счетчике dropped.
+
+        :param db: Обработчик базы данных.
+        :param max_queue: Максимальный размер очереди.
+        :param batch_size: Максимальный размер пачки.
+        :param flush_interval: Максимальное время ожидания пачки в секундах.
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue: "queue.Queue" = queue.Queue(max_queue)
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="stats-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add_fishing_event(self, user_id: int, ts: int, type: FishingEventType) -> bool:
+        """
+        Постановка события рыбалки в очередь без ожидания записи на диск.
+
+        :param user_id: Идентификатор пользователя.
+        :param ts: Временная метка события.
+        :param type: Тип события.
+        :return: False, если очередь переполнена и запись отброшена.
+        """
+        return self._put((FISHING_EVENT, (user_id, ts, type)))
+
+    def add_catch(
+        self,
+        user_id: int,
+        ts: int,
+        weight_g: Optional[int],
+        price: Optional[int],
+    ) -> bool:
+        """
+        Постановка пойманной рыбы в очередь без ожидания записи на диск.
+
+        :param user_id: Идентификатор пользователя.
+        :param ts: Временная метка улова.
+        :param weight_g: Вес рыбы в граммах.
+        :param price: Цена рыбы.
+        :return: False, если очередь переполнена и запись отброшена.
+        """
+        return self._put((FISH_CATCH, (user_id, ts, weight_g, price)))
+
+    def _put(self, item: QueueItem) -> bool:
+        if self._closed:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ожидание записи всех строк, поставленных в очередь до вызова.
+
+        :param timeout: Максимальное время ожидания в секундах.
+        :return: True, если строки записаны за отведенное время.
+        """
+        if self._closed:
+            return True
+        started = time.monotonic()
+        done = threading.Event()
+        # Очередь ограничена: ожидание места в ней входит в общее время ожидания
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        if timeout is not None:
+            timeout = max(0.0, timeout - (time.monotonic() - started))
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Запись оставшихся строк и остановка фонового потока.
+
+        :param timeout: Максимальное время ожидания в секундах.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            # Поток записи не успевает разобрать очередь, закрытие не ждет его
+            pending = self._queue.qsize()
+            self.dropped += pending
+            logging.error(
+                f"Stats queue is still full after {timeout} s, "
+                f"dropping {pending} unwritten rows"
+            )
+            return
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики фоновой записи.
+
+        :return: Глубина очереди, записанные, отброшенные и не записанные из-за ошибок строки, число пачек.
+        """
+        return {
+            "queue_depth": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+    def _run(self) -> None:
+        batch: List[QueueItem] = []
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._write(batch)
+                continue
+            if item is _STOP:
+                self._write(batch)
+                self.db.close()
+                return
+            if isinstance(item, threading.Event):
+                self._write(batch)
+                item.set()
+                continue
+            batch.append(item)
+            if len(batch) == 1:
+                deadline = time.monotonic() + self.flush_interval
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+
+    def _write(self, batch: List[QueueItem]) -> None:
+        if not batch:
+            return
+        rows: Dict[str, list] = {FISHING_EVENT: [], FISH_CATCH: []}
+        for table, row in batch:
+            rows[table].append(row)
+        try:
+            self.db.add_fishing_records(rows[FISHING_EVENT], rows[FISH_CATCH])
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            logging.error("Failed to write stats batch: " + str(e))
+        batch.clear()
+
+
+_writers: Dict[str, StatsWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_stats_writer(db: DatabaseHandler) -> StatsWriter:
+    """
+    Получение общего для процесса StatsWriter для файла базы данных.
+
+    Писатель создается из обработчика первого вызова для этого файла,
+    поэтому обработчик не должен принадлежать конкретному боту.
+
+    :param db: Обработчик базы данных, его tenant попадает в метки метрик.
+    :return: Фоновый писатель статистики.
+    """
+    with _writers_lock:
+        writer = _writers.get(db.db_name)
+        if writer is None:
+            writer = _writers[db.db_name] = StatsWriter(db)
+        return writer
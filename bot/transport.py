@@ -0,0 +1,123 @@
+import configparser
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from vk_api.vk_api import DEFAULT_USERAGENT
+
+
+class HttpTransport(requests.Session):
+    """
+    HTTP-сессия, общая для всех ботов процесса.
+
+    Запросы к API и long poll всех ботов идут через общие пулы keep-alive
+    соединений (отдельный пул на каждый хост), поэтому соединение с
+    сервером VK переиспользуется, а не устанавливается заново для каждого
+    бота. Запросы без явного таймаута получают таймаут по умолчанию.
+    """
+
+    def __init__(
+        self,
+        pool_maxsize: int = 128,
+        pool_connections: int = 16,
+        pool_block: bool = False,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+    ):
+        """
+        Args:
+            pool_maxsize (int): Максимальное количество соединений, хранимых в пуле
+                одного хоста. Должно быть не меньше количества ботов, иначе
+                лишние соединения long poll закрываются после каждого запроса.
+            pool_connections (int): Количество хостов, пулы которых хранятся.
+            pool_block (bool): Ждать свободного соединения вместо открытия
+                нового сверх pool_maxsize.
+            connect_timeout (float): Таймаут установки соединения в секундах.
+            read_timeout (float): Таймаут ожидания ответа в секундах.
+        """
+        super().__init__()
+        self.headers["User-agent"] = DEFAULT_USERAGENT
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self.mount("https://", self.adapter)
+        self.mount("http://", self.adapter)
+        self.requests_sent = 0
+        self.errors = 0
+        self._counters_lock = threading.Lock()
+
+    def request(self, method: str, url: str, *args: Any, **kwargs: Any):
+        # Long poll передает свой таймаут, превышающий время ожидания событий
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            return super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            with self._counters_lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._counters_lock:
+                self.requests_sent += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает счетчики запросов и состояние пулов соединений.
+
+        Returns:
+            Dict[str, Any]: Количество запросов и ошибок, для каждого хоста -
+                количество открытых за все время соединений (каждое означает
+                установку TCP и TLS), выполненных запросов и свободных соединений в пуле.
+        """
+        pools = {}
+        poolmanager = self.adapter.poolmanager
+        for key in list(poolmanager.pools.keys()):
+            pool = poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            idle = sum(conn is not None for conn in list(pool.pool.queue))
+            pools[f"{pool.scheme}://{pool.host}"] = {
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": idle,
+            }
+        return {"requests": self.requests_sent, "errors": self.errors, "pools": pools}
+
+
+_transport: Optional[HttpTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport(global_config: configparser.ConfigParser) -> HttpTransport:
+    """
+    Возвращает общую для процесса HTTP-сессию, создавая ее при первом вызове
+    по настройкам секции HTTP глобального конфига.
+
+    Args:
+        global_config (configparser.ConfigParser): Глобальный конфиг.
+
+    Returns:
+        HttpTransport: HTTP-сессия.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = HttpTransport(
+                pool_maxsize=global_config.getint("HTTP", "pool_maxsize", fallback=128),
+                pool_connections=global_config.getint(
+                    "HTTP", "pool_connections", fallback=16
+                ),
+                pool_block=global_config.getboolean(
+                    "HTTP", "pool_block", fallback=False
+                ),
+                connect_timeout=global_config.getfloat(
+                    "HTTP", "connect_timeout", fallback=5.0
+                ),
+                read_timeout=global_config.getfloat(
+                    "HTTP", "read_timeout", fallback=30.0
+                ),
+            )
+        return _transport
@@ -1,11 +1,21 @@
-import ctypes
+import argparse
+import asyncio
+import configparser
+import multiprocessing
 import threading
-import time
 import logging
 import os
-from bot import Bot, register_handlers
-from utils import calculate_hash, load_configs
-
+import queue
+import random
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from multiprocessing import connection
+from bot import Bot, metrics, register_handlers
+from bot.bot import STOP_TIMEOUT
+from bot.handlers import create_database
+from bot.transport import get_transport
+from utils import HashRing, ConfigWatcher
+from utils.config_loader import ADDED, DELETED, MODIFIED
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,66 +26,434 @@ logging.basicConfig(
 )
 
 
-def start_bot(config, filename, thread_map):
-    token = config["PERSONAL"]["token"]
-    bot = Bot(token)
+def read_global_config():
+    global_config = configparser.ConfigParser()
+    global_config.read("bot/global_config.ini")
+    return global_config
 
-    # Регистрация хендлеров
-    register_handlers(bot, config)
 
-    bot.listen()
+class BootPipeline:
+    """
+    Ограничение одновременного запуска ботов.
 
+    Конструктор Bot блокируется на запросе getLongPollServer, поэтому после
+    перезапуска процесса сотни ботов одновременно обращаются к VK. Подготовку
+    бота (получение long poll сервера и регистрацию обработчиков) выполняют
+    не более parallelism ботов одновременно, перед ней каждый бот ждет
+    случайную задержку до jitter секунд. Неудачное получение long poll
+    сервера повторяется с растущей задержкой.
+    """
 
-if __name__ == "__main__":
-    configs = load_configs()
-    threads = {}
-
-    for filename, config_info in configs.items():
-        config, hash = config_info
-        thread = threading.Thread(
-            target=start_bot,
-            args=(config, filename, threads),
-            name=filename.removesuffix(".ini"),
+    def __init__(self, parallelism=16, jitter=1.0, attempts=5):
+        self.jitter = jitter
+        self.attempts = attempts
+        self._slots = threading.BoundedSemaphore(parallelism)
+
+    @classmethod
+    def from_config(cls, global_config):
+        return cls(
+            parallelism=global_config.getint("BOOT", "parallelism", fallback=16),
+            jitter=global_config.getfloat("BOOT", "jitter", fallback=1.0),
+            attempts=global_config.getint("BOOT", "attempts", fallback=5),
         )
-        thread.start()
-        threads[filename] = {"thread": thread, "hash": hash}
 
-    # Проверка на новые конфиги и запуск ботов для них
-    while True:
-        time.sleep(5)  # Проверка каждую минуту
-        new_configs = load_configs()
-        new_files = set(new_configs.keys()) - set(configs.keys())
-
-        # Обработка новых config-файлов
-        for new_file in new_files:
-            logging.info(f"Config '{new_file}' added. Starting new bot...")
-            new_config_info = new_configs[new_file]
-            new_config, new_hash = new_config_info
-            thread = threading.Thread(
-                target=start_bot,
-                args=(new_config, new_file, threads),
-                name=new_file.removesuffix(".ini"),
+    def prepare(self, config, name, global_config):
+        time.sleep(random.uniform(0, self.jitter))
+        for attempt in range(1, self.attempts + 1):
+            with self._slots:
+                try:
+                    # Все боты процесса используют общие пулы HTTP-соединений
+                    bot = Bot(
+                        config["PERSONAL"]["token"],
+                        name=name,
+                        transport=get_transport(global_config),
+                    )
+                except Exception as e:
+                    if attempt == self.attempts:
+                        raise
+                    error = e
+                else:
+                    # Регистрация хендлеров
+                    register_handlers(bot, config)
+                    return bot
+            # Ожидание перед повтором не занимает место других ботов
+            delay = min(30.0, 2.0**attempt) + random.uniform(0, self.jitter)
+            logging.warning(
+                f"Failed to get long poll server for {name} "
+                f"(attempt {attempt}): {error}. Retrying in {delay:.1f} s"
             )
-            thread.start()
-            threads[new_file] = {"thread": thread, "hash": new_hash}
-
-        same_config_files = set(configs.keys()) & set(new_configs.keys())
-        for same_file in same_config_files:
-            new_config_info = new_configs[same_file]
-            new_config, new_hash = new_config_info
-            if new_hash != threads[same_file]["hash"]:
-                logging.info(f"Config '{same_file}' updated. Restarting bot...")
-                threads[same_file]["hash"] = new_hash
-                id = threads[same_file]["thread"].ident
-                ctypes.pythonapi.PyThreadState_SetAsyncExc(
-                    ctypes.c_long(id), ctypes.py_object(AssertionError)
-                )
-                new_thread = threading.Thread(
-                    target=start_bot,
-                    args=(new_config, same_file, threads),
-                    name=same_file.removesuffix(".ini"),
+            time.sleep(delay)
+
+
+boot = BootPipeline()
+
+
+def bootstrap_database(configs):
+    """
+    Подготавливает базу для всех ботов одной транзакцией до их запуска,
+    после этого регистрация обработчиков каждого бота не пишет в базу.
+    """
+    tenants = []
+    for filename, config in configs:
+        try:
+            tenants.append(
+                (
+                    int(config["PERSONAL"]["user_id"]),
+                    int(config["PERSONAL"]["main_chat_id"]),
                 )
-                threads[same_file]["thread"] = new_thread
-                new_thread.start()
+            )
+        except (KeyError, ValueError) as e:
+            logging.error(f"Invalid PERSONAL section in config '{filename}': {e}")
+    if not tenants:
+        return
+    started_at = time.monotonic()
+    db = create_database(read_global_config())
+    try:
+        db.bootstrap_tenants(tenants)
+    except Exception as e:
+        # Каждый бот подготовит базу для себя при регистрации обработчиков
+        logging.error("Failed to bootstrap database: " + str(e))
+        return
+    finally:
+        db.close()
+    logging.info(
+        f"Database bootstrap of {len(tenants)} bots took "
+        f"{time.monotonic() - started_at:.2f} s"
+    )
+
+
+def start_bot(config, filename, bot_future, predecessor=None, started_at=None):
+    # started_at - начало запуска по time.monotonic(): при запуске процесса
+    # общее для всех ботов, чтобы время готовности включало ожидание очереди
+    started_at = started_at or time.monotonic()
+    name = filename.removesuffix(".ini")
+    try:
+        bot = boot.prepare(config, name, read_global_config())
+    except BaseException as e:
+        bot_future.set_exception(e)
+        # Старый бот не оставляется работать без возможности его остановить
+        if predecessor is not None:
+            stop_bot(predecessor)
+        raise
+    ready_in = time.monotonic() - started_at
+    metrics.BOOT_SECONDS.labels(name).observe(ready_in)
+    logging.info(f"Bot {name} ready in {ready_in:.2f} s")
+    bot_future.set_result(bot)
+
+    # Старый бот останавливается только после подготовки нового,
+    # и новый продолжает long poll с позиции старого
+    bot.listen(stop_bot(predecessor) if predecessor is not None else None)
+
+
+async def start_async_bot(config, filename, session, executor):
+    from bot.async_bot import AsyncBot
+
+    bot = AsyncBot(
+        config["PERSONAL"]["token"],
+        session,
+        executor,
+        name=filename.removesuffix(".ini"),
+    )
+
+    # Регистрация хендлеров, включая запросы к базе, выполняется вне цикла событий
+    await asyncio.get_running_loop().run_in_executor(
+        executor, register_handlers, bot, config
+    )
+
+    await bot.listen()
+
+
+def log_config_event(event, where=""):
+    if event.kind == ADDED:
+        logging.info(f"Config '{event.filename}' added. Starting new bot{where}...")
+    elif event.kind == MODIFIED:
+        logging.info(f"Config '{event.filename}' updated. Restarting bot...")
+    else:
+        logging.info(f"Config '{event.filename}' removed. Stopping bot...")
+
+
+async def run_async(handler_threads=32):
+    from bot.async_bot import AIOHTTP_REQUIRED, aiohttp
+
+    if aiohttp is None:
+        raise ImportError(AIOHTTP_REQUIRED)
+
+    watcher = ConfigWatcher()
+    executor = ThreadPoolExecutor(handler_threads, thread_name_prefix="handlers")
+    tasks = {}
+    loop = asyncio.get_running_loop()
+
+    async with aiohttp.ClientSession() as session:
+
+        def start(filename, config):
+            tasks[filename] = asyncio.create_task(
+                start_async_bot(config, filename, session, executor),
+                name=filename.removesuffix(".ini"),
+            )
+
+        async def stop(filename):
+            task = tasks.pop(filename, None)
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+        await loop.run_in_executor(
+            executor,
+            bootstrap_database,
+            [
+                (filename, config)
+                for filename, (config, hash) in watcher.configs.items()
+            ],
+        )
+        for filename, (config, hash) in watcher.configs.items():
+            start(filename, config)
+
+        # Ожидание изменений конфигов в отдельном потоке, цикл событий не блокируется
+        while True:
+            for event in await loop.run_in_executor(None, watcher.read, 5):
+                log_config_event(event)
+                await stop(event.filename)
+                if event.kind != DELETED:
+                    start(event.filename, event.config)
+
+
+def start_bot_thread(filename, config, predecessor=None, started_at=None):
+    """
+    Запускает бота в отдельном потоке.
+
+    Возвращает Future с ботом, который завершается после регистрации
+    обработчиков. Если передан predecessor (Future предыдущего бота того
+    же конфига), новый бот перед прослушиванием останавливает его.
+    """
+    bot_future = Future()
+    threading.Thread(
+        target=start_bot,
+        args=(config, filename, bot_future, predecessor, started_at),
+        name=filename.removesuffix(".ini"),
+    ).start()
+    return bot_future
+
+
+def boot_bots(configs):
+    """
+    Запускает ботов при старте процесса: подготовка базы одной транзакцией,
+    затем параллельный запуск с ограничением BootPipeline. Итог запуска
+    пишется в лог после готовности всех ботов.
+
+    Возвращает словарь Future ботов по имени конфига.
+    """
+    started_at = time.monotonic()
+    configs = list(configs)
+    bootstrap_database(configs)
+    bots = {
+        filename: start_bot_thread(filename, config, started_at=started_at)
+        for filename, config in configs
+    }
+    if bots:
+        threading.Thread(
+            target=log_boot_summary,
+            args=(list(bots.values()), started_at),
+            name="boot-summary",
+            daemon=True,
+        ).start()
+    return bots
+
+
+def log_boot_summary(bot_futures, started_at):
+    wait(bot_futures)
+    failed = sum(future.exception() is not None for future in bot_futures)
+    logging.info(
+        f"Booted {len(bot_futures) - failed} of {len(bot_futures)} bots "
+        f"in {time.monotonic() - started_at:.2f} s"
+    )
+
+
+def stop_bot(bot_future):
+    # Возвращает позицию long poll остановленного бота или None, если бот
+    # не запустился. Запуск ожидается без таймаута: start_bot завершает
+    # Future всегда, и бот, который еще готовится, не должен остаться
+    # слушать рядом с преемником
+    try:
+        bot = bot_future.result()
+    except Exception as e:
+        logging.warning(f"Previous bot failed to start, nothing to stop: {e!r}")
+        return None
+    return bot.stop(STOP_TIMEOUT)
+
+
+def apply_config_event(bots, kind, filename, config=None):
+    # При перезапуске старый бот передается новому и останавливается им,
+    # при удалении конфига останавливается сразу
+    predecessor = bots.pop(filename, None)
+    if kind != DELETED:
+        bots[filename] = start_bot_thread(filename, config, predecessor)
+    elif predecessor is not None:
+        threading.Thread(
+            target=stop_bot, args=(predecessor,), name="stop-" + filename
+        ).start()
+
+
+def run_threads():
+    watcher = ConfigWatcher()
+    bots = boot_bots(
+        (filename, config) for filename, (config, hash) in watcher.configs.items()
+    )
+
+    # Запуск, перезапуск и остановка ботов по событиям изменения конфигов
+    while True:
+        for event in watcher.read():
+            log_config_event(event)
+            apply_config_event(bots, event.kind, event.filename, event.config)
+
+
+def config_to_dict(config):
+    # ConfigParser передается в процесс-шард в виде словаря секций
+    return {
+        section: dict(config.items(section, raw=True)) for section in config.sections()
+    }
+
+
+def run_shard(shard, commands):
+    """
+    Рабочий процесс шарда: запускает ботов своих конфигов в потоках.
+
+    Команды от родительского процесса: ("start", filename, sections) -
+    запуск или перезапуск бота, ("stop", filename) - остановка бота.
+    """
+    bots = {}
+    parent = os.getppid()
+    # Каждый шард отдает метрики на своем порту: port + номер шарда
+    metrics.port_offset = shard
+    logging.info(f"Shard {shard} started (pid {os.getpid()})")
+    while True:
+        try:
+            command, filename, *payload = commands.get(timeout=5)
+        except queue.Empty:
+            # Потоки ботов не демоны, поэтому без родителя процесс завершается явно
+            if os.getppid() != parent:
+                logging.info(f"Shard {shard} lost its supervisor. Exiting...")
+                os._exit(0)
+            continue
+        if command == "start":
+            config = configparser.ConfigParser()
+            config.read_dict(payload[0])
+            apply_config_event(bots, MODIFIED, filename, config)
+        else:
+            apply_config_event(bots, DELETED, filename)
+
+
+def run_sharded(shards):
+    """
+    Супервизор шардов: распределяет конфиги ботов между процессами-шардами
+    по кольцу хешей и перезапускает упавшие шарды.
+
+    Супервизор не открывает базу и не запускает потоков, поэтому шарды
+    создаются fork из однопоточного процесса. Каждый шард пишет в базу
+    своим потоком записи, между шардами запись разделяется блокировкой
+    файла SQLite.
+    """
+    # fork: дочерний процесс не исполняет модуль заново и не обнуляет bot.log
+    context = multiprocessing.get_context("fork")
+    ring = HashRing(range(shards))
+    watcher = ConfigWatcher()
+    workers = {}
+
+    def spawn(shard):
+        commands = context.Queue()
+        process = context.Process(
+            target=run_shard,
+            args=(shard, commands),
+            name=f"shard-{shard}",
+            daemon=True,
+        )
+        process.start()
+        workers[shard] = {"process": process, "commands": commands}
+
+    def send(command, filename, *payload):
+        workers[ring.node_for(filename)]["commands"].put((command, filename, *payload))
+
+    # База подготавливается до запуска шардов, чтобы они не конкурировали
+    # за запись в нее при одновременном запуске ботов. Подготовка выполняется
+    # в отдельном процессе: поток записи базы не должен оставаться в
+    # супервизоре, из которого потом создаются шарды
+    bootstrap = context.Process(
+        target=bootstrap_database,
+        args=(
+            [
+                (filename, config)
+                for filename, (config, hash) in watcher.configs.items()
+            ],
+        ),
+        name="bootstrap",
+    )
+    bootstrap.start()
+    bootstrap.join()
+    for shard in ring.nodes():
+        spawn(shard)
+    for filename, (config, hash) in watcher.configs.items():
+        send("start", filename, config_to_dict(config))
+
+    while True:
+        # Супервизор спит до изменения конфигов или завершения одного из шардов
+        sentinels = {
+            worker["process"].sentinel: shard for shard, worker in workers.items()
+        }
+        waitables = list(sentinels)
+        if watcher.uses_inotify:
+            waitables.append(watcher)
+        ready = connection.wait(
+            waitables, None if watcher.uses_inotify else watcher.poll_interval
+        )
+
+        # Перезапуск упавших шардов с повторной отправкой их конфигов
+        for shard in [sentinels[item] for item in ready if item in sentinels]:
+            process = workers[shard]["process"]
+            process.join()
+            logging.error(
+                f"Shard {shard} exited with code {process.exitcode}. Restarting..."
+            )
+            spawn(shard)
+            for filename, (config, hash) in watcher.configs.items():
+                if ring.node_for(filename) == shard:
+                    send("start", filename, config_to_dict(config))
+
+        for event in watcher.read(timeout=0):
+            log_config_event(event, f" in shard {ring.node_for(event.filename)}")
+            if event.kind == DELETED:
+                send("stop", event.filename)
+            else:
+                send("start", event.filename, config_to_dict(event.config))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--mode",
+        choices=["threads", "async"],
+        default="threads",
+        help="threads - поток на каждого бота, async - все боты в одном цикле "
+        "событий (требуется пакет aiohttp)",
+    )
+    parser.add_argument(
+        "--handler-threads",
+        type=int,
+        default=32,
+        help="размер общего пула потоков для обработчиков в режиме async",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=0,
+        help="количество процессов-шардов, между которыми распределяются боты "
+        "(0 - все боты в одном процессе)",
+    )
+    args = parser.parse_args()
 
-        configs = new_configs
+    # Ограничения запуска действуют на каждый процесс-шард отдельно
+    boot = BootPipeline.from_config(read_global_config())
+    if args.shards > 0:
+        run_sharded(args.shards)
+    elif args.mode == "async":
+        asyncio.run(run_async(args.handler_threads))
+    else:
+        run_threads()
@@ -0,0 +1,74 @@
+from benchmarks.fake_vk import make_event
+from bot.classifier import MessageKind, classify, parse_auction_lots
+from bot.router import Router
+
+FISH_MESSAGE = "Вы успешно выловили рыбу! Окунь (1.25 кг) продан в 40 золота"
+
+
+def kinds_of(text):
+    return classify(text, text.lower())
+
+
+def test_noise_has_no_kinds():
+    assert kinds_of("Обычное сообщение в чате") == {}
+
+
+def test_overlapping_markers_give_every_kind():
+    text = "Вы готовитесь к рыбалке... Карта озера активирована\n" + FISH_MESSAGE
+    kinds = kinds_of(text)
+    assert list(kinds) == [
+        MessageKind.FISHING_START,
+        MessageKind.FISHING_MAP_ACTIVATED,
+        MessageKind.FISH_CAUGHT,
+    ]
+    assert kinds[MessageKind.FISH_CAUGHT] == {"weight_g": 1250, "price": 40}
+
+
+def test_marker_without_fields_is_not_a_kind():
+    kinds = kinds_of("Вы успешно выловили рыбу! Карта озера активирована")
+    assert list(kinds) == [MessageKind.FISHING_MAP_ACTIVATED]
+
+
+def test_transfer_with_marker_gives_both_kinds():
+    text = "Получено: ✅2*Меч силы: [id555|Вася] =&gt; [id100|Петя] вы готовитесь к рыбалке"
+    kinds = kinds_of(text)
+    assert list(kinds) == [MessageKind.ITEM_TRANSFER, MessageKind.FISHING_START]
+    assert kinds[MessageKind.ITEM_TRANSFER]["item_name"] == "меч силы"
+    assert kinds[MessageKind.ITEM_TRANSFER]["quantity"] == 2
+
+
+def test_auction_lots_are_parsed_per_line():
+    text = (
+        "игрок продает через аукцион:\n"
+        "2*меч силы - 100 золота (1001)\n"
+        "3*щит\n"
+        "- 30 золота (1002)\n"
+        "5 * зелье - 50 золота (1003) 1*лишний - 1 золота (9)\n"
+    )
+    assert parse_auction_lots(text) == [
+        (2, "меч силы", 100, "1001"),
+        (5, "зелье", 50, "1003"),
+    ]
+
+
+def test_router_dispatches_every_matching_kind():
+    router = Router(classifier=classify)
+    calls = []
+
+    def record(name):
+        return lambda event: calls.append((name, event.kind, event.fields))
+
+    router.add(record("start"), {"kind": MessageKind.FISHING_START})
+    router.add(record("any"), {})
+    router.add(record("fish"), {"kind": MessageKind.FISH_CAUGHT})
+    router.add(record("bought"), {"kind": MessageKind.AUCTION_BOUGHT})
+
+    event = make_event(1, "Вы готовитесь к рыбалке\n" + FISH_MESSAGE)
+    for route in router.match(event):
+        route.func(event)
+
+    assert calls == [
+        ("start", MessageKind.FISHING_START, {}),
+        ("any", None, {}),
+        ("fish", MessageKind.FISH_CAUGHT, {"weight_g": 1250, "price": 40}),
+    ]
@@ -0,0 +1,193 @@
+import datetime
+import sqlite3
+import time
+
+import pytest
+
+from bot.db import DatabaseHandler, local_day_start
+
+USERS = (1, 2)
+HOUR = 3600
+DAY = 24 * HOUR
+TODAY = local_day_start(datetime.date.today())
+
+
+def legacy_rows():
+    rows = []
+    for user_id in USERS:
+        for days_ago in range(1, 10):
+            day_start = TODAY - days_ago * DAY
+            for hour in range(1, 6):
+                ts = day_start + hour * HOUR + user_id
+                rows.append((user_id, ts, "FISHING_START", None))
+                if hour % 2:
+                    rows.append((user_id, ts + 60, "FISHING_MAP_ACTIVATED", None))
+                weight = f"{hour * 0.375 + days_ago:.3f}"
+                rows.append((user_id, ts + 120, "FISH_WEIGHT", weight))
+                rows.append((user_id, ts + 120, "FISH_PRICE", str(10 * hour + user_id)))
+    # Строки улова без пары и строка другого типа, которая не переносится
+    rows.append((1, TODAY - 3 * DAY + 7 * HOUR, "FISH_PRICE", "7"))
+    rows.append((2, TODAY - 4 * DAY + 7 * HOUR, "FISH_WEIGHT", "2.5"))
+    rows.append((1, TODAY - 2 * DAY, "OTHER", "x"))
+    return rows
+
+
+WINDOWS = (
+    (TODAY - 9 * DAY + 3 * HOUR, int(time.time())),
+    (TODAY - 5 * DAY, TODAY - 2 * DAY + 5 * HOUR),
+    (TODAY - 4 * DAY + 2 * HOUR, TODAY - 4 * DAY + 4 * HOUR),
+)
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "database.db")
+    db = DatabaseHandler(path)
+    for user_id in USERS:
+        db.add_user(user_id)
+    # Строки в формате до переноса: add_stats пишет рыбалку сразу в новые таблицы
+    with sqlite3.connect(path) as conn:
+        conn.executemany(
+            "INSERT INTO Stats (user_id, timestamp, text, type) VALUES (?, ?, ?, ?)",
+            [
+                (user_id, db.convert_timestamp(ts), text, type)
+                for user_id, ts, type, text in legacy_rows()
+            ],
+        )
+    db.rebuild_daily_stats()
+    yield db
+    db.pool.close_all()
+
+
+def summaries(db):
+    return [
+        db.get_fishing_summary(user_id, start, end)
+        for user_id in USERS
+        for start, end in WINDOWS
+    ]
+
+
+def assert_same_summaries(actual, expected):
+    for summary, before in zip(actual, expected):
+        assert summary._replace(weight_sum=0) == before._replace(weight_sum=0)
+        assert summary.weight_sum == pytest.approx(before.weight_sum)
+
+
+def table_counts(db):
+    with sqlite3.connect(db.db_name) as conn:
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("Stats", "FishingEvent", "FishCatch")
+        }
+
+
+def stats_index_exists(db):
+    with sqlite3.connect(db.db_name) as conn:
+        return (
+            conn.execute(
+                "SELECT 1 FROM sqlite_master "
+                "WHERE name = 'idx_stats_user_type_timestamp'"
+            ).fetchone()
+            is not None
+        )
+
+
+def test_migration_keeps_summaries(db):
+    before = summaries(db)
+    # Индекс Stats нужен сводке, пока перенос не завершен
+    assert stats_index_exists(db)
+
+    migrated = db.migrate_stats(chunk_size=7, pause=0)
+
+    assert migrated == len(legacy_rows()) - 1
+    assert not stats_index_exists(db)
+    # Пары веса и цены объединены, строки без пары перенесены по отдельности
+    assert table_counts(db) == {"Stats": 1, "FishingEvent": 144, "FishCatch": 92}
+    assert_same_summaries(summaries(db), before)
+    db.rebuild_daily_stats()
+    assert_same_summaries(summaries(db), before)
+
+
+def test_leftover_rows_are_migrated_in_bounded_chunks(db):
+    before = summaries(db)
+    counts = []
+    while True:
+        count, done = db._migrate_stats_chunk(3)
+        if done:
+            break
+        counts.append(count)
+
+    # Каждая пачка, включая проход по строкам без пары, не больше chunk_size
+    assert max(counts) <= 3
+    assert sum(counts) == len(legacy_rows()) - 1
+    assert table_counts(db) == {"Stats": 1, "FishingEvent": 144, "FishCatch": 92}
+    assert_same_summaries(summaries(db), before)
+
+
+def test_rerun_after_interrupted_chunk_is_idempotent(db):
+    before = summaries(db)
+    assert db._migrate_stats_chunk(11) == (11, False)
+    # Следующая пачка обрывается на середине записи и откатывается целиком
+    with sqlite3.connect(db.db_name) as conn:
+        conn.execute(
+            "CREATE TRIGGER interrupt BEFORE INSERT ON FishCatch "
+            "BEGIN SELECT RAISE(ABORT, 'interrupted'); END"
+        )
+    with pytest.raises(sqlite3.DatabaseError, match="interrupted"):
+        db._migrate_stats_chunk(11)
+    assert_same_summaries(summaries(db), before)
+    with sqlite3.connect(db.db_name) as conn:
+        conn.execute("DROP TRIGGER interrupt")
+
+    db.migrate_stats(chunk_size=11, pause=0)
+
+    assert table_counts(db) == {"Stats": 1, "FishingEvent": 144, "FishCatch": 92}
+    assert_same_summaries(summaries(db), before)
+    assert db.migrate_stats(chunk_size=11, pause=0) == 0
+    assert table_counts(db) == {"Stats": 1, "FishingEvent": 144, "FishCatch": 92}
+
+
+def test_retention_keeps_daily_summary(db):
+    db.migrate_stats(chunk_size=50, pause=0)
+    start, end = TODAY - 9 * DAY, int(time.time())
+    before = [db.get_fishing_summary(user_id, start, end) for user_id in USERS]
+    before_day = datetime.date.fromtimestamp(TODAY - 3 * DAY).isoformat()
+
+    deleted = 0
+    while True:
+        count = db.delete_old_stats(1, before_day, 10)
+        deleted += count
+        if not count:
+            break
+
+    assert deleted == 6 * (5 + 3 + 5)
+    with sqlite3.connect(db.db_name) as conn:
+        assert conn.execute(
+            "SELECT COUNT(*) FROM FishCatch WHERE user_id = 1 AND ts < ?",
+            (TODAY - 3 * DAY,),
+        ).fetchone() == (0,)
+    after = [db.get_fishing_summary(user_id, start, end) for user_id in USERS]
+    assert_same_summaries(after, before)
+
+
+def test_add_stats_after_migration_is_counted(db):
+    db.migrate_stats(chunk_size=50, pause=0)
+    before = summaries(db)
+    ts = TODAY - 4 * DAY + 3 * HOUR
+    db.add_stats(
+        [
+            (2, ts, "FISHING_START", None),
+            (2, ts + 1, "FISH_WEIGHT", "1.5"),
+            (2, ts + 1, "FISH_PRICE", "30"),
+        ]
+    )
+    db.add_stat(2, ts + 2, "FISH_PRICE", "5")
+
+    counts = table_counts(db)
+    assert counts == {"Stats": 1, "FishingEvent": 145, "FishCatch": 94}
+    for summary, old in zip(summaries(db)[3:], before[3:]):
+        assert summary.fishing_starts == old.fishing_starts + 1
+        assert summary.weight_sum == pytest.approx(old.weight_sum + 1.5)
+        assert summary.weight_count == old.weight_count + 1
+        assert summary.price_sum == old.price_sum + 35
+        assert summary.price_count == old.price_count + 2
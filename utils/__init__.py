@@ -1,3 +1,4 @@
-from .config_loader import calculate_hash, load_configs
+from .config_loader import ConfigEvent, ConfigWatcher, calculate_hash, load_configs
+from .sharding import HashRing
 
-__all__ = ["load_configs", "calculate_hash"]
+__all__ = ["load_configs", "calculate_hash", "ConfigWatcher", "ConfigEvent", "HashRing"]
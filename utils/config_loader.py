@@ -1,7 +1,13 @@
 import configparser
+import ctypes
+import ctypes.util
 import hashlib
+import logging
 import os
-from typing import Dict, Tuple
+import select
+import struct
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 
 def load_configs(
@@ -26,3 +32,223 @@ def calculate_hash(config: configparser.ConfigParser) -> str:
             hash_object.update(key.encode("utf-8"))
             hash_object.update(value.encode("utf-8"))
     return hash_object.hexdigest()
+
+
+# Константы inotify из <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+INOTIFY_EVENT = struct.Struct("iIII")
+
+ADDED = "added"
+MODIFIED = "modified"
+DELETED = "deleted"
+
+
+class ConfigEvent(NamedTuple):
+    kind: str
+    filename: str
+    config: Optional[configparser.ConfigParser]
+    hash: Optional[str]
+
+
+def _inotify_init(path: str) -> Optional[int]:
+    """
+    Открывает inotify и подписывается на изменения каталога.
+
+    Возвращает None, если inotify недоступен (не Linux, нет libc или
+    исчерпан лимит наблюдений).
+    """
+    library = ctypes.util.find_library("c")
+    if library is None:
+        return None
+    try:
+        libc = ctypes.CDLL(library, use_errno=True)
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+    if inotify_add_watch(fd, os.fsencode(path), WATCH_MASK) < 0:
+        logging.warning("inotify_add_watch failed: " + os.strerror(ctypes.get_errno()))
+        os.close(fd)
+        return None
+    return fd
+
+
+class ConfigWatcher:
+    """
+    Отслеживание добавления, изменения и удаления конфигов в каталоге.
+
+    На Linux изменения приходят через inotify, в остальных случаях каталог
+    опрашивается раз в poll_interval секунд. В обоих случаях для каждого
+    файла хранится сигнатура (mtime, размер, inode), и заново читается
+    только файл, сигнатура которого изменилась. Событие MODIFIED выдается,
+    только если изменился хэш содержимого.
+    """
+
+    def __init__(
+        self,
+        config_dir: str = "configs",
+        poll_interval: float = 5.0,
+        use_inotify: bool = True,
+    ):
+        """
+        Args:
+            config_dir (str): Каталог с конфигами.
+            poll_interval (float): Период опроса каталога без inotify в секундах.
+            use_inotify (bool): Использовать inotify, если он доступен.
+        """
+        self.config_dir = config_dir
+        self.poll_interval = poll_interval
+        self.configs: Dict[str, Tuple[configparser.ConfigParser, str]] = {}
+        self._signatures: Dict[str, Tuple[int, int, int]] = {}
+        self._fd = _inotify_init(config_dir) if use_inotify else None
+        self._next_scan = 0.0
+        if self._fd is None:
+            logging.info("Watching " + config_dir + " by polling")
+        self._scan()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def fileno(self) -> Optional[int]:
+        """
+        Дескриптор inotify для select и multiprocessing.connection.wait.
+
+        Returns:
+            Optional[int]: Дескриптор или None при опросе каталога.
+        """
+        return self._fd
+
+    def read(self, timeout: Optional[float] = None) -> List[ConfigEvent]:
+        """
+        Ожидает изменений конфигов.
+
+        Args:
+            timeout (Optional[float]): Максимальное время ожидания в секундах,
+                None - ждать до первого изменения.
+
+        Returns:
+            List[ConfigEvent]: События изменений, пустой список по таймауту.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = (
+                None if deadline is None else max(0.0, deadline - time.monotonic())
+            )
+            if self._fd is not None:
+                events = self._read_inotify(remaining)
+            else:
+                events = self._poll(remaining)
+            if events or (remaining is not None and remaining <= 0):
+                return events
+
+    def close(self) -> None:
+        """
+        Закрывает дескриптор inotify.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _read_inotify(self, timeout: Optional[float]) -> List[ConfigEvent]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return []
+
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[
+                offset + INOTIFY_EVENT.size : offset + INOTIFY_EVENT.size + length
+            ]
+            offset += INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Часть событий потеряна, сверяется весь каталог
+                return self._scan()
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                logging.error(
+                    "Config directory " + self.config_dir + " was removed or moved"
+                )
+                self.close()
+                return self._scan()
+            name = os.fsdecode(name.rstrip(b"\0"))
+            if name.endswith(".ini"):
+                names.add(name)
+        return self._check(names)
+
+    def _poll(self, timeout: Optional[float]) -> List[ConfigEvent]:
+        delay = self._next_scan - time.monotonic()
+        if delay > 0:
+            if timeout is not None and timeout < delay:
+                time.sleep(max(0.0, timeout))
+                return []
+            time.sleep(delay)
+        return self._scan()
+
+    def _scan(self) -> List[ConfigEvent]:
+        self._next_scan = time.monotonic() + self.poll_interval
+        try:
+            names = {
+                entry.name
+                for entry in os.scandir(self.config_dir)
+                if entry.name.endswith(".ini")
+            }
+        except FileNotFoundError:
+            names = set()
+        return self._check(names | set(self._signatures))
+
+    def _check(self, names) -> List[ConfigEvent]:
+        events = []
+        for name in sorted(names):
+            path = os.path.join(self.config_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if name in self._signatures:
+                    del self._signatures[name]
+                    del self.configs[name]
+                    events.append(ConfigEvent(DELETED, name, None, None))
+                continue
+            signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if self._signatures.get(name) == signature:
+                continue
+            self._signatures[name] = signature
+
+            config = configparser.ConfigParser()
+            try:
+                config.read(path)
+            except configparser.Error as e:
+                logging.error(f"Config '{name}' is invalid: {e}")
+                continue
+            hash = calculate_hash(config)
+            previous = self.configs.get(name)
+            self.configs[name] = config, hash
+            if previous is None:
+                events.append(ConfigEvent(ADDED, name, config, hash))
+            elif previous[1] != hash:
+                events.append(ConfigEvent(MODIFIED, name, config, hash))
+        return events
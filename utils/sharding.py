@@ -0,0 +1,82 @@
+import bisect
+import hashlib
+from typing import Dict, Hashable, Iterable, List
+
+
+class HashRing:
+    """
+    Консистентное хэширование ключей по узлам.
+
+    Каждый узел занимает на кольце replicas виртуальных точек, ключ
+    принадлежит первому узлу по часовой стрелке от своего хэша. При
+    добавлении или удалении узла переезжают только ключи, попавшие
+    на его точки, остальные остаются на прежних узлах.
+    """
+
+    def __init__(self, nodes: Iterable[Hashable] = (), replicas: int = 100):
+        """
+        Args:
+            nodes (Iterable[Hashable]): Начальные узлы.
+            replicas (int): Количество виртуальных точек на узел.
+        """
+        self.replicas = replicas
+        self._hashes: List[int] = []
+        self._nodes: Dict[int, Hashable] = {}
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # Встроенный hash() для строк различается между процессами
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def add_node(self, node: Hashable) -> None:
+        """
+        Добавляет узел на кольцо.
+
+        Args:
+            node (Hashable): Узел.
+        """
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}#{replica}")
+            if point in self._nodes:
+                continue
+            bisect.insort(self._hashes, point)
+            self._nodes[point] = node
+
+    def remove_node(self, node: Hashable) -> None:
+        """
+        Удаляет узел с кольца.
+
+        Args:
+            node (Hashable): Узел.
+        """
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}#{replica}")
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                self._hashes.pop(bisect.bisect_left(self._hashes, point))
+
+    def node_for(self, key: str) -> Hashable:
+        """
+        Возвращает узел, которому принадлежит ключ.
+
+        Args:
+            key (str): Ключ.
+
+        Returns:
+            Hashable: Узел.
+        """
+        if not self._hashes:
+            raise LookupError("Hash ring has no nodes")
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[self._hashes[index]]
+
+    def nodes(self) -> List[Hashable]:
+        """
+        Возвращает список узлов на кольце.
+
+        Returns:
+            List[Hashable]: Узлы.
+        """
+        return list(dict.fromkeys(self._nodes[point] for point in self._hashes))